@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# доля заполнения очереди, после которой низкоприоритетные апдейты отбрасываются
+UPDATE_SHED_WATERMARK = float(os.getenv("UPDATE_SHED_WATERMARK", "0.5"))
+STATS_INTERVAL = float(os.getenv("UPDATE_STATS_INTERVAL", "60"))
+
+
+# ===================== UPDATE LIMITER (outer middleware на dp.update) =====================
+
+class UpdateLimiter(BaseMiddleware):
+    """
+    Ограничивает одновременную обработку апдейтов.
+
+    Апдейты копятся в очередях по пользователям (не больше queue_size всего) и обрабатываются
+    UPDATE_CONCURRENCY воркерами; апдейты одного пользователя выполняются строго по очереди.
+    Воркер берёт пользователя из списка готовых (ready), выполняет один его апдейт и, если у
+    пользователя есть ещё, возвращает его в конец списка: воркер никогда не ждёт чужой апдейт,
+    поэтому флуд одного пользователя занимает не больше одного воркера, а остальные — по кругу.
+    Polling нужно запускать с handle_as_tasks=False: тогда заполненная очередь тормозит сам
+    getUpdates (backpressure). Низкоприоритетные апдейты (is_low_priority) при заполнении очереди
+    выше порога отбрасываются.
+    """
+
+    def __init__(
+        self,
+        is_low_priority: Callable[[Update], bool],
+        concurrency: int = UPDATE_CONCURRENCY,
+        queue_size: int = UPDATE_QUEUE_SIZE,
+        shed_watermark: float = UPDATE_SHED_WATERMARK,
+    ):
+        self.is_low_priority = is_low_priority
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.shed_at = max(1, int(queue_size * shed_watermark))
+        # пользователь -> его апдейты; ключ есть, пока у пользователя есть апдейты или один выполняется
+        self.users: Dict[int, Deque[Tuple[Callable, Update, Dict[str, Any]]]] = {}
+        # пользователи с апдейтами, которые сейчас никто не выполняет
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(queue_size)
+        self.depth = 0  # апдейтов в очередях (ещё не взятых воркером)
+        self.unfinished = 0  # принятых и ещё не обработанных
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers: List[asyncio.Task] = []
+        self._closed = False
+        # метрики
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self._last_report = time.monotonic()
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.depth,
+            "max_depth": self.max_depth,
+            "users_queued": len(self.users),
+            "in_flight": self.in_flight,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "rejected": self.rejected,
+        }
+
+    @staticmethod
+    def _user_key(event: Update, data: Dict[str, Any]) -> int:
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        chat = data.get("event_chat")
+        return chat.id if chat is not None else 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._closed:
+            self.rejected += 1
+            return None
+        self.start()
+        if self.depth >= self.shed_at and self.is_low_priority(event):
+            self.shed += 1
+            self._maybe_report()
+            return None
+        # место в очереди: при заполнении polling ждёт здесь
+        await self.slots.acquire()
+        if self._closed:
+            self.slots.release()
+            self.rejected += 1
+            return None
+        self.accepted += 1
+        # время ожидания в очереди попадает в трассу хендлера (MetricsMiddleware)
+        data["enqueued_at"] = time.perf_counter()
+        key = self._user_key(event, data)
+        items = self.users.get(key)
+        if items is None:
+            items = self.users[key] = deque()
+            self.ready.put_nowait(key)
+        items.append((handler, event, data))
+        self.depth += 1
+        self.unfinished += 1
+        self._idle.clear()
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        self._maybe_report()
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self.ready.get()
+            items = self.users.get(key)
+            if not items:
+                continue  # очередь пользователя очищена при завершении
+            handler, event, data = items.popleft()
+            self.depth -= 1
+            self.slots.release()
+            self.in_flight += 1
+            try:
+                await handler(event, data)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"[LIMITER] ошибка при обработке апдейта {event.update_id}: {e}")
+            finally:
+                self.in_flight -= 1
+                if items:
+                    # следующий апдейт пользователя — в конец списка готовых, после других пользователей
+                    self.ready.put_nowait(key)
+                elif self.users.get(key) is items:
+                    del self.users[key]
+                self.unfinished -= 1
+                if self.unfinished <= 0:
+                    self._idle.set()
+
+    async def join(self) -> None:
+        """Дождаться обработки всего, что уже в очереди (для бенчмарков/тестов)."""
+        await self._idle.wait()
+
+    async def drain(self, timeout: Optional[float]) -> int:
+        """
+        Завершение: новые апдейты больше не принимаются, принятые обрабатываются в пределах timeout.
+        Возвращает число отброшенных апдейтов.
+        """
+        self._closed = True
+        if self._workers and self.unfinished:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        left = self.in_flight + self.depth
+        for _ in range(self.depth):
+            self.slots.release()
+        self.users.clear()
+        self.depth = 0
+        for t in self._workers:
+            t.cancel()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.unfinished = 0
+        self._idle.set()
+        return left
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < STATS_INTERVAL:
+            return
+        self._last_report = now
+        st = self.stats()
+        if st["shed"] or st["queue_depth"]:
+            logger.info("[LIMITER] " + " ".join(f"{k}={v}" for k, v in st.items()))
@@ -0,0 +1,121 @@
+import re
+import codecs
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# ===================== BAN INDEX =====================
+
+class BanIndex:
+    """
+    In-memory индекс заблокированных (banned.json читается только при старте и после записи другим шардом).
+    Проверка — O(1) по множеству; для /banned поддерживается отсортированный список id-строк:
+    курсорная пагинация и поиск по префиксу id — бинарным поиском, без перебора всего списка.
+    Порядок добавления сохраняется для записи файла.
+    """
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._order: Dict[int, None] = {}
+        self._keys: List[str] = []
+        self.load(ids)
+
+    def load(self, ids: Iterable[int]) -> None:
+        self._order = dict.fromkeys(int(x) for x in ids)
+        self._keys = sorted(str(x) for x in self._order)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._order
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def add(self, uid: int) -> bool:
+        if uid in self._order:
+            return False
+        self._order[uid] = None
+        insort(self._keys, str(uid))
+        return True
+
+    def remove(self, uid: int) -> bool:
+        if uid not in self._order:
+            return False
+        del self._order[uid]
+        key = str(uid)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+        return True
+
+    def to_list(self) -> List[int]:
+        return list(self._order)
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        if not prefix:
+            return 0, len(self._keys)
+        # id состоят из цифр (и «-»), любой символ после них больше — верхняя граница диапазона префикса
+        return bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + "\uffff")
+
+    def page(self, prefix: str = "", after: Optional[str] = None, before: Optional[str] = None,
+             limit: int = 50) -> Tuple[List[str], bool, bool, int]:
+        """
+        Страница id (как строки, по возрастанию) с заданным префиксом: после курсора after или перед before.
+        Возвращает (ids, есть_предыдущая, есть_следующая, всего_с_префиксом).
+        """
+        lo, hi = self._range(prefix)
+        if after is not None:
+            start = bisect_right(self._keys, after, lo, hi)
+            end = min(hi, start + limit)
+        elif before is not None:
+            end = bisect_left(self._keys, before, lo, hi)
+            start = max(lo, end - limit)
+        else:
+            start, end = lo, min(hi, lo + limit)
+        return self._keys[start:end], start > lo, end < hi, hi - lo
+
+    def matching(self, prefix: str = "") -> List[str]:
+        lo, hi = self._range(prefix)
+        return self._keys[lo:hi]
+
+
+# ===================== ID FILE PARSER =====================
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+class IdStreamParser:
+    """
+    Разбор списка id из текстового/CSV-файла по кускам (файл не держится в памяти целиком).
+    Разделители — пробелы, переводы строк, «,» и «;»; кавычки вокруг значения снимаются.
+    Нечисловые значения (заголовок CSV, юзернеймы) считаются пропущенными. Повторы убираются.
+    """
+
+    def __init__(self, max_invalid_samples: int = 5):
+        self.ids: Dict[int, None] = {}
+        self.invalid = 0
+        self.invalid_samples: List[str] = []
+        self.max_invalid_samples = max_invalid_samples
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._tail = ""
+
+    def _token(self, raw: str) -> None:
+        tok = raw.strip("\"'")
+        if not tok:
+            return
+        if tok.isdigit() and len(tok) <= 20:
+            self.ids[int(tok)] = None
+            return
+        self.invalid += 1
+        if len(self.invalid_samples) < self.max_invalid_samples:
+            self.invalid_samples.append(tok[:32])
+
+    def feed(self, chunk: bytes) -> None:
+        parts = _SEPARATORS.split(self._tail + self._decoder.decode(chunk))
+        # последний кусок мог оборваться на середине id — ждёт следующего чанка
+        self._tail = parts.pop()
+        for tok in parts:
+            self._token(tok)
+
+    def close(self) -> List[int]:
+        self._token(self._tail + self._decoder.decode(b"", final=True))
+        self._tail = ""
+        return list(self.ids)
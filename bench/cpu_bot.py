@@ -0,0 +1,27 @@
+import json
+from html import escape
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Message
+
+# Бот-заглушка для shard_bench: только CPU-работа, которую str.py делает на каждый апдейт
+# (разбор pydantic, экранирование HTML, сериализация JSON), без файлового хранилища.
+
+bot = Bot(token="123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+dp = Dispatcher()
+
+
+def _render(user) -> str:
+    header = f"{escape(user.full_name)} @{escape(user.username or '')}\nID: {user.id}\nЯзыки: {escape(user.language_code or '')}"
+    return header + json.dumps(user.model_dump(), ensure_ascii=False, indent=2)
+
+
+@dp.message()
+async def on_message(message: Message):
+    _render(message.from_user)
+    json.dumps(message.model_dump(mode="json", exclude_none=True), ensure_ascii=False, indent=2)
+
+
+@dp.callback_query()
+async def on_callback(callback: CallbackQuery):
+    _render(callback.from_user)
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Фейковый Bot API для нагрузочных тестов без сети. Боты направляются на него через окружение:
+#   TELEGRAM_API_BASE=http://127.0.0.1:8081 python3 str.py   (так же n.py, sup.py, host.py, shard.py)
+# python -m bench.fake_api --port 8081 --latency 0.05 --jitter 0.02 --rate-429 0.01 --retry-after 2 \
+#     --error-rate 0.005 [--drive-token $BOT_TOKEN2 --drive-rate 50 --drive-users 10000]
+# Апдейты для getUpdates кладутся через POST /_control/updates/<token> (JSON-список апдейтов)
+# или встроенным генератором --drive-*; статистика по методам — GET /_control/stats.
+
+logger = logging.getLogger("fake_api")
+
+# методы, на которые отвечаем Message
+_MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendInvoice", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageReplyMarkup", "editMessageMedia",
+}
+# служебные методы: без задержек и инъекций ошибок, иначе ломается сам polling
+_SERVICE_METHODS = {"getMe", "getUpdates", "deleteWebhook", "setWebhook", "getWebhookInfo", "close", "logOut"}
+
+
+def _chat(chat_id: Any) -> Dict[str, Any]:
+    try:
+        cid = int(chat_id)
+    except (TypeError, ValueError):
+        cid = 0
+    if cid > 0:
+        return {"id": cid, "type": "private", "first_name": f"User <{cid}>"}
+    return {"id": cid, "type": "supergroup", "title": "fake", "is_forum": True}
+
+
+def _json_param(value: Any) -> Any:
+    # aiogram/PTB передают сложные поля (media, reply_markup, message_ids) строкой JSON
+    if isinstance(value, str) and value[:1] in "[{":
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+# ===================== UPDATES (getUpdates) =====================
+
+class UpdateFeed:
+    """Очередь апдейтов одного токена с long polling, как у настоящего getUpdates."""
+
+    def __init__(self):
+        self.items: List[Dict[str, Any]] = []
+        self.cond = asyncio.Condition()
+        self._ids = itertools.count(1)
+        self.delivered = 0
+
+    async def push(self, updates: List[Dict[str, Any]]) -> None:
+        async with self.cond:
+            for upd in updates:
+                # update_id монотонен в пределах токена, как у Telegram
+                self.items.append({**upd, "update_id": next(self._ids)})
+            self.cond.notify_all()
+
+    async def get(self, offset: Optional[int], limit: int, timeout: float) -> List[Dict[str, Any]]:
+        async with self.cond:
+            if offset is not None:
+                self.items = [u for u in self.items if u["update_id"] >= offset]
+            if not self.items and timeout > 0:
+                try:
+                    await asyncio.wait_for(self.cond.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self.items[:limit]
+            self.delivered += len(batch)
+            return batch
+
+
+# ===================== SERVER =====================
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.feeds: Dict[str, UpdateFeed] = defaultdict(UpdateFeed)
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._ids = itertools.count(1000)
+        self.started = time.monotonic()
+
+    # ---------- ответы ----------
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        msg = {"message_id": next(self._ids), "date": int(time.time()), "chat": _chat(params.get("chat_id"))}
+        text = params.get("text") or params.get("caption")
+        if isinstance(text, str):
+            msg["text"] = text
+        if params.get("message_thread_id"):
+            msg["message_thread_id"] = int(params["message_thread_id"])
+        return msg
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method == "copyMessage":
+            return {"message_id": next(self._ids)}
+        if method == "copyMessages":
+            return [{"message_id": next(self._ids)} for _ in _json_param(params.get("message_ids")) or []]
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in _json_param(params.get("media")) or []]
+        if method == "createForumTopic":
+            return {"message_thread_id": next(self._ids), "name": params.get("name", ""), "icon_color": 7322096}
+        if method in _MESSAGE_METHODS:
+            return self._message(params)
+        # answerCallbackQuery, refundStarPayment, deleteWebhook, leaveChat, ...
+        return True
+
+    # ---------- HTTP ----------
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        params: Dict[str, Any] = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                # multipart (aiogram) и urlencoded (PTB); файлы не нужны — только поля
+                for key, value in (await request.post()).items():
+                    params[key] = value if isinstance(value, str) else getattr(value, "filename", "")
+        return params
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        token, method = request.match_info["token"], request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            offset = params.get("offset")
+            updates = await self.feeds[token].get(
+                int(offset) if offset not in (None, "") else None,
+                int(params.get("limit") or 100),
+                float(params.get("timeout") or 0),
+            )
+            return web.json_response({"ok": True, "result": updates})
+
+        if method not in _SERVICE_METHODS:
+            delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            roll = self.random.random()
+            if roll < self.rate_429:
+                self.throttled[method] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+            if roll < self.rate_429 + self.error_rate:
+                self.errors[method] += 1
+                return web.json_response({
+                    "ok": False, "error_code": 400, "description": "Bad Request: injected error",
+                }, status=400)
+
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def handle_push(self, request: web.Request) -> web.Response:
+        updates = await request.json()
+        if isinstance(updates, dict):
+            updates = [updates]
+        await self.feeds[request.match_info["token"]].push(updates)
+        return web.json_response({"ok": True, "queued": len(updates)})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(1e-9, time.monotonic() - self.started)
+        return {
+            "uptime": round(elapsed, 1),
+            "calls": dict(self.calls),
+            "throttled_429": dict(self.throttled),
+            "errors": dict(self.errors),
+            "rps": round(sum(self.calls.values()) / elapsed, 1),
+            "pending_updates": {t[:10]: len(f.items) for t, f in self.feeds.items()},
+            "delivered_updates": {t[:10]: f.delivered for t, f in self.feeds.items()},
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/_control/updates/{token}", self.handle_push)
+        app.router.add_get("/_control/stats", self.handle_stats)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+
+# ===================== LOAD DRIVER =====================
+
+async def drive(api: FakeBotAPI, token: str, rate: float, users: int, total: int) -> None:
+    """Кладёт в getUpdates сценарии пользователей из bench.replay с заданной частотой (апдейтов/с)."""
+    from bench.replay import UID_BASE, _flow
+
+    feed = api.feeds[token]
+    pushed = 0
+    idx = 0
+    t0 = time.monotonic()
+    while not total or pushed < total:
+        chain = _flow(UID_BASE + idx % users, idx, 10)
+        idx += 1
+        for upd in chain:
+            await feed.push([upd])
+            pushed += 1
+            # равномерный поток: догоняем расписание, а не спим фиксированно после каждого апдейта
+            ahead = pushed / rate - (time.monotonic() - t0)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+    logger.info(f"[FAKE_API] генератор отправил {pushed} апдейтов")
+
+
+async def _report(api: FakeBotAPI, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        st = api.stats()
+        logger.info(
+            f"[FAKE_API] rps={st['rps']} calls={sum(st['calls'].values())} "
+            f"429={sum(st['throttled_429'].values())} errors={sum(st['errors'].values())} "
+            f"pending={st['pending_updates']}"
+        )
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_429, args.retry_after, args.error_rate, args.seed)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    logger.info(f"[FAKE_API] слушает http://{args.host}:{args.port} (TELEGRAM_API_BASE)")
+    tasks = [asyncio.create_task(_report(api, args.stats_interval))]
+    if args.drive_token:
+        tasks.append(asyncio.create_task(drive(api, args.drive_token, args.drive_rate, args.drive_users, args.drive_total)))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await runner.cleanup()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± разброс задержки, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 (retry_after)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 400")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    parser.add_argument("--drive-token", default=None, help="токен бота, которому генерировать апдейты")
+    parser.add_argument("--drive-rate", type=float, default=20.0, help="апдейтов в секунду")
+    parser.add_argument("--drive-users", type=int, default=1000)
+    parser.add_argument("--drive-total", type=int, default=0, help="0 — бесконечно")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import analytics  # noqa: E402
+from eventlog import EVENT_CODES, EventLog  # noqa: E402
+
+# Время аналитики воронки (analytics.py) на синтетическом журнале событий: пользователи проходят
+# воронку с убыванием на каждом шаге, сегменты пишутся штатным EventLog.
+# python -m bench.funnel --users 1000000 [--langs 8]
+
+DROP = (1.0, 0.7, 0.6, 0.8, 0.7, 0.9)  # доля дошедших до шага от предыдущего
+
+
+def _synth(users: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    uid = np.arange(10_000_000, 10_000_000 + users, dtype=np.int64)
+    t = rng.integers(1_700_000_000, 1_700_000_000 + 30 * 86400, users).astype(np.int64)
+    alive = np.ones(users, bool)
+    cols = []
+    methods = [EVENT_CODES[f"ask_screenshots_{m}"] for m in ("card", "crypto", "stars")]
+    steps = [[EVENT_CODES["send_welcome"]], [EVENT_CODES["process_premium"]], methods,
+             [EVENT_CODES["handle_submission"]], [EVENT_CODES["grantpay"]], [EVENT_CODES["successful_payment"]]]
+    for codes, p in zip(steps, DROP):
+        alive &= rng.random(users) < p
+        t = t + rng.exponential(600, users).astype(np.int64)
+        code = np.asarray(codes, np.uint8)[rng.integers(0, len(codes), users)]
+        cols.append((uid[alive], code[alive], t[alive]))
+    paid = cols[-1]
+    refund = rng.random(len(paid[0])) < 0.02
+    cols.append((paid[0][refund], np.full(refund.sum(), EVENT_CODES["refund"], np.uint8), paid[2][refund] + 3600))
+    return [np.concatenate(c) for c in zip(*cols)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость воронки на синтетическом журнале")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--langs", type=int, default=8)
+    args = parser.parse_args()
+
+    uid, code, ts = _synth(args.users)
+    # события приходят не упорядоченными по пользователю — как в живом журнале
+    order = np.argsort(ts, kind="stable")
+    uid, code, ts = uid[order], code[order], ts[order]
+    requests = {str(u): {"langs": [f"l{u % args.langs}"]} for u in range(10_000_000, 10_000_000 + args.users)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = EventLog(tmp)
+        t0 = time.perf_counter()
+        # запись через штатный буфер, но пачками: поштучный record на миллионах событий меряет Python, а не формат
+        for start in range(0, len(uid), 1 << 16):
+            log.uids.frombytes(uid[start:start + (1 << 16)].tobytes())
+            log.codes.frombytes(code[start:start + (1 << 16)].tobytes())
+            log.epochs.frombytes(ts[start:start + (1 << 16)].astype(np.uint32).tobytes())
+            log.flush()
+        write = time.perf_counter() - t0
+        size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+
+        t0 = time.perf_counter()
+        ev = analytics.load_events(tmp)
+        load = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        table = analytics.lang_table(requests)
+        langs = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        steps = analytics.funnel(ev, analytics.STEPS, table)
+        refunded = analytics.refunds(ev)
+        calc = time.perf_counter() - t0
+
+    print(analytics.format_report(steps, refunded, len(ev)))
+    print(f"\nсобытий {len(ev)}, на диске {size / 1e6:.1f} МБ ({size / max(len(ev), 1):.1f} Б/событие)")
+    print(f"запись {write:.3f}s, чтение+сортировка {load:.3f}s, таблица языков {langs:.3f}s, воронка {calc:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from aiogram.client.session.base import BaseSession
+
+# Фейковая сессия aiogram для бенчмарков: ничего не отправляет в сеть,
+# но строит правдоподобный JSON-ответ и прогоняет его через check_response (как настоящая сессия).
+
+# метка для разбивки вызовов API (например, имя хендлера); задачи, созданные хендлером, наследуют её
+current_tag: ContextVar[str] = ContextVar("bench_tag", default="-")
+
+
+def _chat(chat_id: Any) -> Dict[str, Any]:
+    try:
+        cid = int(chat_id)
+    except (TypeError, ValueError):
+        cid = 0
+    return {"id": cid, "type": "private" if cid > 0 else "supergroup", "title": None if cid > 0 else "bench"}
+
+
+class MockSession(BaseSession):
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.calls_by_tag: Dict[str, Counter] = defaultdict(Counter)
+        self.bytes_sent = 0
+        self._ids = itertools.count(1000)
+
+    def _message(self, method: Any) -> Dict[str, Any]:
+        chat = _chat(getattr(method, "chat_id", None))
+        msg = {"message_id": next(self._ids), "date": int(time.time()), "chat": chat}
+        text = getattr(method, "text", None) or getattr(method, "caption", None)
+        if isinstance(text, str):
+            msg["text"] = text
+        if getattr(method, "message_thread_id", None):
+            msg["message_thread_id"] = method.message_thread_id
+        return msg
+
+    def _result(self, method: Any) -> Any:
+        name = method.__api_method__
+        if name == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if name == "getUpdates":
+            return []
+        if name == "copyMessage":
+            return {"message_id": next(self._ids)}
+        if name == "copyMessages":
+            return [{"message_id": next(self._ids)} for _ in getattr(method, "message_ids", [])]
+        if name == "sendMediaGroup":
+            return [self._message(method) for _ in method.media]
+        if name == "createForumTopic":
+            return {"message_thread_id": next(self._ids), "name": method.name, "icon_color": 0}
+        if name.startswith("send") or name.startswith("edit") or name == "forwardMessage":
+            return self._message(method)
+        return True
+
+    async def make_request(self, bot: Any, method: Any, timeout: Optional[int] = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        self.calls_by_tag[current_tag.get()][method.__api_method__] += 1
+        # размер запроса считаем так же, как его сериализовала бы настоящая сессия
+        try:
+            self.bytes_sent += len(json.dumps(method.model_dump(exclude_none=True), ensure_ascii=False, default=str))
+        except Exception:
+            pass
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = json.dumps({"ok": True, "result": self._result(method)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        if False:
+            yield b""
+
+    async def close(self) -> None:
+        pass
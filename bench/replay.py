@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import logging
+import tempfile
+import multiprocessing as mp
+from collections import defaultdict
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import updates  # noqa: E402
+from bench.mock_session import MockSession, current_tag  # noqa: E402
+
+# Оффлайн-реплей апдейтов через dp.feed_update с MockSession: пропускная способность хендлеров,
+# p50/p95/p99 задержки и число вызовов API на апдейт по каждому хендлеру.
+# python -m bench.replay --users 1000,10000,100000 [--flows 2%] [--bot str] [--latency 0.05]
+# Каждый масштаб — отдельный процесс в чистом temp-каталоге; хранилище заранее заполняется
+# записями на --users пользователей (requests.json, admin_map.json), так что стоимость
+# полной перезаписи JSON растёт вместе с аудиторией, как в проде. Весь сценарий проходит
+# --flows пользователей — доля аудитории («2%») или фиксированное число («200»).
+# Поток одного пользователя: /start -> premium -> pay_* -> текст -> альбом -> ответ админа ->
+# grantpay -> successful_payment. У засеянных пользователей has_seen_instructions=True, чтобы
+# UX-пауза «Подготавливаем оплату» (4–10 с sleep) не подменяла собой измерение.
+# Хранилище — полная перезапись JSON на каждое изменение, поэтому 100k пользователей идут долго
+# (2000 потоков по 100k записей): для быстрой оценки уменьшайте --flows.
+# Долгий прогон на рост памяти и in-memory структур — bench/soak.py.
+
+PAY_METHODS = ["pay_card", "pay_crypto", "pay_stars"]
+HEADER_BASE = 5_000_000  # message_id «шапок» заявок в админ-чате (засеяны в admin_map.json)
+UID_BASE = 10_000_000
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _flow(uid: int, idx: int, album_size: int) -> List[Dict[str, Any]]:
+    return [
+        updates.command(uid, "/start"),
+        updates.callback(uid, "premium"),
+        updates.callback(uid, PAY_METHODS[idx % len(PAY_METHODS)]),
+        updates.text_message(uid),
+        *updates.album(uid, album_size),
+        updates.admin_reply(HEADER_BASE + uid - UID_BASE),
+        updates.admin_decision(uid, "grantpay"),
+        updates.successful_payment(uid),
+    ]
+
+
+def _flow_count(flows: str, users: int) -> int:
+    """--flows: доля аудитории в процентах («2%») или число пользователей («200»)."""
+    flows = flows.strip()
+    if flows.endswith("%"):
+        return max(1, round(users * float(flows[:-1]) / 100))
+    return int(flows)
+
+
+def _seed(users: int) -> None:
+    """Хранилище на `users` пользователей — в формате, который пишет сам бот."""
+    started = "2024-01-01T00:00:00"
+    reqs = {
+        str(UID_BASE + i): {
+            "full_name": f"User <{UID_BASE + i}>", "username": f"user{UID_BASE + i}",
+            "langs": [updates.LANGS[(UID_BASE + i) % len(updates.LANGS)]], "started_at": started,
+            "submitted": False, "has_seen_instructions": True,
+        }
+        for i in range(users)
+    }
+    amap = {f"{updates.ADMIN_CHAT}:{HEADER_BASE + i}": UID_BASE + i for i in range(users)}
+    for name, data in (("requests.json", reqs), ("admin_map.json", amap), ("banned.json", [])):
+        with open(name, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def _workload(users: int, flows: int, album_size: int, batch: int) -> List[Dict[str, Any]]:
+    """Потоки пользователей, равномерно разнесённых по аудитории; внутри пачки шаги чередуются."""
+    step = max(1, users // max(1, flows))
+    chains = [_flow(UID_BASE + (i * step) % users, i, album_size) for i in range(flows)]
+    out = []
+    for start in range(0, len(chains), batch):
+        group = chains[start:start + batch]
+        for pos in range(max(len(c) for c in group)):
+            out.extend(c[pos] for c in group if pos < len(c))
+    return out
+
+
+async def _replay(module_name: str, raw: List[Dict[str, Any]], latency: float) -> Dict[str, Any]:
+    from aiogram.types import Update
+
+    module = importlib.import_module(module_name)
+    dp, bot = module.dp, module.bot
+    session = MockSession(latency=latency)
+    bot.session = session
+
+    async def _refund(user_id: int, telegram_payment_charge_id: str) -> dict:
+        # прямой aiohttp-вызов модуля заменяется учётом в MockSession
+        session.calls["refundStarPayment"] += 1
+        session.calls_by_tag[current_tag.get()]["refundStarPayment"] += 1
+        return {"ok": True, "result": True}
+
+    if hasattr(module, "refund_star_payment"):
+        module.refund_star_payment = _refund
+
+    fed_at: Dict[int, float] = {}
+    done_at: Dict[int, float] = {}
+    service: Dict[str, List[float]] = defaultdict(list)
+
+    async def _timing(handler, event, data):
+        # регистрируется после лимитера — выполняется в его воркере, когда апдейт реально обработан
+        try:
+            return await handler(event, data)
+        finally:
+            done_at[event.update_id] = time.perf_counter()
+
+    async def _tag(handler, event, data):
+        name = data["handler"].callback.__name__
+        token = current_tag.set(name)
+        t = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            service[name].append(time.perf_counter() - t)
+            current_tag.reset(token)
+
+    dp.update.outer_middleware(_timing)
+    for name, observer in dp.observers.items():
+        if name != "update":
+            observer.middleware(_tag)
+
+    token = current_tag.set("startup")
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+    current_tag.reset(token)
+    outbox = getattr(module, "admin_log_outbox", None)
+    if outbox is not None:
+        # воркеры очереди логов стартуют со своей меткой, а не с меткой первого хендлера
+        token = current_tag.set("admin_log_outbox")
+        outbox.start()
+        current_tag.reset(token)
+    limiter = getattr(module, "update_limiter", None)
+
+    parsed = [Update.model_validate(r, context={"bot": bot}) for r in raw]
+    t0 = time.perf_counter()
+    for upd in parsed:
+        fed_at[upd.update_id] = time.perf_counter()
+        await dp.feed_update(bot, upd)
+    if limiter is not None:
+        await limiter.join()
+    elapsed = time.perf_counter() - t0
+
+    # досылка буферов заявок, очередь логов и сохранение — штатным on_shutdown
+    token = current_tag.set("handle_submission")
+    t1 = time.perf_counter()
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+    shutdown = time.perf_counter() - t1
+    current_tag.reset(token)
+
+    return {
+        "updates": len(parsed),
+        "elapsed": elapsed,
+        "shutdown": shutdown,
+        "latencies": sorted(done_at[uid] - t for uid, t in fed_at.items() if uid in done_at),
+        "service": {k: sorted(v) for k, v in service.items()},
+        "calls_by_tag": {k: dict(v) for k, v in session.calls_by_tag.items()},
+        "limiter": limiter.stats() if limiter is not None else None,
+    }
+
+
+def run_scale(module_name: str, users: int, flows: int, album_size: int, batch: int, latency: float) -> Dict[str, Any]:
+    """Выполняется в отдельном процессе: свой cwd, свои модульные кэши бота."""
+    logging.basicConfig(level=logging.WARNING)
+    sys.stdout = open(os.devnull, "w")  # print() в хендлерах бота
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        _seed(users)
+        raw = _workload(users, flows, album_size, batch)
+        return asyncio.run(_replay(module_name, raw, latency))
+
+
+def _print_report(users: int, flows: int, res: Dict[str, Any]) -> None:
+    def ms(vals: List[float]) -> str:
+        return " ".join(f"{_pct(vals, q) * 1000:>8.1f}" for q in (.5, .95, .99))
+
+    total = res["latencies"]
+    busy = sorted(v for vals in res["service"].values() for v in vals)
+    rate = res["updates"] / res["elapsed"] if res["elapsed"] else 0.0
+    print(f"\n== users={users} flows={flows} updates={res['updates']} за {res['elapsed']:.2f}s -> {rate:.0f} upd/s; shutdown={res['shutdown']:.2f}s")
+    # все апдейты подаются разом, поэтому сквозная задержка включает ожидание в очереди лимитера
+    print(f"   p50/p95/p99 ms: хендлер {ms(busy)}; сквозная (с очередью) {ms(total)}")
+    if res["limiter"]:
+        print("   limiter: " + " ".join(f"{k}={v}" for k, v in res["limiter"].items()))
+    print(f"   {'handler':<28} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  API-вызовы на апдейт")
+    for name in sorted(res["service"], key=lambda k: -len(res["service"][k])):
+        vals = res["service"][name]
+        calls = res["calls_by_tag"].get(name, {})
+        per = " ".join(f"{m}={c / len(vals):.2f}" for m, c in sorted(calls.items(), key=lambda x: -x[1])) or "-"
+        print(f"   {name:<28} {len(vals):>6} {ms(vals)}  {per}")
+    for tag in sorted(set(res["calls_by_tag"]) - set(res["service"])):
+        calls = res["calls_by_tag"][tag]
+        print(f"   {tag:<28} {'':>6} {'':>8} {'':>8} {'':>8}  " + " ".join(f"{m}={c}" for m, c in sorted(calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Реплей синтетических апдейтов через dp.feed_update")
+    parser.add_argument("--users", default="1000,10000,100000", help="размеры аудитории через запятую")
+    parser.add_argument("--flows", default="2%", help="сколько пользователей проходят весь сценарий: «2%%» аудитории или число")
+    parser.add_argument("--album", type=int, default=10, help="фото в альбоме")
+    parser.add_argument("--batch", type=int, default=50, help="сколько потоков идут вперемешку")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка MockSession на вызов API, с")
+    parser.add_argument("--bot", default="str")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN2", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", str(updates.ADMIN_CHAT))
+    os.environ.setdefault("ADMINS", str(updates.ADMIN_ID))
+    ctx = mp.get_context("spawn")
+    print(f"bot={args.bot} flows={args.flows} album={args.album} latency={args.latency}s")
+    for users in [int(x) for x in args.users.split(",") if x.strip()]:
+        flows = _flow_count(args.flows, users)
+        with ctx.Pool(1) as pool:
+            res = pool.apply(run_scale, (args.bot, users, flows, args.album, args.batch, args.latency))
+        _print_report(users, flows, res)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import shard  # noqa: E402
+from bench import updates  # noqa: E402
+
+# Масштабирование shard.py по ядрам: одни и те же апдейты прогоняются через 1..N воркеров.
+# python -m bench.shard_bench --workers 1,2,4 --updates 20000 [--bot str]
+# --bot bench.cpu_bot (по умолчанию) — чистая CPU-нагрузка; --bot str — реальные хендлеры с JSON-хранилищем
+# (упирается в storage_lock и полную перезапись requests.json, а не в CPU).
+
+
+def _workload(users: int, total: int) -> list:
+    out = []
+    uid = 10_000_000
+    while len(out) < total:
+        u = uid + (len(out) % users)
+        out.append(updates.command(u, "/start"))
+        out.append(updates.callback(u, "premium"))
+        out.append(updates.text_message(u))
+    return out[:total]
+
+
+def run_once(workers: int, bot_module: str, raw: list, batch: int) -> float:
+    queues, procs = shard.start_workers(workers, bot_module, session_factory="bench.mock_session:MockSession")
+    t0 = time.perf_counter()
+    for i in range(0, len(raw), batch):
+        shard.dispatch(queues, raw[i:i + batch])
+    shard.stop_workers(queues, procs, timeout=600)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк шардирования по user_id")
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4) if n <= (os.cpu_count() or 1)) or "1")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=100, help="размер пачки getUpdates")
+    parser.add_argument("--bot", default="bench.cpu_bot")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN2", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", str(updates.ADMIN_CHAT))
+    raw = _workload(args.users, args.updates)
+    base = None
+    print(f"bot={args.bot} updates={len(raw)} users={args.users} cpus={os.cpu_count()}")
+    print(f"{'workers':>8} {'seconds':>9} {'upd/s':>10} {'speedup':>8}")
+    for n in [int(x) for x in args.workers.split(",") if x.strip()]:
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                elapsed = run_once(n, args.bot, raw, args.batch)
+            finally:
+                os.chdir(cwd)
+        rate = len(raw) / elapsed
+        base = base or rate
+        print(f"{n:>8} {elapsed:>9.2f} {rate:>10.0f} {rate / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import os
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import logging
+import tempfile
+import tracemalloc
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import updates  # noqa: E402
+from bench.mock_session import MockSession  # noqa: E402
+from bench.replay import PAY_METHODS, UID_BASE  # noqa: E402
+
+# Soak-режим реплея: миллионы синтетических пользователей проходят сценарий бота окнами по --window,
+# после каждого окна — затишье (очереди и коллекторы пусты), gc и замер RSS, tracemalloc и длины
+# in-memory структур бота. Рост структуры (в пределах окна) и памяти (между окнами, после обнуления
+# данных) на 1000 пользователей после прогрева сравнивается с бюджетом;
+# превышение — код выхода 1 и топ мест выделения памяти по tracemalloc.
+# python -m bench.soak --bot str --users 1000000 [--window 1000] [--concurrency 200] [--sleep-scale 0.001]
+#     [--budget user_submission_locks=1 --budget rss_kib=2048] [--no-tracemalloc]
+# Файлы хранилища (requests.json, admin_map.json и т.п.), их in-memory копии и индексы (бан-лист,
+# индексы заявок и пользователей, кеши решений, статистика, буфер журнала событий) — данные, а не утечка:
+# их рост меряется в пределах окна, затем они обнуляются, иначе полная перезапись JSON сделала бы
+# прогон квадратичным, а память росла бы на объём данных. Паузы бота (UX-задержки, окно сбора заявки,
+# ожидание альбома) сокращаются в --sleep-scale раз подменой asyncio в модуле бота.
+# Скорость упирается в JSON-хранилище (~20 пользователей/с на ядро для str.py, tracemalloc — ещё в 3–4 раза
+# медленнее), так что миллион пользователей — прогон на ночь; для быстрой проверки — --users 5000 --no-tracemalloc.
+
+PAUSE = None  # шаг сценария: дождаться окна сбора заявки (3 с в масштабе --sleep-scale)
+SUBMIT_WAIT = 3.0
+
+
+class _ScaledAsyncio:
+    """asyncio для модуля бота с укороченным sleep(); остальное — настоящий asyncio."""
+
+    def __init__(self, scale: float):
+        self.scale = scale
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay: float, result: Any = None) -> Any:
+        return await asyncio.sleep(delay * self.scale, result)
+
+
+# ===================== СЦЕНАРИИ И СТРУКТУРЫ =====================
+
+def _str_flow(uid: int, idx: int, album_size: int) -> List[Optional[List[Dict[str, Any]]]]:
+    decision = ("grantpay", "reject", "ban")[idx % 3]
+    steps = [
+        [updates.command(uid, "/start")],
+        [updates.callback(uid, "premium")],
+        [updates.callback(uid, PAY_METHODS[idx % len(PAY_METHODS)])],
+        [updates.text_message(uid)],
+        updates.album(uid, album_size),
+        PAUSE,
+        [updates.admin_decision(uid, decision)],
+    ]
+    if decision == "grantpay":
+        steps.append([updates.successful_payment(uid)])
+    return steps
+
+
+def _j_flow(uid: int, idx: int, album_size: int) -> List[Optional[List[Dict[str, Any]]]]:
+    return [
+        [updates.command(uid, "/start")],
+        [updates.callback(uid, "premium")],
+        [updates.callback(uid, PAY_METHODS[idx % len(PAY_METHODS)])],
+        # апдейты альбома приходят одновременно — AlbumMiddleware склеивает их в одну заявку
+        updates.album(uid, album_size),
+        PAUSE,
+        [updates.admin_decision(uid, "reject")],
+    ]
+
+
+def _fsm_size(m: Any) -> int:
+    # MemoryStorage диспетчера по умолчанию: запись на каждый (бот, чат, пользователь)
+    return len(getattr(m.dp.storage, "storage", ()))
+
+
+def _album_middleware(m: Any) -> Any:
+    for mw in m.dp.message.middleware:
+        if type(mw).__name__ == "AlbumMiddleware":
+            return mw
+    raise RuntimeError("AlbumMiddleware не найден")
+
+
+def _stats_size(m: Any) -> int:
+    stats = m.bot_metrics.stats
+    return len(stats.totals) + sum(len(sk.buckets) for sk in stats.sketches.values())
+
+
+def _reset_stats(m: Any) -> None:
+    stats = m.bot_metrics.stats
+    stats.totals.clear()
+    stats.rolling.clear()
+    stats.sketches.clear()
+
+
+def _reset_n(m: Any) -> None:
+    m.banned_index.load(())
+    _reset_stats(m)
+
+
+def _reset_str(m: Any) -> None:
+    _reset_n(m)
+    m.request_index.load({})
+    m.user_index.load_admin_map({})
+    m.user_index.load_transactions(())
+    m.decided_headers.clear()
+    m.decision_flights.done.clear()
+    m.event_log.flush()
+
+
+_N_STRUCTURES: Dict[str, Callable[[Any], int]] = {
+    "user_submission_locks": lambda m: len(m.user_submission_locks),
+    "fsm_storage": lambda m: _fsm_size(m),
+    "submission_buffers": lambda m: len(m.submission_buffers),
+    "collecting_tasks": lambda m: len(m.collecting_tasks),
+    "inflight_submissions": lambda m: len(m.inflight_submissions),
+    "admin_topics_map": lambda m: len(m.admin_topics_map),
+    "limiter_users": lambda m: len(m.update_limiter.users),
+    "admin_log_queue": lambda m: m.admin_log_outbox.queue.qsize(),
+    # данные хранилища: растут в пределах окна, обнуляются между окнами
+    "admin_message_to_user": lambda m: len(m.admin_message_to_user),
+    "rejected_users": lambda m: len(m.rejected_users),
+    "banned_index": lambda m: len(m.banned_index),
+    "stats": _stats_size,
+}
+
+_STR_STRUCTURES: Dict[str, Callable[[Any], int]] = {
+    **_N_STRUCTURES,
+    "decision_queue": lambda m: m.decision_outbox.queue.qsize(),
+    "decision_inflight": lambda m: len(m.decision_flights.inflight),
+    "request_index": lambda m: len(m.request_index),
+    "user_index_msgs": lambda m: len(m.user_index.admin_msgs),
+    "user_index_tx": lambda m: len(m.user_index.tx_by_charge),
+    "decided_headers": lambda m: len(m.decided_headers),
+    "decision_flights": lambda m: len(m.decision_flights.done),
+    "event_log_buffer": lambda m: len(m.event_log.uids),
+}
+
+BOTS: Dict[str, Dict[str, Any]] = {
+    "str": {
+        "flow": _str_flow,
+        "structures": _STR_STRUCTURES,
+        "files": {"requests.json": {}, "banned.json": [], "admin_map.json": {}, "rejected.json": [], "transactions.json": []},
+        "memory": ("admin_message_to_user", "rejected_users"),
+        "reset": _reset_str,
+    },
+    "n": {
+        "flow": _str_flow,
+        "structures": _N_STRUCTURES,
+        "files": {"requests.json": {}, "banned.json": [], "admin_map.json": {}, "rejected.json": []},
+        "memory": ("admin_message_to_user", "rejected_users"),
+        "reset": _reset_n,
+    },
+    "j": {
+        "flow": _j_flow,
+        "structures": {
+            "user_submission_locks": lambda m: len(m.user_submission_locks),
+            "fsm_storage": lambda m: _fsm_size(m),
+            "album_buffer": lambda m: len(_album_middleware(m)._buffer),
+            "album_locks": lambda m: len(_album_middleware(m)._locks),
+        },
+        "files": {"requests.json": {}},
+        "memory": (),
+    },
+}
+
+
+# ограничены сами по себе (число событий и корзин скетчей, порог сброса журнала) и обнуляются
+# между окнами — их «рост на 1000 пользователей» зависит от --window, поэтому только отчёт
+_UNBUDGETED = ("stats", "event_log_buffer")
+
+
+def default_budgets(bot: str, album_size: int) -> Dict[str, float]:
+    """Допустимый рост на 1000 пользователей после прогрева."""
+    budgets = {name: 1.0 for name in BOTS[bot]["structures"] if name not in _UNBUDGETED}
+    if bot in ("str", "n"):
+        # копии альбома + текст + шапка на каждую заявку; отклонён каждый третий
+        budgets["admin_message_to_user"] = (album_size + 2) * 1000.0
+        # данные хранилища и индексы по ним: не больше одной записи на пользователя
+        for name in ("rejected_users", "banned_index", "request_index", "user_index_msgs", "user_index_tx",
+                     "decision_flights"):
+            if name in budgets:
+                budgets[name] = 1000.0
+        if "decided_headers" in budgets:
+            budgets["decided_headers"] = 2000.0  # шапка и сообщение с нажатой кнопкой на каждое решение
+    # локи и записи FSM освобождаются (keyedlock.py, fsmstore.py); остаток — прогрев (linecache трейсбеков, аллокатор);
+    # RSS выходит на плато после нескольких тысяч пользователей, на коротких прогонах и с tracemalloc — выше
+    budgets["rss_kib"] = 5120.0
+    budgets["traced_kib"] = 1024.0
+    return budgets
+
+
+# ===================== ПРОГОН =====================
+
+def _rss_kib() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def _reset_data(module: Any, spec: Dict[str, Any]) -> None:
+    """Обнуляет файлы хранилища, а если бот уже загружен — и их in-memory копии и индексы."""
+    for name, empty in spec["files"].items():
+        with open(name, "w", encoding="utf-8") as f:
+            json.dump(empty, f)
+    if module is None:
+        return
+    for attr in spec["memory"]:
+        getattr(module, attr).clear()
+    if "reset" in spec:
+        spec["reset"](module)
+
+
+async def _quiesce(module: Any) -> None:
+    """Ждёт, пока бот доделает всё принятое: очередь апдейтов, коллекторы заявок, очередь логов."""
+    limiter = getattr(module, "update_limiter", None)
+    for _ in range(1000):
+        if limiter is not None:
+            await limiter.join()
+        tasks = [t for t in getattr(module, "inflight_submissions", ()) if not t.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            continue
+        outbox = getattr(module, "admin_log_outbox", None)
+        if outbox is not None and outbox.queue.qsize():
+            await asyncio.sleep(0.01)
+            continue
+        if limiter is not None and limiter.depth:
+            continue
+        return
+
+
+async def _soak(bot: str, users: int, window: int, warmup: int, concurrency: int, album_size: int,
+                sleep_scale: float, trace_malloc: bool) -> Dict[str, Any]:
+    from aiogram.types import Update
+
+    spec = BOTS[bot]
+    _reset_data(None, spec)
+    module = importlib.import_module(bot)
+    module.asyncio = _ScaledAsyncio(sleep_scale)
+    module.bot.session = MockSession()
+    if hasattr(module, "refund_star_payment"):
+        async def _refund(user_id: int, telegram_payment_charge_id: str) -> dict:
+            return {"ok": True, "result": True}
+        module.refund_star_payment = _refund
+    if hasattr(module, "on_shutdown"):
+        await module.dp.emit_startup(bot=module.bot, dispatcher=module.dp, bots=[module.bot])
+
+    sem = asyncio.Semaphore(concurrency)
+    pause = SUBMIT_WAIT * sleep_scale * 1.5 + 0.01
+
+    async def feed(raw: Dict[str, Any]) -> None:
+        await module.dp.feed_update(module.bot, Update.model_validate(raw, context={"bot": module.bot}))
+
+    async def chain(idx: int) -> None:
+        async with sem:
+            for step in spec["flow"](UID_BASE + idx, idx, album_size):
+                if step is PAUSE:
+                    await asyncio.sleep(pause)
+                else:
+                    await asyncio.gather(*(feed(raw) for raw in step))
+
+    def sample(done: int) -> Dict[str, Any]:
+        gc.collect()
+        row = {"users": done, "rss_kib": _rss_kib(), "traced_kib": None, "t": time.perf_counter()}
+        if trace_malloc:
+            row["traced_kib"] = tracemalloc.get_traced_memory()[0] / 1024
+            if row["rss_kib"] is not None:
+                # собственные структуры tracemalloc (по трассе на каждый живой блок) — не рост бота
+                row["rss_kib"] -= tracemalloc.get_tracemalloc_memory() // 1024
+        for name, fn in spec["structures"].items():
+            row[name] = fn(module)
+        return row
+
+    if trace_malloc:
+        tracemalloc.start()
+    rows: List[Dict[str, Any]] = []
+    growth: Dict[str, float] = {}
+    grown_users = 0
+    snapshot = None
+    done = 0
+    t0 = time.perf_counter()
+    start = sample(done)
+    while done < users:
+        n = min(window, users - done)
+        await asyncio.gather(*(chain(done + i) for i in range(n)))
+        await _quiesce(module)
+        done += n
+        end = sample(done)
+        rows.append(end)
+        print(
+            f"  users={done:>9} {n / max(1e-9, end['t'] - start['t']):>7.0f} users/s rss={(end['rss_kib'] or 0) / 1024:.1f}MiB "
+            + (f"traced={end['traced_kib'] / 1024:.1f}MiB " if end["traced_kib"] is not None else "")
+            + " ".join(f"{k}={end[k]}" for k in spec["structures"]),
+            file=sys.stderr, flush=True,
+        )
+        _reset_data(module, spec)
+        # память — между точками после обнуления данных: в пределах окна её рост — это сами данные
+        after = sample(done)
+        if len(rows) == warmup and trace_malloc:
+            snapshot = tracemalloc.take_snapshot()
+        if len(rows) > warmup:
+            grown_users += n
+            spans = [(key, end) for key in spec["structures"]] + [(key, after) for key in ("rss_kib", "traced_kib")]
+            for key, last in spans:
+                if last[key] is not None and start[key] is not None:
+                    growth[key] = growth.get(key, 0.0) + last[key] - start[key]
+        start = after
+
+    top: List[str] = []
+    if snapshot is not None:
+        diff = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        top = [str(stat) for stat in diff[:10]]
+        tracemalloc.stop()
+    if hasattr(module, "on_shutdown"):
+        await module.dp.emit_shutdown(bot=module.bot, dispatcher=module.dp, bots=[module.bot])
+    return {
+        "rows": rows,
+        "per_1000": {k: v * 1000 / grown_users for k, v in growth.items()} if grown_users else {},
+        "elapsed": time.perf_counter() - t0,
+        "top": top,
+    }
+
+
+def run_soak(bot: str, *args: Any) -> Dict[str, Any]:
+    """Выполняется в отдельном процессе в чистом temp-каталоге."""
+    logging.basicConfig(level=logging.WARNING)
+    # tracemalloc замедляет всё в разы — предупреждения монитора лага здесь шум
+    logging.getLogger("loopmon").setLevel(logging.ERROR)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")  # print() в хендлерах бота
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            return asyncio.run(_soak(bot, *args))
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-тест: рост памяти и структур бота на миллионах пользователей")
+    parser.add_argument("--bot", default="str", help=f"из: {', '.join(BOTS)}")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--window", type=int, default=1000, help="пользователей между замерами (и обнулениями хранилища)")
+    parser.add_argument("--warmup", type=int, default=2, help="окон прогрева без учёта роста")
+    parser.add_argument("--concurrency", type=int, default=200, help="пользователей одновременно")
+    parser.add_argument("--album", type=int, default=3)
+    parser.add_argument("--sleep-scale", type=float, default=0.001, help="множитель пауз asyncio.sleep бота")
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=PER_1000",
+                        help="рост на 1000 пользователей (структуры — элементы, rss_kib/traced_kib — КиБ)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="без tracemalloc (быстрее, только RSS)")
+    args = parser.parse_args()
+
+    budgets = default_budgets(args.bot, args.album)
+    for item in args.budget:
+        name, _, value = item.partition("=")
+        budgets[name.strip()] = float(value)
+
+    os.environ.setdefault("BOT_TOKEN2", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", str(updates.ADMIN_CHAT))
+    os.environ.setdefault("ADMINS", str(updates.ADMIN_ID))
+    print(f"bot={args.bot} users={args.users} window={args.window} concurrency={args.concurrency} album={args.album}")
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        res = pool.apply(run_soak, (
+            args.bot, args.users, args.window, args.warmup, args.concurrency, args.album,
+            args.sleep_scale, not args.no_tracemalloc,
+        ))
+
+    if not res["per_1000"]:
+        print(f"\nнужно больше {args.warmup} окон прогрева для оценки роста")
+        sys.exit(2)
+    failed = []
+    print(f"\n== {res['elapsed']:.0f}s; рост на 1000 пользователей после прогрева:")
+    print(f"   {'structure':<24} {'growth':>12} {'budget':>10}")
+    for name, value in sorted(res["per_1000"].items()):
+        budget = budgets.get(name)
+        ok = budget is None or value <= budget
+        if not ok:
+            failed.append(name)
+        print(f"   {name:<24} {value:>12.1f} {'-' if budget is None else f'{budget:.1f}':>10}  {'ok' if ok else 'FAIL'}")
+    if failed:
+        print(f"\nFAIL: {', '.join(failed)}")
+        if res["top"]:
+            print("рост выделений с конца прогрева (tracemalloc):")
+            for line in res["top"]:
+                print(f"   {line}")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
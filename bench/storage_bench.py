@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import logging
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing as mp
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import updates  # noqa: E402
+
+# Микробенчмарки хранилища бота в зависимости от объёма данных (1k -> 1M записей):
+# время операции (медиана), байт записано за операцию и пиковая память Python (tracemalloc).
+# python -m bench.storage_bench [--sizes 1000,10000,100000,1000000] [--repeat 5] [--backend json]
+#     [--out results.json] [--baseline prev.json]
+# --out сохраняет результаты, --baseline сравнивает с прошлым прогоном на той же машине (x<1 — быстрее).
+# Новое хранилище добавляется классом в BACKENDS с теми же именами операций — тогда оно
+# измеряется рядом с текущим JSON-хранилищем.
+
+UID_BASE = 10_000_000
+
+
+def _written_bytes() -> Optional[int]:
+    # wchar — байты, переданные в write() этим процессом (Linux)
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _dump(path: str, data: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+# ===================== BACKENDS =====================
+
+class JsonStorage:
+    """Текущее хранилище str.py: JSON-файлы, каждое изменение — полная перезапись файла."""
+
+    name = "json"
+
+    def seed(self, size: int) -> None:
+        started = datetime.now().isoformat()
+        created = datetime.now(timezone.utc).isoformat()
+        _dump("requests.json", {
+            str(UID_BASE + i): {
+                "full_name": f"User <{UID_BASE + i}>", "username": f"user{UID_BASE + i}",
+                "langs": [updates.LANGS[i % len(updates.LANGS)]], "started_at": started,
+                "submitted": bool(i % 2), "has_seen_instructions": True,
+            }
+            for i in range(size)
+        })
+        _dump("admin_map.json", {f"{updates.ADMIN_CHAT}:{i + 1}": UID_BASE + i for i in range(size)})
+        _dump("transactions.json", [
+            {
+                "user_id": UID_BASE + i, "telegram_payment_charge_id": f"stxSEED{i}", "payload": f"uid::{UID_BASE + i}",
+                "amount": 100, "currency": "XTR", "refunded": True, "created_at": created, "refunded_at": created,
+            }
+            for i in range(size)
+        ])
+
+    def ops(self, module: Any, size: int) -> Dict[str, Callable[[int], Any]]:
+        data = module.load_requests()
+        created = datetime.now(timezone.utc).isoformat()
+        day_ago = (datetime.now() - timedelta(days=1)).isoformat()
+        # операции с astorage_lock — корутины; один loop на все вызовы, чтобы не мерить его создание
+        run = asyncio.new_event_loop().run_until_complete
+        return {
+            "load_requests": lambda i: module.load_requests(),
+            # запросы к заявкам: вторичный индекс (reqindex.py) против перебора файла
+            "requests_by_lang": lambda i: module.request_index.with_lang("ru"),
+            "requests_by_lang_scan": lambda i: [k for k, r in module.load_requests().items() if "ru" in (r.get("langs") or ())],
+            "requests_started_24h": lambda i: module.request_index.count_started(since=day_ago),
+            "request_by_username": lambda i: module.request_index.by_username(f"user{UID_BASE + (i * 7919) % size}"),
+            "save_requests": lambda i: module.save_requests(data),
+            "update_user_lang": lambda i: run(module.update_user_lang(str(UID_BASE + (i * 7919) % size), "ru")),
+            "set_admin_map": lambda i: run(module.set_admin_map(updates.ADMIN_CHAT, size + i + 1, UID_BASE + i)),
+            "_save_transaction_sync": lambda i: module._save_transaction_sync({
+                "user_id": UID_BASE + i, "telegram_payment_charge_id": f"stxBENCH{i}", "payload": f"uid::{UID_BASE + i}",
+                "amount": 100, "currency": "XTR", "refunded": False, "created_at": created, "refunded_at": None,
+            }),
+        }
+
+
+BACKENDS = {cls.name: cls for cls in (JsonStorage,)}
+
+
+# ===================== RUN =====================
+
+def measure(fn: Callable[[int], Any], repeat: int) -> Dict[str, Any]:
+    times = []
+    written = []
+    for i in range(repeat):
+        before = _written_bytes()
+        t0 = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - t0)
+        after = _written_bytes()
+        if before is not None and after is not None:
+            written.append(after - before)
+    # отдельный проход под tracemalloc: он сам замедляет код, время здесь не учитываем
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn(repeat)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {
+        "ms": statistics.median(times) * 1000,
+        "bytes": int(statistics.median(written)) if written else None,
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_size(backend_name: str, module_name: str, size: int, repeat: int) -> List[Dict[str, Any]]:
+    """Выполняется в отдельном процессе: чистый cwd и свежие модульные кэши бота."""
+    logging.basicConfig(level=logging.WARNING)
+    backend = BACKENDS[backend_name]()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        backend.seed(size)
+        # in-memory карты (admin_map и т.п.) бот читает при импорте — импортируем после засева
+        module = importlib.import_module(module_name)
+        rows = []
+        for op, fn in backend.ops(module, size).items():
+            rows.append({"backend": backend_name, "size": size, "op": op, **measure(fn, repeat)})
+        return rows
+
+
+def _fmt_bytes(n: Optional[int]) -> str:
+    if n is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024 or unit == "GiB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование хранилища бота по числу записей")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backend", default=",".join(BACKENDS), help=f"из: {', '.join(BACKENDS)}")
+    parser.add_argument("--bot", default="str")
+    parser.add_argument("--out", default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN2", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ.setdefault("ADMIN_CHAT_ID", str(updates.ADMIN_CHAT))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {(r["backend"], r["size"], r["op"]): r for r in json.load(f)}
+
+    ctx = mp.get_context("spawn")
+    rows: List[Dict[str, Any]] = []
+    print(f"{'backend':<8} {'size':>8} {'op':<24} {'ms':>10} {'written/op':>11} {'peak mem':>10} {'vs base':>8}")
+    for backend in [b.strip() for b in args.backend.split(",") if b.strip()]:
+        for size in [int(x) for x in args.sizes.split(",") if x.strip()]:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_size, (backend, args.bot, size, args.repeat))
+            for r in result:
+                base = baseline.get((r["backend"], r["size"], r["op"]))
+                ratio = f"x{r['ms'] / base['ms']:.2f}" if base and base["ms"] else "-"
+                print(
+                    f"{r['backend']:<8} {r['size']:>8} {r['op']:<24} {r['ms']:>10.2f} "
+                    f"{_fmt_bytes(r['bytes']):>11} {_fmt_bytes(int(r['peak_kib'] * 1024)):>10} {ratio:>8}"
+                )
+            rows.extend(result)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import time
+import itertools
+from typing import Any, Dict, List
+
+# Генераторы синтетических апдейтов в формате Bot API (dict, как из getUpdates).
+
+ADMIN_CHAT = -1001000000001
+ADMIN_ID = 777000111
+LANGS = ["ru", "en", "uk", "es", "de", "tr"]
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def user(uid: int) -> Dict[str, Any]:
+    return {
+        "id": uid, "is_bot": False, "first_name": f"User <{uid}>", "username": f"user{uid}",
+        "language_code": LANGS[uid % len(LANGS)],
+    }
+
+
+def _chat(uid: int) -> Dict[str, Any]:
+    if uid < 0:
+        return {"id": uid, "type": "supergroup", "title": "admins", "is_forum": True}
+    return {"id": uid, "type": "private", "first_name": f"User <{uid}>", "username": f"user{uid}"}
+
+
+def _message(uid: int, chat_id: int = None, **fields: Any) -> Dict[str, Any]:
+    chat_id = uid if chat_id is None else chat_id
+    msg = {"message_id": next(_message_ids), "date": int(time.time()), "chat": _chat(chat_id), "from": user(uid)}
+    msg.update(fields)
+    return msg
+
+
+def _update(**fields: Any) -> Dict[str, Any]:
+    return {"update_id": next(_update_ids), **fields}
+
+
+def command(uid: int, text: str = "/start") -> Dict[str, Any]:
+    cmd_len = len(text.split()[0])
+    return _update(message=_message(uid, text=text, entities=[{"type": "bot_command", "offset": 0, "length": cmd_len}]))
+
+
+def text_message(uid: int, text: str = "скриншот прикреплю позже") -> Dict[str, Any]:
+    return _update(message=_message(uid, text=text))
+
+
+def photo(uid: int, media_group_id: str = None) -> Dict[str, Any]:
+    fid = f"AgAC{uid}{next(_message_ids)}"
+    fields = {"photo": [{"file_id": fid, "file_unique_id": fid[-12:], "width": 1280, "height": 720, "file_size": 120000}]}
+    if media_group_id:
+        fields["media_group_id"] = media_group_id
+    return _update(message=_message(uid, **fields))
+
+
+def album(uid: int, size: int = 10) -> List[Dict[str, Any]]:
+    gid = f"{uid}{next(_message_ids)}"
+    return [photo(uid, gid) for _ in range(size)]
+
+
+def callback(uid: int, data: str, chat_id: int = None) -> Dict[str, Any]:
+    chat_id = uid if chat_id is None else chat_id
+    msg = {"message_id": next(_message_ids), "date": int(time.time()), "chat": _chat(chat_id), "text": "menu"}
+    return _update(callback_query={
+        "id": str(next(_update_ids)), "from": user(uid), "chat_instance": str(chat_id), "data": data, "message": msg,
+    })
+
+
+def admin_decision(target_uid: int, decision: str = "reject", admin_id: int = ADMIN_ID, chat_id: int = ADMIN_CHAT) -> Dict[str, Any]:
+    return callback(admin_id, f"{decision}_{target_uid}", chat_id=chat_id)
+
+
+def admin_reply(reply_to_message_id: int, admin_id: int = ADMIN_ID, chat_id: int = ADMIN_CHAT) -> Dict[str, Any]:
+    replied = {"message_id": reply_to_message_id, "date": int(time.time()), "chat": _chat(chat_id), "text": "header"}
+    return _update(message=_message(admin_id, chat_id=chat_id, text="Ответ администратора", reply_to_message=replied))
+
+
+def successful_payment(uid: int, amount: int = 100) -> Dict[str, Any]:
+    charge = f"stxBENCH{uid}_{next(_update_ids)}"
+    return _update(message=_message(uid, successful_payment={
+        "currency": "XTR", "total_amount": amount, "invoice_payload": f"uid::{uid}",
+        "telegram_payment_charge_id": charge, "provider_payment_charge_id": "",
+    }))
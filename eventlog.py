@@ -0,0 +1,156 @@
+import os
+import glob
+import time
+import struct
+import logging
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Журнал шагов воронки для аналитики (analytics.py): каждое событие — (user_id, код шага, epoch).
+# Хранение колоночное: события копятся в трёх array.array и сбрасываются блоком
+# [заголовок][user_id int64 x n][code uint8 x n][epoch uint32 x n] в конец текущего сегмента;
+# сегмент закрывается после EVENTLOG_SEGMENT событий. Читатель отдаёт колонки блоков как есть,
+# NumPy собирает их через frombuffer без разбора строк. Писателю NumPy не нужен.
+# В шардированном режиме у каждого шарда свои сегменты (префикс s<N>-), читатель берёт все.
+
+EVENTLOG_DIR = os.getenv("EVENTLOG_DIR", "events")
+EVENTLOG_SEGMENT = int(os.getenv("EVENTLOG_SEGMENT", "1000000"))  # событий на файл сегмента
+EVENTLOG_FLUSH_EVENTS = int(os.getenv("EVENTLOG_FLUSH_EVENTS", "4096"))
+EVENTLOG_FLUSH_SECONDS = float(os.getenv("EVENTLOG_FLUSH_SECONDS", "60"))
+
+# коды шагов: только дописывать в конец — номер кода хранится в файлах
+EVENTS = (
+    "send_welcome",
+    "process_premium",
+    "ask_screenshots_card",
+    "ask_screenshots_crypto",
+    "ask_screenshots_stars",
+    "handle_submission",
+    "grantpay",
+    "successful_payment",
+    "refund",
+)
+EVENT_CODES = {name: code for code, name in enumerate(EVENTS)}
+
+_MAGIC = b"EVB1"
+_HEADER = struct.Struct("<4sI")  # магия, число событий в блоке
+_EVENT_BYTES = 8 + 1 + 4
+
+Columns = Tuple[bytes, bytes, bytes]
+
+
+def _shard_prefix() -> str:
+    shard = os.getenv("SHARD_INDEX")
+    if shard is not None and int(os.getenv("SHARD_COUNT", "1")) > 1:
+        return f"s{shard}-"
+    return ""
+
+
+# ===================== WRITER =====================
+
+class EventLog:
+    def __init__(self, path: str = EVENTLOG_DIR, segment_events: int = EVENTLOG_SEGMENT):
+        self.path = path
+        self.segment_events = segment_events
+        self.prefix = _shard_prefix()
+        self.uids = array("q")
+        self.codes = array("B")
+        self.epochs = array("I")
+        self.recorded = 0
+        self._flushed_at = time.monotonic()
+        self._segment: Optional[str] = None
+        self._segment_no = 0
+        self._segment_count = 0
+
+    def record(self, user_id: int, event: str, ts: Optional[float] = None) -> None:
+        code = EVENT_CODES.get(event)
+        if code is None:
+            logger.warning(f"Неизвестное событие журнала: {event}")
+            return
+        self.uids.append(int(user_id))
+        self.codes.append(code)
+        self.epochs.append(int(time.time() if ts is None else ts))
+        self.recorded += 1
+        if len(self.uids) >= EVENTLOG_FLUSH_EVENTS or time.monotonic() - self._flushed_at >= EVENTLOG_FLUSH_SECONDS:
+            self.flush()
+
+    def _segment_path(self, n: int) -> str:
+        return os.path.join(self.path, f"{self.prefix}{n:08d}.evl")
+
+    def _open_segment(self) -> str:
+        if self._segment is None:
+            # после перезапуска дописываем последний сегмент, пока в нём есть место
+            existing = glob.glob(os.path.join(self.path, f"{self.prefix}[0-9]*.evl"))
+            nums = [int(os.path.basename(p)[len(self.prefix):-4]) for p in existing]
+            self._segment_no = max(nums, default=1)
+            self._segment = self._segment_path(self._segment_no)
+            self._segment_count, valid = 0, 0
+            for n, offset in (_scan(self._segment) if nums else ()):
+                self._segment_count += n
+                valid = offset + n * _EVENT_BYTES
+            if nums and os.path.getsize(self._segment) > valid:
+                # оборванный при аварийной остановке блок: иначе всё дописанное после него не прочитается
+                with open(self._segment, "r+b") as f:
+                    f.truncate(valid)
+        if self._segment_count >= self.segment_events:
+            self._segment_no += 1
+            self._segment = self._segment_path(self._segment_no)
+            self._segment_count = 0
+        return self._segment
+
+    def flush(self) -> None:
+        self._flushed_at = time.monotonic()
+        n = len(self.uids)
+        if not n:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            path = self._open_segment()
+            with open(path, "ab") as f:
+                f.write(_HEADER.pack(_MAGIC, n))
+                f.write(self.uids.tobytes())
+                f.write(self.codes.tobytes())
+                f.write(self.epochs.tobytes())
+            self._segment_count += n
+        except Exception as e:
+            # события остаются в буфере до следующей попытки
+            logger.warning(f"Не удалось записать журнал событий в {self.path}: {e}")
+            return
+        self.uids = array("q")
+        self.codes = array("B")
+        self.epochs = array("I")
+
+    def stats(self) -> Dict[str, int]:
+        return {"recorded": self.recorded, "buffered": len(self.uids)}
+
+
+# ===================== READER =====================
+
+def _scan(path: str) -> Iterator[Tuple[int, int]]:
+    """(число событий, смещение данных) по блокам сегмента; оборванный хвост пропускается."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        pos = 0
+        while pos + _HEADER.size <= size:
+            f.seek(pos)
+            magic, n = _HEADER.unpack(f.read(_HEADER.size))
+            end = pos + _HEADER.size + n * _EVENT_BYTES
+            if magic != _MAGIC or end > size:
+                logger.warning(f"{path}: повреждённый блок на смещении {pos}, дальше не читаем")
+                return
+            yield n, pos + _HEADER.size
+            pos = end
+
+
+def read_blocks(path: str = EVENTLOG_DIR) -> Iterator[Columns]:
+    """Сырые колонки (user_id, code, epoch) каждого блока всех сегментов."""
+    for seg in sorted(glob.glob(os.path.join(path, "*.evl"))):
+        try:
+            with open(seg, "rb") as f:
+                for n, offset in list(_scan(seg)):
+                    f.seek(offset)
+                    yield f.read(8 * n), f.read(n), f.read(4 * n)
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать {seg}: {e}")
@@ -0,0 +1,40 @@
+from copy import copy
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+# FSMContextMiddleware читает состояние на каждом апдейте, а MemoryStorage (defaultdict) при чтении
+# создаёт запись — пустая запись на каждого пользователя остаётся до перезапуска.
+# Здесь чтение записей не создаёт, а запись без состояния и данных (state.clear(), отправленная
+# заявка, бан) удаляется.
+
+
+class CompactMemoryStorage(MemoryStorage):
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            self.storage.pop(key, None)
+            return
+        record = self.storage[key]
+        record.state, record.data = state, data
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self.storage.get(key) or MemoryStorageRecord()
+        self._put(key, state.state if isinstance(state, State) else state, record.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self.storage.get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await super().set_data(key, data)  # проверка типа data
+        self._put(key, self.storage[key].state, self.storage[key].data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self.storage.get(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Any = None) -> Any:
+        record = self.storage.get(storage_key)
+        return copy(record.data.get(dict_key, default)) if record else default
@@ -18,8 +18,9 @@ async def start_handler(message: Message):
 async def on_startup():
     print("Бот запущен!!")
 
+dp.startup.register(on_startup)
+
 async def main():
-    dp.startup.register(on_startup)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+import os
+import sys
+import signal
+import asyncio
+import logging
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.dispatcher.event.event import EventObserver
+
+from logsetup import setup_logging
+from metrics import REGISTRY, start_server as start_metrics_server, stop_server as stop_metrics_server
+from supervisor import notify_ready
+
+# Хост: несколько ботов в одном процессе и одном event loop.
+# Запуск: python3 host.py [str sup g ...]  (по умолчанию — HOST_BOTS или str,sup)
+# aiogram-боты (модули с bot/dp) делят одну aiohttp-сессию (пул соединений),
+# PTB-бот из sup.py (build_application) работает со своим httpx-клиентом — общий пул у него не поддерживается.
+# Все боты делят executor для asyncio.to_thread (файловое хранилище) и счётчики HostStats.
+
+logger = logging.getLogger("host")
+
+STORAGE_WORKERS = int(os.getenv("HOST_STORAGE_WORKERS", "4"))
+POOL_LIMIT = int(os.getenv("HOST_POOL_LIMIT", "100"))
+STATS_INTERVAL = float(os.getenv("HOST_STATS_INTERVAL", "60"))
+RESTART_DELAY = float(os.getenv("HOST_RESTART_DELAY", "5"))
+
+
+# ===================== METRICS =====================
+
+class HostStats:
+    def __init__(self):
+        self.updates: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def update(self, name: str) -> None:
+        self.updates[name] = self.updates.get(name, 0) + 1
+
+    def error(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> str:
+        names = sorted(set(self.updates) | set(self.errors))
+        return ", ".join(f"{n}: updates={self.updates.get(n, 0)} errors={self.errors.get(n, 0)}" for n in names) or "-"
+
+    def register(self) -> None:
+        """Экспорт в /metrics (в т.ч. для PTB-ботов, у которых нет aiogram-middleware)."""
+        REGISTRY.collect("host_updates_total", "counter", "Апдейты по ботам хоста", ("bot",),
+                         lambda: {(n,): v for n, v in self.updates.items()})
+        REGISTRY.collect("host_errors_total", "counter", "Ошибки по ботам хоста", ("bot",),
+                         lambda: {(n,): v for n, v in self.errors.items()})
+
+
+# ===================== BOT ADAPTERS =====================
+
+class AiogramBot:
+    """Модуль с module-level bot/dp (str.py, n.py, g.py)."""
+
+    def __init__(self, name: str, module: Any, session: AiohttpSession, stats: HostStats):
+        self.name = name
+        self.module = module
+        self.stats = stats
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+        # общий пул соединений; собственная сессия модуля ещё не открыта (aiohttp создаётся лениво).
+        # адрес Bot API (TELEGRAM_API_BASE) берём у модуля — он одинаков для всех ботов хоста
+        session.api = module.bot.session.api
+        module.bot.session = session
+        # учёт вызовов API модуля (ApiCallMetrics фильтрует по токену — сессия общая)
+        if hasattr(module, "api_metrics"):
+            session.middleware(module.api_metrics)
+        module.dp.update.outer_middleware(self._guard)
+        # start_polling вызывает startup/shutdown-хуки на каждом запуске, а _run перезапускает polling
+        # после падения: хуки модуля (закрытие очередей, фоновые задачи) забираем и вызываем сами —
+        # один раз при start() и один раз при stop()
+        self.startup, self.shutdown = EventObserver(), EventObserver()
+        self.startup.handlers, module.dp.startup.handlers = module.dp.startup.handlers, []
+        self.shutdown.handlers, module.dp.shutdown.handlers = module.dp.shutdown.handlers, []
+
+    def _hook_kwargs(self) -> Dict[str, Any]:
+        dp, bot = self.module.dp, self.module.bot
+        return {"dispatcher": dp, "bots": [bot], **dp.workflow_data,
+                **getattr(self.module, "POLLING_KWARGS", {}), "bot": bot}
+
+    async def _guard(self, handler, event, data):
+        self.stats.update(self.name)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            # ошибка хендлера одного бота не должна влиять на остальных
+            self.stats.error(self.name)
+            logger.exception(f"[HOST:{self.name}] ошибка при обработке апдейта: {e}")
+            return None
+
+    async def _run(self) -> None:
+        while not self.stopping:
+            try:
+                await self.module.dp.start_polling(
+                    self.module.bot, handle_signals=False, close_bot_session=False,
+                    **getattr(self.module, "POLLING_KWARGS", {}),
+                )
+            except Exception as e:
+                self.stats.error(self.name)
+                logger.exception(f"[HOST:{self.name}] polling упал: {e}")
+            if not self.stopping:
+                logger.warning(f"[HOST:{self.name}] перезапуск polling через {RESTART_DELAY:.0f}s")
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def start(self) -> None:
+        await self.startup.trigger(**self._hook_kwargs())
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.stopping = True
+        try:
+            await self.module.dp.stop_polling()
+        except RuntimeError:
+            pass
+        if self.task:
+            await asyncio.gather(self.task, return_exceptions=True)
+        # shutdown-хуки модуля (on_shutdown) — только при настоящей остановке
+        await self.shutdown.trigger(**self._hook_kwargs())
+
+
+class PTBBot:
+    """Модуль с build_application() (sup.py, python-telegram-bot)."""
+
+    def __init__(self, name: str, module: Any, stats: HostStats):
+        self.name = name
+        self.module = module
+        self.stats = stats
+        self.app = None
+
+    async def _count(self, update, context) -> None:
+        self.stats.update(self.name)
+
+    async def _on_error(self, update, context) -> None:
+        self.stats.error(self.name)
+        logger.error(f"[HOST:{self.name}] ошибка при обработке апдейта: {context.error!r}")
+
+    async def start(self) -> None:
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        self.app = self.module.build_application()
+        self.app.add_handler(TypeHandler(Update, self._count), group=-1)
+        self.app.add_error_handler(self._on_error)
+        await self.app.initialize()
+        await self.app.start()
+        await self.app.updater.start_polling()
+        notify_ready()
+
+    async def stop(self) -> None:
+        if not self.app:
+            return
+        try:
+            if self.app.updater.running:
+                await self.app.updater.stop()
+            if self.app.running:
+                await self.app.stop()
+            await self.app.shutdown()
+        except Exception as e:
+            logger.warning(f"[HOST:{self.name}] ошибка при остановке: {e}")
+
+
+# ===================== HOST =====================
+
+def load_bots(names: List[str], session: AiohttpSession, stats: HostStats) -> list:
+    bots = []
+    tokens = {}
+    for name in names:
+        try:
+            module = importlib.import_module(name)
+        except Exception as e:
+            logger.error(f"[HOST] не удалось загрузить {name}: {e}")
+            continue
+        if hasattr(module, "build_application"):
+            bots.append(PTBBot(name, module, stats))
+        elif hasattr(module, "dp") and hasattr(module, "bot"):
+            token = module.bot.token
+            if token in tokens:
+                # один токен нельзя поллить дважды (конфликт getUpdates)
+                logger.error(f"[HOST] {name} использует тот же токен, что и {tokens[token]} — пропущен")
+                continue
+            tokens[token] = name
+            bots.append(AiogramBot(name, module, session, stats))
+        else:
+            logger.error(f"[HOST] {name}: нет ни bot/dp, ни build_application — пропущен")
+    return bots
+
+
+async def _report_stats(stats: HostStats, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=STATS_INTERVAL)
+        except asyncio.TimeoutError:
+            logger.info(f"[HOST] {stats.summary()}")
+
+
+async def run(names: List[str]) -> None:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+    loop.set_default_executor(executor)
+    session = AiohttpSession(limit=POOL_LIMIT)
+    stats = HostStats()
+    stats.register()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    bots = load_bots(names, session, stats)
+    if not bots:
+        raise RuntimeError("Нет ни одного бота для запуска")
+    for b in bots:
+        try:
+            await b.start()
+        except Exception as e:
+            logger.exception(f"[HOST] {b.name} не запустился: {e}")
+    logger.info(f"[HOST] запущены: {', '.join(b.name for b in bots)}")
+    # aiogram-боты поднимают /metrics в on_startup; здесь — на случай хоста только с PTB-ботами
+    await start_metrics_server()
+
+    reporter = asyncio.create_task(_report_stats(stats, stop))
+    await stop.wait()
+    logger.info("[HOST] получен сигнал, останавливаем ботов...")
+    await asyncio.gather(*(b.stop() for b in bots), return_exceptions=True)
+    await reporter
+    await session.close()
+    await stop_metrics_server()
+    executor.shutdown(wait=True)
+    logger.info(f"[HOST] остановлен; {stats.summary()}")
+
+
+def main():
+    setup_logging("")
+    names = sys.argv[1:] or [s.strip() for s in os.getenv("HOST_BOTS", "str,sup").split(",") if s.strip()]
+    names = [n[:-3] if n.endswith(".py") else n for n in names]
+    asyncio.run(run(names))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,9 @@ from aiogram.types import (
 )
 from aiogram.filters import Command, ChatMemberUpdatedFilter, MEMBER
 
+from fsmstore import CompactMemoryStorage
+from keyedlock import KeyedLock
+
 
 # ===================== ENV =====================
 
@@ -33,10 +36,10 @@ if ADMIN_CHAT_ID == 0:
 
 #  <<< 2. MODIFY THIS LINE
 bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+dp = Dispatcher(storage=CompactMemoryStorage())
 
 # Объект для блокировки одновременной обработки заявок от одного пользователя
-user_submission_locks = defaultdict(asyncio.Lock)
+user_submission_locks = KeyedLock()
 
 REQUESTS_FILE = "requests.json"
 CONFIG_FILE = "config.json"
@@ -161,7 +164,7 @@ class AlbumMiddleware(BaseMiddleware):
         super().__init__()
         self.wait = wait
         self._buffer: Dict[str, List[Message]] = defaultdict(list)
-        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._locks = KeyedLock()
 
     async def __call__(
         self,
@@ -173,7 +176,7 @@ class AlbumMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         group_id = str(event.media_group_id)
-        async with self._locks[group_id]:
+        async with self._locks.hold(group_id):
             self._buffer[group_id].append(event)
             await asyncio.sleep(self.wait)
             messages = self._buffer.pop(group_id, [])
@@ -298,7 +301,7 @@ async def handle_submission(messages: Union[Message, List[Message]], album: Opti
     user_id_str = str(user.id)
 
     # Блокируем, чтобы избежать двойной отправки
-    async with user_submission_locks[user_id_str]:
+    async with user_submission_locks.hold(user_id_str):
         # Проверяем, есть ли у пользователя активная заявка
         if not has_active_request(user_id_str):
             return
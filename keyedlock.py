@@ -0,0 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+# asyncio.Lock по ключу (пользователь, media_group_id): запись живёт, пока лок держат или ждут,
+# и удаляется последним вышедшим. defaultdict(asyncio.Lock) хранил бы лок каждого ключа до перезапуска.
+
+
+class KeyedLock:
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}  # ключ -> [лок, сколько корутин держат или ждут]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
@@ -0,0 +1,139 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from tracing import current_id
+
+# Логи через QueueHandler/QueueListener: хендлеры бота только кладут запись в очередь,
+# запись в файл (ротация, gzip) выполняет отдельный поток.
+# LOG_FILE       — файл ("" — только консоль); по умолчанию задаёт бот
+# LOG_FORMAT     — text | json (JSON lines)
+# LOG_ROTATE     — size (LOG_MAX_BYTES) | time (LOG_ROTATE_WHEN, например midnight)
+# LOG_BACKUP_COUNT, LOG_COMPRESS=1 — сжимать ротированные файлы в .gz
+# LOG_LEVEL, LOG_CONSOLE=1 — дублировать в stderr (supervisor.py пишет его в logs/<bot>.log)
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_listening = False  # поток слушателя запущен (QueueListener сам этого не сообщает)
+
+
+class TextFormatter(logging.Formatter):
+    """Текстовый формат; строки внутри трассы помечаются её id."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        trace = getattr(record, "trace_id", None)
+        return f"{line} [trace {trace}]" if trace else line
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace = getattr(record, "trace_id", None)
+        if trace:
+            entry["trace"] = trace
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # форматирование — в потоке слушателя; здесь только то, что нельзя передать как есть
+        # (аргументы, исключение и id трассы из contextvars вызывающего)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        record.trace_id = current_id()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(path: str) -> logging.Handler:
+    backups = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+    if os.getenv("LOG_ROTATE", "size") == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=os.getenv("LOG_ROTATE_WHEN", "midnight"), backupCount=backups, encoding="utf-8",
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))), backupCount=backups, encoding="utf-8",
+        )
+    if os.getenv("LOG_COMPRESS", "1") == "1":
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(default_file: str = "bot_debug.log") -> None:
+    """
+    Настраивает корневой логгер один раз на процесс. Как и basicConfig, ничего не делает,
+    если корневой логгер уже настроен кем-то другим (бенчмарки, хост с собственной настройкой).
+    """
+    global _listener, _listening
+    root = logging.getLogger()
+    if _listener is not None or root.handlers:
+        return
+    fmt = JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else TextFormatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = []
+    if os.getenv("LOG_CONSOLE", "1") == "1":
+        handlers.append(logging.StreamHandler())
+    path = os.getenv("LOG_FILE", default_file)
+    if path:
+        shard = os.getenv("SHARD_INDEX")
+        if shard is not None and int(os.getenv("SHARD_COUNT", "1")) > 1:
+            # шарды не ротируют один и тот же файл
+            base, ext = os.path.splitext(path)
+            path = f"{base}.shard{shard}{ext}"
+        handlers.append(_file_handler(path))
+    for h in handlers:
+        h.setFormatter(fmt)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(_QueueHandler(q))
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listening = True
+    atexit.register(stop_logging)
+
+
+def flush_logging() -> None:
+    """Дописывает всё, что уже в очереди (при завершении бота); приём логов продолжается."""
+    if _listener is not None and _listening:
+        _listener.stop()
+        _listener.start()
+
+
+def stop_logging() -> None:
+    global _listener, _listening
+    if _listener is not None:
+        if _listening:
+            _listener.stop()
+            _listening = False
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
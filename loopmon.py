@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# блокировка loop дольше порога записывается как медленный колбэк со стеком
+SLOW_THRESHOLD = float(os.getenv("LOOP_SLOW_THRESHOLD", "0.1"))
+LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "1200"))  # замеров (~10 минут при 0.5s)
+SLOW_KEEP = int(os.getenv("LOOP_SLOW_KEEP", "50"))
+STACK_LIMIT = 30
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _task_name(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "-"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+# ===================== EVENT LOOP LAG MONITOR =====================
+
+class LoopMonitor:
+    """
+    Лаг планирования event loop и медленные (блокирующие) колбэки.
+
+    Корутина-зонд спит LAG_INTERVAL и меряет, насколько позже она проснулась. Сторожевой поток
+    видит, что зонд давно не отмечался, и снимает стек потока loop прямо во время блокировки —
+    так виден синхронный код (JSON I/O, запись логов), который держит loop.
+    Один монитор на процесс (loop): в host.py его делят все боты.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = SLOW_THRESHOLD,
+                 window: int = LAG_WINDOW, keep: int = SLOW_KEEP):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.stalls = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = 0.0
+        self._pending: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._running = True
+        self._task = asyncio.create_task(self._probe(), name="loop-monitor")
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def _probe(self) -> None:
+        try:
+            while True:
+                self._beat = time.monotonic()
+                t0 = self._loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, self._loop.time() - t0 - self.interval)
+                self.samples.append(lag)
+                if lag >= self.threshold:
+                    self._finish_stall(lag)
+        finally:
+            self._running = False
+
+    def _finish_stall(self, lag: float) -> None:
+        self.stalls += 1
+        rec, self._pending = self._pending, None
+        if rec is None:
+            # блокировка короче периода сторожа — стек не снят, остаётся только длительность
+            rec = {"at": time.time() - lag, "task": "-", "where": "?", "stack": "(стек не снят)\n"}
+        rec["duration"] = lag
+        self.slow.append(rec)
+        if lag >= self.threshold * 5:
+            logger.warning(f"[LOOP] event loop заблокирован на {lag * 1000:.0f} мс: {rec['where']} ({rec['task']})")
+
+    def _watchdog(self) -> None:
+        period = max(0.01, self.threshold / 2)
+        while self._running:
+            time.sleep(period)
+            if self._pending is not None:
+                continue
+            if time.monotonic() - self._beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            top = stack[-1] if stack else None
+            try:
+                task = asyncio.current_task(self._loop)
+            except Exception:
+                task = None
+            self._pending = {
+                "at": time.time(),
+                "task": _task_name(task),
+                "where": f"{os.path.basename(top.filename)}:{top.lineno} {top.name}" if top else "?",
+                "stack": "".join(stack.format()),
+            }
+
+    # ---------- отчёты ----------
+
+    def lag_stats(self) -> Dict[str, float]:
+        values = sorted(self.samples)
+        return {
+            "p50": _pct(values, 0.5),
+            "p95": _pct(values, 0.95),
+            "p99": _pct(values, 0.99),
+            "max": values[-1] if values else 0.0,
+            "samples": len(values),
+            "stalls": self.stalls,
+        }
+
+    def slowest(self, n: int = 5) -> List[Dict[str, Any]]:
+        return sorted(self.slow, key=lambda r: r["duration"], reverse=True)[:n]
+
+    def dump(self) -> str:
+        """Снимок: лаг, самые долгие блокировки со стеками и текущие задачи loop (вызывать из loop)."""
+        st = self.lag_stats()
+        out = [
+            f"lag p50={st['p50'] * 1000:.1f}ms p95={st['p95'] * 1000:.1f}ms p99={st['p99'] * 1000:.1f}ms "
+            f"max={st['max'] * 1000:.1f}ms samples={st['samples']} stalls={st['stalls']} threshold={self.threshold * 1000:.0f}ms",
+            "",
+            "== Самые долгие блокировки ==",
+        ]
+        for rec in self.slowest(len(self.slow)):
+            at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rec["at"]))
+            out.append(f"--- {rec['duration'] * 1000:.0f} ms at {at}; task {rec['task']}; {rec['where']}")
+            out.append(rec["stack"])
+        tasks = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+        out.append(f"== Задачи loop: {len(tasks)} ==")
+        for t in sorted(tasks, key=lambda t: t.get_name()):
+            out.append(f"--- {_task_name(t)}")
+            for frame in t.get_stack(limit=5):
+                out.append(f"  {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}")
+        return "\n".join(out) + "\n"
+
+
+MONITOR = LoopMonitor()
@@ -0,0 +1,339 @@
+import os
+import time
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from stats import EventStats
+from tracing import record_span, start_trace
+
+logger = logging.getLogger(__name__)
+
+# /metrics в текстовом формате Prometheus; порт не задан — сервер не запускается.
+# В шардированном режиме каждый воркер слушает METRICS_PORT + SHARD_INDEX.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+# размер запросов к Bot API: estimate — по строковым полям запроса (текст, подпись, file_id) без сериализации,
+# exact — полная сериализация запроса (ещё одна на каждый вызов), off — не считать
+METRICS_API_BYTES = os.getenv("METRICS_API_BYTES", "estimate").lower()
+
+# границы бакетов задержки хендлеров, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+# путь обработки, от имени которого идут вызовы API: имя хендлера (ставит MetricsMiddleware)
+# или фоновой задачи (handle_submission); задачи и очереди Outbox наследуют его от создателя
+api_path: ContextVar[str] = ContextVar("api_path", default="-")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Labels, values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# ===================== METRIC TYPES =====================
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            out.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Labels = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # на каждый набор меток: счётчики по бакетам (последний — +Inf), сумма
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = defaultdict(float)
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in list(self.counts.items()):
+            total = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                total += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {self.sums[labels]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return out
+
+
+class Collected:
+    """Значения, которые вычисляются в момент запроса /metrics (статистика очередей, HostStats)."""
+
+    def __init__(self, name: str, kind: str, help: str, labelnames: Labels, fn: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"[METRICS] {self.name}: не удалось собрать значения: {e}")
+            return []
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in values.items():
+            out.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.collected: Dict[str, List[Collected]] = defaultdict(list)
+
+    def counter(self, name: str, help: str, labelnames: Labels = ()) -> Counter:
+        # один процесс может держать несколько ботов (host.py) — метрики общие, различаются меткой bot
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name: str, help: str, labelnames: Labels = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help, labelnames, buckets)
+        return self.metrics[name]
+
+    def collect(self, name: str, kind: str, help: str, labelnames: Labels, fn: Callable[[], Dict[Labels, float]]) -> None:
+        self.collected[name].append(Collected(name, kind, help, labelnames, fn))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        for name, parts in list(self.collected.items()):
+            rendered = [p.render() for p in parts]
+            # одна шапка HELP/TYPE на имя, даже если значения дают несколько ботов
+            head = next((r[:2] for r in rendered if r), None)
+            if head:
+                lines.extend(head)
+                for r in rendered:
+                    lines.extend(r[2:])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ===================== AIOGRAM MIDDLEWARE =====================
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Счётчики апдейтов по типу, гистограммы задержки и ошибки по хендлерам, бизнес-события.
+    На горячем пути — только perf_counter, bisect и инкремент словаря.
+    """
+
+    def __init__(self, bot_name: str, registry: Registry = REGISTRY):
+        self.bot_name = bot_name
+        self.registry = registry
+        self.updates = registry.counter("bot_updates_total", "Полученные апдейты по типу", ("bot", "type"))
+        self.latency = registry.histogram("bot_handler_seconds", "Время выполнения хендлера", ("bot", "handler"))
+        self.errors = registry.counter("bot_handler_errors_total", "Исключения в хендлерах", ("bot", "handler"))
+        self.events = registry.counter("bot_events_total", "Бизнес-события (заявки, баны, оплаты...)", ("bot", "event"))
+        # те же события с окнами час/сутки/неделя — для /stats
+        self.stats = EventStats()
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Подсчёт апдейтов — outer middleware на dp.update, время хендлеров — inner middleware всех observers."""
+        dp.update.outer_middleware(self._count_update)
+        for name, observer in dp.observers.items():
+            if name != "update":
+                observer.middleware(self)
+
+    def event(self, name: str, value: float = 1.0) -> None:
+        self.events.inc(self.bot_name, name, value=value)
+        self.stats.add(name, value)
+
+    def watch(self, name: str, stats: Callable[[], Dict[str, float]]) -> None:
+        """Экспорт словаря stats() (UpdateLimiter, Outbox) как gauge bot_<name>{stat=...}."""
+        self.registry.collect(
+            f"bot_{name}", "gauge", f"Состояние {name}", ("bot", "stat"),
+            lambda: {(self.bot_name, k): v for k, v in stats().items()},
+        )
+
+    async def _count_update(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        self.updates.inc(self.bot_name, event.event_type)
+        return await handler(event, data)
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        name = data["handler"].callback.__name__
+        token = api_path.set(name)
+        user = data.get("event_from_user")
+        with start_trace(name, bot=self.bot_name, user=user.id if user else "-") as trace:
+            t0 = time.perf_counter()
+            enqueued = data.get("enqueued_at")
+            if enqueued is not None:
+                trace.add_span("queue.wait", enqueued, t0 - enqueued)
+            try:
+                return await handler(event, data)
+            except Exception:
+                self.errors.inc(self.bot_name, name)
+                raise
+            finally:
+                self.latency.observe(time.perf_counter() - t0, self.bot_name, name)
+                api_path.reset(token)
+
+
+# ===================== BOT API CALLS =====================
+
+def chat_class(chat_id: Any, admin_chats: Iterable[int]) -> str:
+    """Класс адресата вызова: admin (админ-чаты), user (личка), group (прочие чаты), none (без chat_id)."""
+    if chat_id is None:
+        return "none"
+    try:
+        cid = int(chat_id)
+    except (TypeError, ValueError):
+        return "group"  # @username канала
+    if cid in admin_chats:
+        return "admin"
+    return "user" if cid > 0 else "group"
+
+
+def estimate_values_size(values: Iterable[Any]) -> int:
+    """Оценка размера запроса: строки и числа верхнего уровня (разметка и медиа-группы не разбираются)."""
+    size = 0
+    for value in values:
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            size += 8
+    return size
+
+
+def estimate_request_size(method: Any) -> int:
+    return estimate_values_size(method.__dict__.values())
+
+
+def request_size(method: Any, mode: str = METRICS_API_BYTES) -> int:
+    if mode == "off":
+        return 0
+    try:
+        if mode == "exact":
+            return len(method.model_dump_json(exclude_none=True, fallback=lambda _: None))
+        return estimate_request_size(method)
+    except Exception:
+        return 0  # InputFile и т.п. — размер файла не считаем
+
+
+class ApiCallMetrics(BaseRequestMiddleware):
+    """
+    Учёт вызовов Bot API (middleware сессии aiogram): задержка, статус, retry_after и байты запроса
+    (по умолчанию — оценка, см. METRICS_API_BYTES)
+    по методу, классу чата и пути обработки (api_path). record() используется и PTB-ботом (sup.py).
+    """
+
+    def __init__(self, bot_name: str, admin_chats: Iterable[int] = (), token: Optional[str] = None, registry: Registry = REGISTRY):
+        self.bot_name = bot_name
+        self.admin_chats = frozenset(admin_chats)
+        # в host.py сессия общая для нескольких ботов — каждый учитывает только свои вызовы
+        self.token = token
+        self.calls = registry.counter("bot_api_calls_total", "Вызовы Bot API", ("bot", "method", "chat", "path", "status"))
+        self.latency = registry.histogram("bot_api_seconds", "Задержка вызовов Bot API", ("bot", "method", "chat"))
+        self.sent = registry.counter("bot_api_sent_bytes_total", "Размер запросов к Bot API", ("bot", "method", "chat", "path"))
+        self.retry_after = registry.counter("bot_api_retry_after_seconds_total", "Сумма retry_after из ответов 429", ("bot", "method"))
+
+    def record(self, method: str, chat_id: Any, status: str, elapsed: float, sent: int, retry_after: int = 0) -> None:
+        chat = chat_class(chat_id, self.admin_chats)
+        path = api_path.get()
+        self.calls.inc(self.bot_name, method, chat, path, status)
+        self.latency.observe(elapsed, self.bot_name, method, chat)
+        if sent:
+            self.sent.inc(self.bot_name, method, chat, path, value=sent)
+        if retry_after:
+            self.retry_after.inc(self.bot_name, method, value=retry_after)
+
+    async def __call__(self, make_request: Callable[..., Awaitable[Any]], bot: Any, method: Any) -> Any:
+        if self.token is not None and bot.token != self.token:
+            return await make_request(bot, method)
+        sent = request_size(method)
+        status, retry_after = "ok", 0
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            status, retry_after = "429", e.retry_after
+            raise
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            record_span(f"api.{method.__api_method__}", t0, elapsed, status)
+            self.record(method.__api_method__, getattr(method, "chat_id", None), status, elapsed, sent, retry_after)
+
+
+# ===================== HTTP /metrics =====================
+
+_runner = None
+
+
+async def start_server(port: Optional[int] = None, registry: Registry = REGISTRY) -> None:
+    """Поднимает /metrics один раз на процесс (повторные вызовы других ботов хоста ничего не делают)."""
+    global _runner
+    port = METRICS_PORT if port is None else port
+    if not port or _runner is not None:
+        return
+    from aiohttp import web
+
+    port += int(os.getenv("SHARD_INDEX", "0") or 0)
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logger.warning(f"[METRICS] не удалось открыть {METRICS_HOST}:{port}: {e}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    logger.info(f"[METRICS] http://{METRICS_HOST}:{port}/metrics")
+
+
+async def stop_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
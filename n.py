@@ -2,14 +2,18 @@ import os
 import json
 import asyncio
 import random
+import time
+import logging
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List, Union, Optional
+from typing import AsyncIterator, Dict, List, Union, Optional
 from html import escape
 
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.types import (
     Message,
@@ -18,8 +22,10 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     FSInputFile,
+    BufferedInputFile,
+    Update,
 )
-from aiogram.filters import Command, ChatMemberUpdatedFilter, MEMBER
+from aiogram.filters import Command, CommandObject, ChatMemberUpdatedFilter, MEMBER
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
     InputMediaPhoto,
@@ -28,9 +34,28 @@ from aiogram.types import (
     InputMediaAudio,
 )
 
-# ===================== ENV (robust parsing for multiple IDs) =====================
+from outbox import Outbox
+from backpressure import UpdateLimiter
+from banindex import BanIndex, IdStreamParser
+from logsetup import setup_logging, flush_logging
+from loopmon import MONITOR as loop_monitor
+from profiler import PROFILE_MAX_SECONDS, ProfileBusy, profile as run_profiler
+from metrics import ApiCallMetrics, MetricsMiddleware, api_path, start_server as start_metrics_server, stop_server as stop_metrics_server
+from shutdown import ShutdownReport
+from supervisor import notify_ready
+from tracing import TRACES, span, start_trace, traced
+from fsmstore import CompactMemoryStorage
+from keyedlock import KeyedLock
+
+# LOG_* (как и остальные настройки) могут лежать в .env.prem — загружаем до setup_logging
 load_dotenv(".env.prem")
 
+# только консоль; файл с ротацией — через LOG_FILE (см. logsetup.py)
+setup_logging("")
+logger = logging.getLogger(__name__)
+
+# ===================== ENV (robust parsing for multiple IDs) =====================
+
 
 def _parse_int_list(env_name: str) -> List[int]:
     raw = os.getenv(env_name, "")
@@ -80,11 +105,58 @@ API_TOKEN = os.getenv("BOT_TOKEN2")
 if not API_TOKEN:
     raise RuntimeError("BOT_TOKEN2 не найден в .env.prem")
 
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+# TELEGRAM_API_BASE — локальный Bot API сервер или фейковый bench/fake_api.py для нагрузочных тестов
+API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+bot = Bot(
+    token=API_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(API_BASE)),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
+dp = Dispatcher(storage=CompactMemoryStorage())
+
+# метрики (/metrics при заданном METRICS_PORT); регистрируются до лимитера, чтобы считать и отброшенные апдейты
+BOT_NAME = os.path.splitext(os.path.basename(__file__))[0]
+bot_metrics = MetricsMiddleware(BOT_NAME)
+bot_metrics.setup(dp)
+# вызовы Bot API: задержка, статус, 429 — по методу, классу чата (user/admin) и хендлеру
+api_metrics = ApiCallMetrics(BOT_NAME, ADMIN_CHAT_IDS, token=API_TOKEN)
+bot.session.middleware(api_metrics)
+bot_metrics.watch("loop_lag", loop_monitor.lag_stats)
+
+
+def _is_low_priority_update(update: Update) -> bool:
+    """Шум из посторонних групп/каналов (leave_any_group, on_added) — первым отбрасывается при перегрузке."""
+    event = update.message or update.chat_member or update.my_chat_member
+    if event is None:
+        return False
+    return event.chat.type != "private" and event.chat.id not in ADMIN_CHAT_IDS
+
+
+# ограниченная очередь апдейтов: UPDATE_CONCURRENCY воркеров, по одному апдейту на пользователя одновременно
+update_limiter = UpdateLimiter(_is_low_priority_update)
+dp.update.outer_middleware(update_limiter)
+bot_metrics.watch("update_limiter", update_limiter.stats)
+# с handle_as_tasks=False заполненная очередь лимитера тормозит сам polling
+POLLING_KWARGS = {"handle_as_tasks": False}
+
+# задачи, в которых сейчас выполняются хендлеры (при завершении ждём их в пределах дедлайна)
+handler_tasks: set = set()
+
+
+async def _track_handler_task(handler, event, data):
+    task = asyncio.current_task()
+    handler_tasks.add(task)
+    try:
+        return await handler(event, data)
+    finally:
+        handler_tasks.discard(task)
+
+
+# регистрируется после лимитера — выполняется в задаче, которая реально обрабатывает апдейт
+dp.update.outer_middleware(_track_handler_task)
 
 # Объект для блокировки одновременной обработки заявок от одного пользователя
-user_submission_locks = defaultdict(asyncio.Lock)
+user_submission_locks = KeyedLock()
 
 REQUESTS_FILE = "requests.json"
 CONFIG_FILE = "config.json"
@@ -93,10 +165,20 @@ BANNED_FILE = "banned.json"
 ADMIN_MAP_FILE = "admin_map.json"  # сохраняет маппинг "chat:msg" -> user_id
 ADMIN_TOPICS_FILE = "admin_topics.json"  # сохраняет маппинг chat_id -> thread_id (созданные темы)
 REJECTED_FILE = "rejected.json"  # сохраняет пользователей, которым отклонили заявку
+BANNED_PAGE_SIZE = 50  # id на одной странице /banned
+BAN_FILE_MAX_BYTES = 20 * 1024 * 1024  # предел Bot API на скачивание файла
 
 # Buffers and tasks to collect messages sent by user within a short window
 submission_buffers: Dict[str, List[Message]] = defaultdict(list)
 collecting_tasks: Dict[str, asyncio.Task] = {}
+# коллекторы, уже отправляющие заявку (нужны при завершении, чтобы не оборвать рассылку)
+inflight_submissions: set = set()
+# фоновые прогоны /profile
+profile_tasks: set = set()
+
+# очередь лог-сообщений в админ-чаты (хендлеры не ждут рассылку логов)
+admin_log_outbox = Outbox("admin_log", maxsize=int(os.getenv("ADMIN_LOG_QUEUE_SIZE", "1000")))
+bot_metrics.watch("admin_log_outbox", admin_log_outbox.stats)
 
 # mapping admin chat+message -> user_id (ключ: "chat:msgid")
 admin_message_to_user: Dict[str, int] = {}
@@ -114,6 +196,7 @@ def _now() -> datetime:
     return datetime.now()
 
 
+@traced("storage.load_requests")
 def load_requests() -> Dict[str, dict]:
     if not os.path.exists(REQUESTS_FILE):
         return {}
@@ -126,6 +209,7 @@ def load_requests() -> Dict[str, dict]:
         return {}
 
 
+@traced("storage.save_requests")
 def save_requests(data: Dict[str, dict]) -> None:
     try:
         with open(REQUESTS_FILE, "w", encoding="utf-8") as f:
@@ -134,6 +218,7 @@ def save_requests(data: Dict[str, dict]) -> None:
         print(f"[ERROR] Не удалось сохранить {REQUESTS_FILE}: {e}")
 
 
+@traced("storage.load_banned")
 def load_banned() -> List[int]:
     if not os.path.exists(BANNED_FILE):
         return []
@@ -145,6 +230,7 @@ def load_banned() -> List[int]:
         return []
 
 
+@traced("storage.save_banned")
 def save_banned(b: List[int]) -> None:
     try:
         with open(BANNED_FILE, "w", encoding="utf-8") as f:
@@ -154,17 +240,15 @@ def save_banned(b: List[int]) -> None:
 
 
 def ban_user_by_id(uid: int) -> None:
-    b = load_banned()
-    if uid not in b:
-        b.append(uid)
-        save_banned(b)
+    if banned_index.add(uid):
+        save_banned(banned_index.to_list())
+        bot_metrics.event("ban")
 
 
 def unban_user_by_id(uid: int) -> None:
-    b = load_banned()
-    if uid in b:
-        b.remove(uid)
-        save_banned(b)
+    if banned_index.remove(uid):
+        save_banned(banned_index.to_list())
+        bot_metrics.event("unban")
 
 
 def is_banned(uid: Union[int, str]) -> bool:
@@ -172,7 +256,7 @@ def is_banned(uid: Union[int, str]) -> bool:
         uid_int = int(uid)
     except Exception:
         return False
-    return uid_int in load_banned()
+    return uid_int in banned_index
 
 
 def load_admin_map() -> Dict[str, int]:
@@ -186,6 +270,7 @@ def load_admin_map() -> Dict[str, int]:
         return {}
 
 
+@traced("storage.save_admin_map")
 def save_admin_map(m: Dict[str, int]) -> None:
     try:
         with open(ADMIN_MAP_FILE, "w", encoding="utf-8") as f:
@@ -205,6 +290,7 @@ def load_admin_topics() -> Dict[str, int]:
         return {}
 
 
+@traced("storage.save_admin_topics")
 def save_admin_topics(m: Dict[str, int]) -> None:
     try:
         with open(ADMIN_TOPICS_FILE, "w", encoding="utf-8") as f:
@@ -224,6 +310,7 @@ def load_rejected() -> set:
         return set()
 
 
+@traced("storage.save_rejected")
 def save_rejected(s: set) -> None:
     try:
         with open(REJECTED_FILE, "w", encoding="utf-8") as f:
@@ -253,6 +340,33 @@ def clear_all_rejected() -> None:
     save_rejected(rejected_users)
 
 
+def ban_users_bulk(uids: List[int]) -> Dict[str, int]:
+    """
+    Бан пачки id одной транзакцией: banned.json, rejected.json и requests.json
+    переписываются по одному разу на всю пачку, а не на каждого пользователя.
+    """
+    added = sum(1 for uid in uids if banned_index.add(uid))
+    if added:
+        save_banned(banned_index.to_list())
+    rejected_users.update(uids)
+    save_rejected(rejected_users)
+    data = load_requests()
+    closed = sum(1 for uid in uids if data.pop(str(uid), None) is not None)
+    if closed:
+        save_requests(data)
+    if added:
+        bot_metrics.event("ban", added)
+    return {"added": added, "already": len(uids) - added, "closed": closed}
+
+
+def unban_users_bulk(uids: List[int]) -> Dict[str, int]:
+    removed = sum(1 for uid in uids if banned_index.remove(uid))
+    if removed:
+        save_banned(banned_index.to_list())
+        bot_metrics.event("unban", removed)
+    return {"removed": removed, "missing": len(uids) - removed}
+
+
 def _admin_map_key(chat_id: int, message_id: int) -> str:
     return f"{chat_id}:{message_id}"
 
@@ -290,6 +404,9 @@ try:
 except Exception:
     rejected_users = set()
 
+# индекс заблокированных: is_banned и /banned без чтения banned.json на каждый вызов
+banned_index = BanIndex(load_banned())
+
 # ===================== REQUESTS / LANGS =====================
 
 
@@ -518,18 +635,25 @@ async def log_user_action(user_obj: Union[Message, CallbackQuery, Message, dict,
     header = f"{safe_full_name} {safe_username}\nID: {uid}\nЯзыки: {safe_langs}\nВремя: {tm}\n\n"
     text = header + f"Действие: {escape(action)}"
 
-    # Отправляем в каждый admin chat (в thread если задан)
+    # Ставим в очередь отправку в каждый admin chat (в thread если задан)
     for admin_chat in ADMIN_CHAT_IDS:
         # пытаемся использовать заранее настроенную log-thread (если есть)
         thread_id = get_log_thread_for_chat(admin_chat)
-        try:
-            if thread_id is not None:
-                await bot.send_message(chat_id=admin_chat, text=text, message_thread_id=thread_id)
-            else:
-                await bot.send_message(chat_id=admin_chat, text=text)
-        except Exception as e:
-            # не фатально, логируем на stdout
-            print(f"[WARN] Не удалось отправить лог в {admin_chat} (thread {thread_id}): {e}")
+        # рассылка логов учитывается в метриках API отдельным путём, а не хендлером-источником
+        token = api_path.set("log_user_action")
+        admin_log_outbox.put(lambda c=admin_chat, t=thread_id: _send_log_message(c, t, text))
+        api_path.reset(token)
+
+
+async def _send_log_message(admin_chat: int, thread_id: Optional[int], text: str) -> None:
+    try:
+        if thread_id is not None:
+            await bot.send_message(chat_id=admin_chat, text=text, message_thread_id=thread_id)
+        else:
+            await bot.send_message(chat_id=admin_chat, text=text)
+    except Exception as e:
+        # не фатально, логируем на stdout
+        print(f"[WARN] Не удалось отправить лог в {admin_chat} (thread {thread_id}): {e}")
 
 
 # ===================== HANDLERS =====================
@@ -742,6 +866,7 @@ async def reject_request(callback: CallbackQuery):
         add_rejected(int(user_id))
     except Exception:
         pass
+    bot_metrics.event("rejection")
 
     try:
         await bot.send_message(user_id, "❌ Ваша заявка отклонена.\nВы можете попробовать подать её снова.")
@@ -891,6 +1016,94 @@ async def cmd_ban(message: Message):
         pass
 
 
+# ------------------ BAN/UNBAN списком из файла ------------------
+
+async def _document_chunks(document) -> AsyncIterator[bytes]:
+    """Содержимое документа по кускам — без загрузки файла в память целиком."""
+    file = await bot.get_file(document.file_id)
+    api = bot.session.api
+    if api.is_local:
+        with open(api.wrap_local_file.to_local(file.file_path), "rb") as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+    async for chunk in bot.session.stream_content(
+        url=api.file_url(bot.token, file.file_path), timeout=60, chunk_size=65536, raise_for_status=True
+    ):
+        yield chunk
+
+
+def _drop_collectors(uids: List[int]) -> int:
+    """Один проход по буферам/коллекторам заявок: снимает всё, что относится к uids."""
+    stopped = 0
+    for uid in map(str, uids):
+        submission_buffers.pop(uid, None)
+        task = collecting_tasks.pop(uid, None)
+        if task and not task.done():
+            task.cancel()
+            stopped += 1
+    return stopped
+
+
+@dp.message(Command("ban_file", "unban_file"))
+async def cmd_ban_file(message: Message, command: CommandObject):
+    """
+    /ban_file, /unban_file — подписью к .txt/.csv с id (или reply на такой документ).
+    id разделяются переводом строки, пробелом, «,» или «;». Выгрузка текущего списка — кнопка 📄 в /banned.
+    """
+    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await log_user_action(message, f"Команда /{command.command}")
+
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply(f"Пришлите .txt/.csv с id пользователей с подписью /{command.command} "
+                            f"или ответьте командой на такой документ.")
+        return
+    if document.file_size and document.file_size > BAN_FILE_MAX_BYTES:
+        await message.reply("Файл слишком большой (больше 20 МБ).")
+        return
+
+    parser = IdStreamParser()
+    try:
+        async for chunk in _document_chunks(document):
+            parser.feed(chunk)
+    except Exception as e:
+        logger.error(f"Не удалось скачать файл для /{command.command}: {e}")
+        await message.reply(f"Не удалось скачать файл: {e}")
+        return
+    uids = parser.close()
+    skipped = f"\nПропущено нечисловых значений: {parser.invalid}" if parser.invalid else ""
+    if parser.invalid_samples:
+        skipped += " (" + ", ".join(parser.invalid_samples) + ")"
+    if not uids:
+        await message.reply("В файле не найдено ни одного id." + skipped)
+        return
+
+    try:
+        if command.command == "unban_file":
+            res = unban_users_bulk(uids)
+            text = (f"✅ Разблокировано: {res['removed']} из {len(uids)}"
+                    f"\nНе было в бан-листе: {res['missing']}")
+        else:
+            res = ban_users_bulk(uids)
+            stopped = _drop_collectors(uids)
+            # пользователей не уведомляем: тысячи send_message упрутся в лимиты Bot API
+            text = (f"🔒 Заблокировано новых: {res['added']} из {len(uids)}"
+                    f"\nУже были в бан-листе: {res['already']}"
+                    f"\nЗакрыто заявок: {res['closed']}, остановлено сборов заявок: {stopped}")
+    except Exception as e:
+        logger.error(f"Ошибка при /{command.command}: {e}")
+        await message.reply(f"Ошибка при сохранении: {e}")
+        return
+    logger.info(f"/{command.command} от {message.from_user.id}: {len(uids)} id")
+    await message.reply(text + skipped + f"\nВсего в бан-листе: {len(banned_index)}")
+
+
 # ------------------ UNBAN: команда и callback ------------------
 
 @dp.message(Command("unban"))
@@ -919,8 +1132,7 @@ async def cmd_unban(message: Message):
             await message.reply("Укажите id: /unban <user_id> или выполните команду через reply на сообщении бота в админ-чате.")
             return
 
-    banned = load_banned()
-    if target_id not in banned:
+    if not is_banned(target_id):
         await message.reply(f"Пользователь {target_id} не в списке заблокированных.")
         return
 
@@ -952,8 +1164,7 @@ async def unban_request(callback: CallbackQuery):
         await callback.message.answer("Неверный id для разблокировки.")
         return
 
-    banned = load_banned()
-    if uid not in banned:
+    if not is_banned(uid):
         await callback.message.answer("Пользователь уже не заблокирован.")
         try:
             await callback.message.edit_reply_markup(reply_markup=None)
@@ -988,12 +1199,70 @@ async def cmd_banned(message: Message):
 
     if message.from_user.id not in ALL_ADMINS_SET:
         return
-    banned = load_banned()
-    if not banned:
-        await message.reply("Список заблокированных пуст.")
+    parts = (message.text or "").split(maxsplit=1)
+    prefix = parts[1].strip() if len(parts) > 1 else ""
+    if prefix and not (prefix.isdigit() and len(prefix) <= 20):
+        await message.reply("Использование: /banned [начало id]")
+        return
+    text, kb = _banned_page(prefix)
+    await message.reply(text, reply_markup=kb)
+
+
+def _banned_page(prefix: str = "", after: Optional[str] = None, before: Optional[str] = None):
+    """Страница /banned из индекса: курсор — крайний id страницы, префикс — фильтр по началу id."""
+    ids, has_prev, has_next, total = banned_index.page(prefix, after=after, before=before, limit=BANNED_PAGE_SIZE)
+    if total and not ids:
+        # курсор ушёл за край (id с края страницы разбанили) — с начала списка
+        ids, has_prev, has_next, total = banned_index.page(prefix, limit=BANNED_PAGE_SIZE)
+    if not total:
+        return ("Нет заблокированных с id на " + prefix) if prefix else "Список заблокированных пуст.", None
+    title = f"Заблокированные пользователи с id на {prefix}" if prefix else "Заблокированные пользователи"
+    text = f"{title} (всего {total}):\n" + "\n".join(ids)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"banned:p:{prefix}:{ids[0]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"banned:n:{prefix}:{ids[-1]}"))
+    rows = [nav] if nav else []
+    if has_prev or has_next:
+        rows.append([InlineKeyboardButton(text="📄 Выгрузить файлом", callback_data=f"banned:f:{prefix}")])
+    return text, InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+@dp.callback_query(F.data.startswith("banned:"))
+async def banned_nav(callback: CallbackQuery):
+    if callback.from_user.id not in ALL_ADMINS_SET:
+        await callback.answer()
+        return
+    parts = callback.data.split(":")
+    action, prefix = parts[1], parts[2] if len(parts) > 2 else ""
+    cursor = parts[3] if len(parts) > 3 else None
+
+    if action == "f":
+        ids = banned_index.matching(prefix)
+        await callback.answer()
+        if not ids:
+            return
+        name = f"banned_{prefix}.txt" if prefix else "banned.txt"
+        try:
+            await callback.message.answer_document(
+                BufferedInputFile(("\n".join(ids) + "\n").encode("utf-8"), filename=name),
+                caption=f"Заблокированных: {len(ids)}",
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить выгрузку /banned: {e}")
         return
-    text = "Заблокированные пользователи:\n" + "\n".join([str(x) for x in banned])
-    await message.reply(text)
+
+    if action == "n":
+        text, kb = _banned_page(prefix, after=cursor)
+    else:
+        text, kb = _banned_page(prefix, before=cursor)
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        # страница не изменилась (двойное нажатие) — нечего обновлять
+        pass
 
 
 # ===================== NEW: /clear_rejected command =====================
@@ -1043,10 +1312,121 @@ async def cmd_clear_rejected(message: Message):
         await message.reply("✅ Список отклонённых пользователей очищен.")
 
 
+# ===================== ДИАГНОСТИКА (админские команды) =====================
+@dp.message(Command("lag"))
+async def cmd_lag(message: Message):
+    """
+    /lag — лаг event loop (p50/p95/p99/max) и самые долгие блокировки.
+    /lag dump — плюс файл со стеками блокировок и текущими задачами.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    st = loop_monitor.lag_stats()
+    lines = [
+        f"⏱ Лаг event loop ({st['samples']} замеров): p50 {st['p50'] * 1000:.1f} мс, p95 {st['p95'] * 1000:.1f} мс, "
+        f"p99 {st['p99'] * 1000:.1f} мс, max {st['max'] * 1000:.1f} мс",
+        f"Блокировок дольше {loop_monitor.threshold * 1000:.0f} мс: {st['stalls']}",
+    ]
+    for rec in loop_monitor.slowest(5):
+        lines.append(f"• {rec['duration'] * 1000:.0f} мс — {escape(rec['where'])} ({escape(rec['task'])})")
+    await message.reply("\n".join(lines))
+
+    args = (message.text or "").split()[1:]
+    if args and args[0] == "dump":
+        dump = loop_monitor.dump().encode("utf-8")
+        await message.reply_document(BufferedInputFile(dump, filename=f"loop_dump_{int(time.time())}.txt"))
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """
+    /profile [секунды] — семплирующий профайлер event loop на заданное окно (по умолчанию 10 с).
+    Результат (топ функций и collapsed stacks) уходит документами в лог-темы админ-чатов.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    args = (message.text or "").split()[1:]
+    try:
+        seconds = float(args[0]) if args else 10.0
+    except ValueError:
+        await message.reply("Использование: /profile [секунды]")
+        return
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+    await message.reply(f"🔬 Профилирую {seconds:.0f} с, результат придёт в лог-тему.")
+    # окно профилирования не занимает слот обработки апдейтов
+    task = asyncio.create_task(_run_profile(message, seconds))
+    profile_tasks.add(task)
+    task.add_done_callback(profile_tasks.discard)
+
+
+async def _run_profile(message: Message, seconds: float) -> None:
+    try:
+        prof = await run_profiler(seconds)
+    except ProfileBusy as e:
+        await message.reply(f"⚠️ {e}")
+        return
+    except Exception as e:
+        logger.error(f"[PROFILE] ошибка профилирования: {e}")
+        return
+    summary = prof.summary()
+    stamp = int(time.time())
+    logger.info(f"[PROFILE] {summary.splitlines()[0]}")
+    caption = f"/profile {seconds:.0f}s от {message.from_user.id}\n{escape(summary.splitlines()[0])}"
+    for admin_chat in ADMIN_CHAT_IDS:
+        thread_id = get_log_thread_for_chat(admin_chat)
+        try:
+            await bot.send_document(
+                chat_id=admin_chat,
+                document=BufferedInputFile(summary.encode("utf-8"), filename=f"profile_{stamp}_top.txt"),
+                caption=caption,
+                message_thread_id=thread_id,
+            )
+            await bot.send_document(
+                chat_id=admin_chat,
+                document=BufferedInputFile(prof.collapsed().encode("utf-8"), filename=f"profile_{stamp}.collapsed.txt"),
+                message_thread_id=thread_id,
+            )
+        except Exception as e:
+            logger.warning(f"[PROFILE] не удалось отправить профиль в {admin_chat}: {e}")
+
+
+@dp.message(Command("trace"))
+async def cmd_trace(message: Message):
+    """
+    /trace — самые медленные недавние заявки; /trace all | /trace <хендлер> — среди всех трасс или одного хендлера;
+    /trace <id> — шаги одной трассы (id есть в строках лога).
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    args = (message.text or "").split()[1:]
+    arg = args[0] if args else "submission"
+    trace = TRACES.get(arg)
+    if trace is not None:
+        text = trace.format()
+        if len(text) > 3500:
+            await message.reply_document(BufferedInputFile(text.encode("utf-8"), filename=f"trace_{trace.id}.txt"))
+        else:
+            await message.reply(f"<pre>{escape(text)}</pre>")
+        return
+    traces = TRACES.slowest(None if arg == "all" else arg, 10)
+    if not traces:
+        await message.reply(f"Трасс «{escape(arg)}» нет (в буфере {TRACES.stats()['kept']}).")
+        return
+    lines = [f"🐢 Самые медленные трассы «{escape(arg)}» из последних {TRACES.stats()['kept']}:"]
+    for t in traces:
+        top = sorted(t.spans, key=lambda s: s[2], reverse=True)[:3]
+        steps = ", ".join(f"{escape(name)} {duration * 1000:.0f}" for name, _, duration, _ in top)
+        user = t.attrs.get("user", "-")
+        lines.append(f"• {t.duration * 1000:.0f} мс — <code>{t.id}</code> {escape(t.name)} user={user} {t.status} ({steps})")
+    await message.reply("\n".join(lines))
+
+
 # ===================== ПРИЁМ ЗАЯВОК (с копированием) =====================
 
 
 async def handle_submission(messages: Union[Message, List[Message]]):
+    # выполняется в своей задаче (коллектор / досылка при остановке) — метка не затрагивает хендлер
+    api_path.set("handle_submission")
     first_message: Message = messages[0] if isinstance(messages, list) else messages
     if not await ensure_private_and_autoleave(first_message):
         return
@@ -1068,7 +1448,7 @@ async def handle_submission(messages: Union[Message, List[Message]]):
             pass
         return
 
-    async with user_submission_locks[user_id_str]:
+    async with user_submission_locks.hold(user_id_str):
         if not has_active_request(user_id_str):
             return
         update_user_lang(user_id_str, user.language_code or "unknown")
@@ -1089,50 +1469,53 @@ async def handle_submission(messages: Union[Message, List[Message]]):
         try:
             # Для каждого admin chat отправляем копии и шапку (в topic, если задан или можно создать)
             for admin_chat in ADMIN_CHAT_IDS:
-                # NEW: ensure or create thread for submissions (if ADMIN_THREAD_NAMES provided)
-                thread_id = await ensure_or_create_topic_for_chat(admin_chat)
-
-                if isinstance(messages, list):
-                    album_msgs: List[Message] = sorted(messages, key=lambda m: m.message_id)
-                    media_group_ids = {getattr(m, "media_group_id", None) for m in album_msgs}
-                    if len(media_group_ids) == 1 and next(iter(media_group_ids)) is not None:
-                        for m in album_msgs:
-                            res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
-                            set_admin_map(admin_chat, res.message_id, int(user.id))
-                        header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
-                        set_admin_map(admin_chat, header_msg.message_id, int(user.id))
-                    else:
-                        media_group = []
-                        for i, m in enumerate(album_msgs):
-                            caption = getattr(m, "html_text", None) or getattr(m, "caption_html", None) or None
-                            cap = caption if i == 0 else None
-                            if m.photo:
-                                file_id = m.photo[-1].file_id
-                                media_group.append(InputMediaPhoto(media=file_id, caption=cap, parse_mode="HTML"))
-                            elif m.video:
-                                media_group.append(InputMediaVideo(media=m.video.file_id, caption=cap, parse_mode="HTML"))
-                            elif getattr(m, "document", None):
-                                media_group.append(InputMediaDocument(media=m.document.file_id, caption=cap, parse_mode="HTML"))
-                            elif getattr(m, "audio", None):
-                                media_group.append(InputMediaAudio(media=m.audio.file_id, caption=cap, parse_mode="HTML"))
-                            else:
+                with span(f"fanout.{admin_chat}"):
+                    # NEW: ensure or create thread for submissions (if ADMIN_THREAD_NAMES provided)
+                    thread_id = await ensure_or_create_topic_for_chat(admin_chat)
+
+                    if isinstance(messages, list):
+                        album_msgs: List[Message] = sorted(messages, key=lambda m: m.message_id)
+                        media_group_ids = {getattr(m, "media_group_id", None) for m in album_msgs}
+                        if len(media_group_ids) == 1 and next(iter(media_group_ids)) is not None:
+                            for m in album_msgs:
                                 res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
                                 set_admin_map(admin_chat, res.message_id, int(user.id))
-                        if media_group:
-                            sent = await bot.send_media_group(chat_id=admin_chat, media=media_group, message_thread_id=thread_id)
-                            for s in sent:
-                                set_admin_map(admin_chat, s.message_id, int(user.id))
                             header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
                             set_admin_map(admin_chat, header_msg.message_id, int(user.id))
-                else:
-                    res = await bot.copy_message(chat_id=admin_chat, from_chat_id=first_message.chat.id, message_id=first_message.message_id, message_thread_id=thread_id)
-                    set_admin_map(admin_chat, res.message_id, int(user.id))
-                    header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
-                    set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                        else:
+                            media_group = []
+                            for i, m in enumerate(album_msgs):
+                                caption = getattr(m, "html_text", None) or getattr(m, "caption_html", None) or None
+                                cap = caption if i == 0 else None
+                                if m.photo:
+                                    file_id = m.photo[-1].file_id
+                                    media_group.append(InputMediaPhoto(media=file_id, caption=cap, parse_mode="HTML"))
+                                elif m.video:
+                                    media_group.append(InputMediaVideo(media=m.video.file_id, caption=cap, parse_mode="HTML"))
+                                elif getattr(m, "document", None):
+                                    media_group.append(InputMediaDocument(media=m.document.file_id, caption=cap, parse_mode="HTML"))
+                                elif getattr(m, "audio", None):
+                                    media_group.append(InputMediaAudio(media=m.audio.file_id, caption=cap, parse_mode="HTML"))
+                                else:
+                                    res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
+                                    set_admin_map(admin_chat, res.message_id, int(user.id))
+                            if media_group:
+                                sent = await bot.send_media_group(chat_id=admin_chat, media=media_group, message_thread_id=thread_id)
+                                for s in sent:
+                                    set_admin_map(admin_chat, s.message_id, int(user.id))
+                                header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
+                                set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                    else:
+                        res = await bot.copy_message(chat_id=admin_chat, from_chat_id=first_message.chat.id, message_id=first_message.message_id, message_thread_id=thread_id)
+                        set_admin_map(admin_chat, res.message_id, int(user.id))
+                        header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
+                        set_admin_map(admin_chat, header_msg.message_id, int(user.id))
 
             # уведомляем пользователя и помечаем заявку
             await bot.send_message(chat_id=user.id, text="✅ Ваша заявка отправлена администраторам.\nОжидайте ответа.")
-            mark_submitted(user_id_str)
+            with span("mark_submitted"):
+                mark_submitted(user_id_str)
+            bot_metrics.event("submission")
 
         except TelegramBadRequest as e:
             print(f"[BAD_REQUEST] {e!r}")
@@ -1184,18 +1567,24 @@ async def collect_user_messages(message: Message):
         return
 
     async def _collector(uid: str):
-        await asyncio.sleep(3)
-        msgs = submission_buffers.pop(uid, [])
-        collecting_tasks.pop(uid, None)
-        if not msgs:
-            return
-        if len(msgs) == 1:
-            await handle_submission(msgs[0])
-        else:
-            await handle_submission(msgs)
+        # трасса заявки; родитель — трасса апдейта, начавшего сбор (контекст задачи наследуется)
+        with start_trace("submission", user=uid) as trace:
+            with span("collect.wait"):
+                await asyncio.sleep(3)
+            msgs = submission_buffers.pop(uid, [])
+            collecting_tasks.pop(uid, None)
+            trace.attrs["messages"] = len(msgs)
+            if not msgs:
+                return
+            if len(msgs) == 1:
+                await handle_submission(msgs[0])
+            else:
+                await handle_submission(msgs)
 
     task = asyncio.create_task(_collector(user_id_str))
     collecting_tasks[user_id_str] = task
+    inflight_submissions.add(task)
+    task.add_done_callback(inflight_submissions.discard)
 
 
 # ===================== АДМИН: ответ reply -> пользователю =====================
@@ -1257,20 +1646,74 @@ async def leave_any_group(message: Message):
             print(f"[ERROR] Не удалось выйти из чата {message.chat.id}: {e}")
 
 
+# ===================== SHUTDOWN =====================
+
+def flush_submission_buffers() -> None:
+    """
+    Досылает накопленные буферы заявок сразу, не дожидаясь окна коллектора.
+    Спящие коллекторы отменяются, вместо них запускается handle_submission.
+    """
+    for uid, task in list(collecting_tasks.items()):
+        if not task.done():
+            task.cancel()
+    collecting_tasks.clear()
+    for uid, msgs in list(submission_buffers.items()):
+        submission_buffers.pop(uid, None)
+        if not msgs:
+            continue
+        task = asyncio.create_task(handle_submission(msgs[0] if len(msgs) == 1 else msgs))
+        inflight_submissions.add(task)
+        task.add_done_callback(inflight_submissions.discard)
+
+
+def persist_stores() -> None:
+    save_admin_map(admin_message_to_user)
+    save_admin_topics(admin_topics_map)
+    save_rejected(rejected_users)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    Вызывается aiogram после остановки polling (SIGTERM/SIGINT) — новые апдейты уже не принимаются.
+    Сессия бота закрывается aiogram после этого хука.
+    """
+    report = ShutdownReport()
+    print("[SHUTDOWN] polling остановлен, завершаем обработку...")
+    # принятые апдейты: очередь лимитера и хендлеры, которые ещё выполняются
+    await report.drain("updates", update_limiter.drain)
+    await report.wait_tasks("handlers", handler_tasks)
+    # буферы заявок -> рассылка в админ-чаты
+    flush_submission_buffers()
+    await report.wait_tasks("submissions", inflight_submissions)
+    # очередь логов в админ-чаты
+    await report.drain("admin_log", admin_log_outbox.drain)
+    report.run_sync("stores", persist_stores)
+    report.log_summary()
+    await stop_metrics_server()
+    report.run_sync("logs", flush_logging)
+
+
 # ===================== MAIN =====================
-async def main():
+async def on_startup():
     print(f"[BOOT] ADMIN_CHAT_IDS={ADMIN_CHAT_IDS}, ADMIN_THREAD_IDS={ADMIN_THREAD_IDS}, ADMIN_THREAD_NAMES={ADMIN_THREAD_NAMES}, ADMIN_LOG_THREAD_IDS={ADMIN_LOG_THREAD_IDS}, MAIN_ADMIN_IDS={MAIN_ADMIN_IDS}, ADMINS={ADMINS}")
+    await start_metrics_server()
+    loop_monitor.start()
     # Попытка заранее создать темы, которые указаны в ADMIN_THREAD_NAMES и ещё не сохранены
     for admin_chat in ADMIN_CHAT_IDS:
         try:
             await ensure_or_create_topic_for_chat(admin_chat)
         except Exception:
             pass
-    await dp.start_polling(bot)
 
 
-if __name__ == "__main__":
-    asyncio.run(main())
+# хуки регистрируются при импорте, чтобы host.py мог запускать dp без main()
+dp.startup.register(on_startup)
+dp.startup.register(notify_ready)
+dp.shutdown.register(on_shutdown)
+
+
+async def main():
+    await dp.start_polling(bot, **POLLING_KWARGS)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ===================== OUTBOX: очередь исходящих сообщений =====================
+
+class Outbox:
+    """
+    Ограниченная очередь исходящих отправок (лог-сообщения в админ-чаты и т.п.).
+    Хендлер кладёт фабрику корутины и сразу продолжает работу; фоновые воркеры отправляют.
+    Отправка выполняется в контексте (contextvars) того, кто её поставил, — метрики и трассировка
+    относят её к исходному хендлеру.
+    При переполнении новые элементы отбрасываются и учитываются в dropped.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1000, workers: int = 1):
+        self.name = name
+        self.maxsize = maxsize
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.sent = 0
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def put(self, factory: Callable[[], Awaitable]) -> bool:
+        if self._closed:
+            self.dropped += 1
+            return False
+        if not self._tasks:
+            self.start()
+        try:
+            self.queue.put_nowait((factory, contextvars.copy_context()))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "sent": self.sent, "dropped": self.dropped}
+
+    async def _worker(self) -> None:
+        while True:
+            factory, ctx = await self.queue.get()
+            try:
+                await asyncio.create_task(factory(), context=ctx)
+                self.sent += 1
+            except Exception as e:
+                logger.warning(f"[OUTBOX:{self.name}] отправка не удалась: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def drain(self, timeout: Optional[float]) -> int:
+        """
+        Перестаёт принимать новые элементы, ждёт опустошения очереди не дольше timeout,
+        останавливает воркеров. Возвращает число неотправленных (отброшенных) элементов.
+        """
+        self._closed = True
+        if self._tasks and not self.queue.empty():
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        left = 0
+        while not self.queue.empty():
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                left += 1
+            except asyncio.QueueEmpty:
+                break
+        for t in self._tasks:
+            t.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.dropped += left
+        return left
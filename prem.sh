@@ -1,63 +1,76 @@
 set -euo pipefail
 
-SESSION="prem"
 # рабочая директория — папка скрипта
 DIR="$(cd "$(dirname "$0")" && pwd)"
 PYTHON="${PYTHON:-python3}"
+PIDFILE="$DIR/logs/supervisor.pid"
 
 usage() {
   cat <<EOF
 Использование: $0 {start|stop|restart|status|attach}
-  start   - создать сессию и запустить n.py и sup.py
-  stop    - остановить (убить) tmux сессию
+  start   - запустить supervisor.py (он поднимает n.py и sup.py и перезапускает их при падении)
+  stop    - остановить супервизор (SIGTERM, боты завершаются корректно)
   restart - stop затем start
-  status  - показать статус (окна) сессии
-  attach  - подключиться к сессии (tmux attach)
+  status  - показать статус супервизора и ботов
+  attach  - смотреть логи (tail -f)
 EOF
 }
 
+is_running() {
+  [ -f "$PIDFILE" ] && kill -0 "$(cat "$PIDFILE")" 2>/dev/null
+}
+
 start() {
-  if tmux has-session -t "$SESSION" 2>/dev/null; then
-    echo "Сессия '$SESSION' уже запущена."
+  if is_running; then
+    echo "Супервизор уже запущен (pid $(cat "$PIDFILE"))."
     return 0
   fi
 
   mkdir -p "$DIR/logs"
+  cd "$DIR"
+  nohup $PYTHON supervisor.py >> "$DIR/logs/supervisor.log" 2>&1 &
+  echo $! > "$PIDFILE"
 
-  # создаём сессию и окно для n.py
-  tmux new-session -d -s "$SESSION" -n n
-  tmux send-keys -t "$SESSION":n "cd '$DIR' && exec $PYTHON n.py >> '$DIR/logs/n.log' 2>&1" C-m
-
-  # создаём окно для sup.py
-  tmux new-window -t "$SESSION" -n sup
-  tmux send-keys -t "$SESSION":sup "cd '$DIR' && exec $PYTHON sup.py >> '$DIR/logs/sup.log' 2>&1" C-m
-
-  echo "Запущено: сессия '$SESSION' с окнами 'n' и 'sup'. Логи: $DIR/logs/"
+  echo "Запущен супервизор (pid $(cat "$PIDFILE")) для n.py и sup.py. Логи: $DIR/logs/"
 }
 
 stop() {
-  if tmux has-session -t "$SESSION" 2>/dev/null; then
-    tmux kill-session -t "$SESSION"
-    echo "Сессия '$SESSION' остановлена."
+  if is_running; then
+    pid="$(cat "$PIDFILE")"
+    # супервизор перешлёт SIGTERM ботам и дождётся их завершения
+    kill -TERM "$pid"
+    for _ in $(seq 1 "${STOP_TIMEOUT:-30}"); do
+      if ! kill -0 "$pid" 2>/dev/null; then
+        rm -f "$PIDFILE"
+        echo "Супервизор остановлен."
+        return 0
+      fi
+      sleep 1
+    done
+    kill -KILL "$pid" 2>/dev/null || true
+    rm -f "$PIDFILE"
+    echo "Супервизор остановлен принудительно (таймаут)."
   else
-    echo "Сессия '$SESSION' не найдена."
+    rm -f "$PIDFILE"
+    echo "Супервизор не запущен."
   fi
 }
 
 status() {
-  if tmux has-session -t "$SESSION" 2>/dev/null; then
-    echo "Сессия '$SESSION' запущена. Окна:"
-    tmux list-windows -t "$SESSION"
+  if is_running; then
+    pid="$(cat "$PIDFILE")"
+    echo "Супервизор запущен (pid $pid). Боты:"
+    ps --ppid "$pid" -o pid,etime,rss,args || true
   else
-    echo "Сессия '$SESSION' не запущена."
+    echo "Супервизор не запущен."
   fi
 }
 
 attach() {
-  if tmux has-session -t "$SESSION" 2>/dev/null; then
-    tmux attach -t "$SESSION"
+  if [ -d "$DIR/logs" ]; then
+    tail -n 50 -f "$DIR/logs/"*.log
   else
-    echo "Сессия '$SESSION' не найдена. Запустите: $0 start"
+    echo "Логов нет. Запустите: $0 start"
     return 1
   fi
 }
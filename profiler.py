@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Семплирующий профайлер потока event loop для /profile: отдельный поток раз в PROFILE_INTERVAL
+# снимает стек loop через sys._current_frames() — код бота не инструментируется, работа не
+# останавливается. Результат — collapsed stacks (flamegraph.pl, speedscope) и топ функций.
+# Накладные расходы ограничены: если семплирование занимает больше PROFILE_MAX_OVERHEAD
+# от времени работы, интервал увеличивается; окно не длиннее PROFILE_MAX_SECONDS.
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_MAX_OVERHEAD = float(os.getenv("PROFILE_MAX_OVERHEAD", "0.02"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
+STACK_DEPTH = 64
+
+# loop ждёт событий в селекторе — это простой, а не работа
+_IDLE_FUNCS = {("selectors.py", "select"), ("selectors.py", "poll")}
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+def _frame_key(frame) -> Tuple[str, str]:
+    return os.path.basename(frame.f_code.co_filename), frame.f_code.co_name
+
+
+class SamplingProfiler:
+    """Один прогон профайлера; создаётся на каждый /profile."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_overhead: float = PROFILE_MAX_OVERHEAD):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.sampling_time = 0.0
+        self.elapsed = 0.0
+        self._target: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: int) -> None:
+        self._target = thread_id
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self) -> None:
+        t0 = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            s0 = time.perf_counter()
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < STACK_DEPTH:
+                stack.append(_frame_key(frame))
+                frame = frame.f_back
+            self.samples += 1
+            if stack and stack[0] in _IDLE_FUNCS:
+                self.idle += 1
+            else:
+                self.stacks[tuple(reversed(stack))] += 1
+            spent = time.perf_counter() - s0
+            self.sampling_time += spent
+            # держим долю времени на семплирование не выше max_overhead
+            if self.sampling_time > self.max_overhead * (time.perf_counter() - t0):
+                self.interval = min(self.interval * 2, 0.5)
+        self.elapsed = time.perf_counter() - t0
+
+    # ---------- отчёты ----------
+
+    def collapsed(self) -> str:
+        lines = [
+            ";".join(f"{name} ({fname})" for fname, name in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        if self.idle:
+            lines.append(f"<idle> {self.idle}")
+        return "\n".join(lines) + "\n"
+
+    def top(self, n: int = PROFILE_TOP) -> List[Dict[str, object]]:
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for key in set(stack):
+                total[key] += count
+        return [
+            {"func": f"{name} ({fname})", "self": cnt, "total": total[(fname, name)]}
+            for (fname, name), cnt in own.most_common(n)
+        ]
+
+    def summary(self, n: int = PROFILE_TOP) -> str:
+        busy = self.samples - self.idle
+        out = [
+            f"samples={self.samples} busy={busy} ({busy * 100 / max(1, self.samples):.1f}%) idle={self.idle} "
+            f"window={self.elapsed:.1f}s interval={self.interval * 1000:.1f}ms "
+            f"overhead={self.sampling_time * 100 / max(1e-9, self.elapsed):.2f}%",
+            "",
+            f"{'self%':>7} {'total%':>7}  function (busy samples)",
+        ]
+        for row in self.top(n):
+            out.append(f"{row['self'] * 100 / max(1, busy):>6.1f}% {row['total'] * 100 / max(1, busy):>6.1f}%  {row['func']}")
+        return "\n".join(out) + "\n"
+
+
+_running = False
+
+
+async def profile(seconds: float) -> SamplingProfiler:
+    """Профилирует поток текущего event loop seconds секунд (не больше PROFILE_MAX_SECONDS)."""
+    global _running
+    if _running:
+        raise ProfileBusy("профилирование уже идёт")
+    _running = True
+    prof = SamplingProfiler()
+    try:
+        prof.start(threading.get_ident())
+        await asyncio.sleep(max(0.1, min(seconds, PROFILE_MAX_SECONDS)))
+    finally:
+        prof.stop()
+        _running = False
+    return prof
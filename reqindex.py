@@ -0,0 +1,237 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, List, Optional, Tuple
+
+# Вторичные индексы записей requests.json: username, язык, состояние заявки и started_at.
+# requests.json — плоский словарь по user_id, любой другой запрос к нему — полный перебор.
+# Индексы строятся при старте и обновляются точечно при каждой записи (put/drop из функций,
+# меняющих заявку): для пользователя запоминается, под какими ключами он проиндексирован,
+# и при изменении переносится только то, что поменялось.
+# started_at хранится отсортированным списком (iso-строка, user_id) по каждому состоянию —
+# выборка по диапазону времени и подсчёт — бинарным поиском.
+# Очередь на рассмотрение (/queue) — так же отсортированный список (submitted_at, user_id)
+# отправленных заявок без решения админа; вставка и удаление — бинарным поиском.
+# Для /user индекс хранит и то, что показывается о заявке (имя, username как есть, решение), —
+# summary() собирает запись в формате requests.json без чтения файла; submitted_at хранится
+# и после решения — по нему различаются повторные заявки одного пользователя.
+
+STATES = ("new", "started", "submitted")
+
+_IndexKey = Tuple[str, Tuple[str, ...], str, str, str]  # username, langs, state, started_at, pending_at
+
+
+def request_state(rec: dict) -> str:
+    if rec.get("submitted"):
+        return "submitted"
+    if rec.get("started_at"):
+        return "started"
+    return "new"
+
+
+def pending_since(rec: dict) -> str:
+    """submitted_at заявки, ждущей решения; "" — не в очереди (в т.ч. отправленные до появления submitted_at)."""
+    if rec.get("submitted") and not rec.get("decision"):
+        return str(rec.get("submitted_at") or "")
+    return ""
+
+
+def _norm_username(username: str) -> str:
+    return username.strip().lstrip("@").lower()
+
+
+def _key(rec: dict) -> _IndexKey:
+    return (
+        _norm_username(rec.get("username") or ""),
+        tuple(str(x) for x in rec.get("langs") or ()),
+        request_state(rec),
+        str(rec.get("started_at") or ""),
+        pending_since(rec),
+    )
+
+
+def _details(rec: dict) -> Tuple[str, str, str, str, str]:
+    return (str(rec.get("full_name") or ""), str(rec.get("username") or ""), str(rec.get("decision") or ""),
+            str(rec.get("submitted_at") or ""), str(rec.get("decided_at") or ""))
+
+
+class RequestIndex:
+    def __init__(self):
+        self.load({})
+
+    def load(self, data: Dict[str, dict]) -> None:
+        self._keys: Dict[int, _IndexKey] = {}
+        self.usernames: Dict[str, int] = {}
+        self.langs: Dict[str, Dict[int, None]] = {}
+        self.states: Dict[str, Dict[int, None]] = {s: {} for s in STATES}
+        self.started: Dict[str, List[Tuple[str, int]]] = {s: [] for s in STATES}
+        self.pending: List[Tuple[str, int]] = []
+        self.headers: Dict[int, Dict[str, int]] = {}
+        # full_name, username, decision, submitted_at, decided_at
+        self.details: Dict[int, Tuple[str, str, str, str, str]] = {}
+        for uid, rec in data.items():
+            try:
+                self._add(int(uid), _key(rec), rec)
+            except (TypeError, ValueError):
+                continue
+        for items in self.started.values():
+            items.sort()
+        self.pending.sort()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._keys
+
+    # --------- обновление ---------
+
+    def _add(self, uid: int, key: _IndexKey, rec: dict, sort: bool = False) -> None:
+        username, langs, state, started_at, pending_at = key
+        self._keys[uid] = key
+        if username:
+            self.usernames[username] = uid
+        for lang in langs:
+            self.langs.setdefault(lang, {})[uid] = None
+        self.states[state][uid] = None
+        if started_at:
+            if sort:
+                insort(self.started[state], (started_at, uid))
+            else:
+                self.started[state].append((started_at, uid))
+        if pending_at:
+            if sort:
+                insort(self.pending, (pending_at, uid))
+            else:
+                self.pending.append((pending_at, uid))
+        if rec.get("headers"):
+            self.headers[uid] = dict(rec["headers"])
+        self.details[uid] = _details(rec)
+
+    @staticmethod
+    def _discard(items: List[Tuple[str, int]], item: Tuple[str, int]) -> None:
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def _remove(self, uid: int, key: _IndexKey) -> None:
+        username, langs, state, started_at, pending_at = key
+        del self._keys[uid]
+        if username and self.usernames.get(username) == uid:
+            del self.usernames[username]
+        for lang in langs:
+            users = self.langs.get(lang)
+            if users is not None:
+                users.pop(uid, None)
+                if not users:
+                    del self.langs[lang]
+        self.states[state].pop(uid, None)
+        if started_at:
+            self._discard(self.started[state], (started_at, uid))
+        if pending_at:
+            self._discard(self.pending, (pending_at, uid))
+        self.headers.pop(uid, None)
+        self.details.pop(uid, None)
+
+    def put(self, uid, rec: dict) -> None:
+        uid = int(uid)
+        key = _key(rec)
+        old = self._keys.get(uid)
+        if old == key and self.headers.get(uid) == (rec.get("headers") or None) and self.details.get(uid) == _details(rec):
+            return
+        if old is not None:
+            self._remove(uid, old)
+        self._add(uid, key, rec, sort=True)
+
+    def drop(self, uid) -> None:
+        uid = int(uid)
+        old = self._keys.get(uid)
+        if old is not None:
+            self._remove(uid, old)
+
+    # --------- запросы ---------
+
+    def by_username(self, username: str) -> Optional[int]:
+        return self.usernames.get(_norm_username(username))
+
+    def with_lang(self, lang: str) -> List[int]:
+        return list(self.langs.get(lang, ()))
+
+    def lang_counts(self) -> Dict[str, int]:
+        return {lang: len(users) for lang, users in self.langs.items()}
+
+    def in_state(self, state: str) -> List[int]:
+        return list(self.states[state])
+
+    def count(self, state: Optional[str] = None) -> int:
+        return len(self._keys) if state is None else len(self.states[state])
+
+    def started_between(self, since: str = "", until: Optional[str] = None, state: Optional[str] = None) -> List[Tuple[str, int]]:
+        """(started_at, user_id) по возрастанию времени; since/until — iso-строки в формате записей."""
+        out: List[Tuple[str, int]] = []
+        for s in (STATES if state is None else (state,)):
+            items = self.started[s]
+            lo = bisect_left(items, (since,))
+            hi = len(items) if until is None else bisect_right(items, (until, float("inf")))
+            out.extend(items[lo:hi])
+        if state is None:
+            out.sort()
+        return out
+
+    def count_started(self, since: str = "", until: Optional[str] = None, state: str = "started") -> int:
+        items = self.started[state]
+        lo = bisect_left(items, (since,))
+        hi = len(items) if until is None else bisect_right(items, (until, float("inf")))
+        return max(0, hi - lo)
+
+    # --------- очередь на рассмотрение ---------
+
+    def pending_page(self, after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None,
+                     limit: int = 20) -> Tuple[List[Tuple[str, int]], int, bool, bool]:
+        """
+        Страница очереди от самых старых: после курсора after или перед before (курсор — (submitted_at, user_id)).
+        Возвращает (записи, номер первой записи в очереди, есть_предыдущая, есть_следующая).
+        """
+        items = self.pending
+        if after is not None:
+            start = bisect_right(items, after)
+            end = min(len(items), start + limit)
+        elif before is not None:
+            end = bisect_left(items, before)
+            start = max(0, end - limit)
+        else:
+            start, end = 0, min(len(items), limit)
+        return items[start:end], start, start > 0, end < len(items)
+
+    def pending_at(self, uid: int) -> str:
+        """submitted_at заявки в очереди; "" — заявки в очереди нет."""
+        key = self._keys.get(int(uid))
+        return key[4] if key else ""
+
+    def overdue(self, cutoff: str) -> List[Tuple[str, int]]:
+        """Заявки очереди, отправленные раньше cutoff (iso-строка), — префикс отсортированного списка."""
+        return self.pending[:bisect_left(self.pending, (cutoff,))]
+
+    def submitted_at(self, uid: int) -> str:
+        """submitted_at последней отправленной заявки, в том числе уже решённой; "" — не отправлялась."""
+        details = self.details.get(int(uid))
+        return details[3] if details else ""
+
+    def summary(self, uid: int) -> Optional[dict]:
+        """Поля заявки, которые показывает /user, в формате записи requests.json; None — записи нет."""
+        key = self._keys.get(int(uid))
+        if key is None:
+            return None
+        full_name, username, decision, submitted_at, decided_at = self.details.get(int(uid), ("",) * 5)
+        return {
+            "full_name": full_name,
+            "username": username,
+            "langs": list(key[1]),
+            "started_at": key[3] or None,
+            "submitted": key[2] == "submitted",
+            "submitted_at": submitted_at or None,
+            "decision": decision or None,
+            "decided_at": decided_at or None,
+        }
+
+    def username_of(self, uid: int) -> str:
+        key = self._keys.get(uid)
+        return key[0] if key else ""
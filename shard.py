@@ -0,0 +1,265 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import importlib
+import multiprocessing as mp
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from supervisor import notify_ready
+
+# Шардированный режим: фронт-процесс получает апдейты (polling или webhook) и раздаёт их
+# N процессам-воркерам по user_id, так что апдейты одного пользователя всегда обрабатывает один воркер
+# и в исходном порядке. Воркеры делят состояние через JSON-хранилище под storage_lock (SHARD_COUNT > 1).
+# Запуск: python3 shard.py --workers 4 [--bot str] [--webhook 0.0.0.0:8080]
+
+logger = logging.getLogger("shard")
+
+API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+ALLOWED_UPDATES = [
+    u.strip() for u in os.getenv(
+        "SHARD_ALLOWED_UPDATES", "message,edited_message,callback_query,pre_checkout_query,chat_member,my_chat_member",
+    ).split(",") if u.strip()
+]
+QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))
+READY_TIMEOUT = float(os.getenv("SHARD_READY_TIMEOUT", "60"))
+
+# решения админа по заявке: апдейт относится к пользователю из callback_data, а не к админу
+_TARGET_CALLBACK_RE = re.compile(r"^(?:grantpay|reject|ban|unban)_(\d+)$")
+_TARGET_COMMAND_RE = re.compile(r"^/(?:ban|unban|clear_rejected)(?:@\w+)?\s+(\d+)\s*$")
+
+
+# ===================== ROUTING =====================
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """Ключ шардирования сырого апдейта (dict из getUpdates)."""
+    cq = update.get("callback_query")
+    if cq:
+        m = _TARGET_CALLBACK_RE.match(cq.get("data") or "")
+        if m:
+            return int(m.group(1))
+        return int((cq.get("from") or {}).get("id", 0))
+    for field in ("message", "edited_message", "pre_checkout_query", "chat_member", "my_chat_member"):
+        obj = update.get(field)
+        if not obj:
+            continue
+        m = _TARGET_COMMAND_RE.match(obj.get("text") or "") if field == "message" else None
+        if m:
+            return int(m.group(1))
+        user = obj.get("from") or {}
+        if user.get("id"):
+            return int(user["id"])
+        return int((obj.get("chat") or {}).get("id", 0))
+    return 0
+
+
+def shard_for(update: Dict[str, Any], count: int) -> int:
+    return abs(shard_key(update)) % count
+
+
+# ===================== WORKER =====================
+
+async def _worker_loop(index: int, module_name: str, queue: Any, session_factory: Optional[str], ready: Any) -> None:
+    module = importlib.import_module(module_name)
+    dp, bot = module.dp, module.bot
+    if session_factory:
+        mod_name, _, attr = session_factory.partition(":")
+        bot.session = getattr(importlib.import_module(mod_name), attr)()
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+    ready.set()
+
+    loop = asyncio.get_running_loop()
+    parent = os.getppid()
+    locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    pending: Dict[int, int] = defaultdict(int)
+    tasks: set = set()
+
+    async def _process(key: int, raw: Dict[str, Any]) -> None:
+        # порядок внутри пользователя: asyncio.Lock отдаёт блокировку в порядке ожидания
+        try:
+            async with locks[key]:
+                await dp.feed_raw_update(bot, raw)
+        except Exception as e:
+            logger.exception(f"[SHARD {index}] ошибка обработки апдейта {raw.get('update_id')}: {e}")
+        finally:
+            pending[key] -= 1
+            if pending[key] <= 0:
+                pending.pop(key, None)
+                locks.pop(key, None)
+
+    def _get():
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except Exception:
+                # фронт умер — выходим, чтобы не висеть сиротой
+                if os.getppid() != parent:
+                    return None
+
+    while True:
+        batch = await loop.run_in_executor(None, _get)
+        if batch is None:
+            break
+        for raw in batch:
+            key = shard_key(raw)
+            pending[key] += 1
+            task = asyncio.create_task(_process(key, raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+    await bot.session.close()
+
+
+def run_worker(index: int, count: int, module_name: str, queue: Any, ready: Any, session_factory: Optional[str] = None) -> None:
+    # останавливает воркеров фронт (сентинелом None), сигналы группы игнорируем
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, module_name, queue, session_factory, ready))
+
+
+def start_workers(count: int, module_name: str, session_factory: Optional[str] = None) -> tuple:
+    """Запускает воркеров (spawn). SHARD_COUNT/SHARD_INDEX передаются через окружение до импорта бота."""
+    ctx = mp.get_context("spawn")
+    queues, procs, events = [], [], []
+    os.environ["SHARD_COUNT"] = str(count)
+    for i in range(count):
+        q = ctx.Queue(maxsize=QUEUE_SIZE)
+        ready = ctx.Event()
+        os.environ["SHARD_INDEX"] = str(i)
+        p = ctx.Process(target=run_worker, args=(i, count, module_name, q, ready, session_factory), name=f"shard-{i}")
+        p.start()
+        queues.append(q)
+        procs.append(p)
+        events.append(ready)
+    for p, ready in zip(procs, events):
+        if not ready.wait(READY_TIMEOUT):
+            logger.warning(f"[SHARD] {p.name} не сообщил о готовности за {READY_TIMEOUT:.0f}s")
+    return queues, procs
+
+
+def dispatch(queues: List[Any], updates: List[Dict[str, Any]]) -> None:
+    """Раскладывает пачку апдейтов по шардам (одна put на шард, порядок внутри шарда сохраняется)."""
+    batches: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for upd in updates:
+        batches[shard_for(upd, len(queues))].append(upd)
+    for idx, batch in batches.items():
+        queues[idx].put(batch)
+
+
+def stop_workers(queues: List[Any], procs: List[Any], timeout: float = STOP_TIMEOUT) -> None:
+    for q in queues:
+        q.put(None)
+    deadline = time.monotonic() + timeout
+    for p in procs:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            logger.warning(f"[SHARD] {p.name} не завершился за {timeout:.0f}s, terminate")
+            p.terminate()
+
+
+# ===================== FRONT =====================
+
+async def _poll(token: str, queues: List[Any], stop: asyncio.Event) -> None:
+    url = f"{API_BASE}/bot{token}/getUpdates"
+    offset = None
+    loop = asyncio.get_running_loop()
+    async with aiohttp.ClientSession() as session:
+        while not stop.is_set():
+            params = {"timeout": 10, "allowed_updates": json.dumps(ALLOWED_UPDATES)}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=20)) as resp:
+                    js = await resp.json(content_type=None)
+            except Exception as e:
+                logger.warning(f"[SHARD] getUpdates не удался: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not js.get("ok"):
+                logger.warning(f"[SHARD] getUpdates вернул ошибку: {js}")
+                await asyncio.sleep(float((js.get("parameters") or {}).get("retry_after", 1)))
+                continue
+            updates = js.get("result") or []
+            if updates:
+                offset = updates[-1]["update_id"] + 1
+                # put может блокироваться при заполненных очередях — это и есть backpressure для фронта
+                await loop.run_in_executor(None, dispatch, queues, updates)
+
+
+async def _webhook(bind: str, queues: List[Any], stop: asyncio.Event) -> None:
+    from aiohttp import web
+
+    secret = os.getenv("SHARD_WEBHOOK_SECRET")
+    path = os.getenv("SHARD_WEBHOOK_PATH", "/webhook")
+    loop = asyncio.get_running_loop()
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=403)
+        upd = await request.json()
+        await loop.run_in_executor(None, dispatch, queues, [upd])
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host, _, port = bind.rpartition(":")
+    site = web.TCPSite(runner, host or "0.0.0.0", int(port))
+    await site.start()
+    logger.info(f"[SHARD] webhook слушает {bind}{path}")
+    await stop.wait()
+    await runner.cleanup()
+
+
+async def run_front(args: argparse.Namespace) -> None:
+    load_dotenv(args.env_file)
+    token = os.getenv(args.token_env)
+    if not token:
+        raise RuntimeError(f"{args.token_env} не найден в {args.env_file}")
+    loop = asyncio.get_running_loop()
+    queues, procs = await loop.run_in_executor(None, start_workers, args.workers, args.bot)
+    logger.info(f"[SHARD] запущено воркеров: {args.workers} ({args.bot})")
+    notify_ready()
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    receiver = _webhook(args.webhook, queues, stop) if args.webhook else _poll(token, queues, stop)
+    task = asyncio.create_task(receiver)
+    await stop.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    logger.info("[SHARD] остановка воркеров...")
+    await loop.run_in_executor(None, stop_workers, queues, procs)
+    logger.info("[SHARD] остановлен")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Шардированная обработка апдейтов по user_id")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2))))
+    parser.add_argument("--bot", default=os.getenv("SHARD_BOT", "str"), help="модуль бота с bot/dp")
+    parser.add_argument("--env-file", default=".env.prem")
+    parser.add_argument("--token-env", default="BOT_TOKEN2")
+    parser.add_argument("--webhook", default=os.getenv("SHARD_WEBHOOK"), help="host:port для приёма webhook вместо polling")
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(run_front(args))
+
+
+if __name__ == "__main__":
+    main()
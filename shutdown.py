@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# общий дедлайн на всё завершение (секунды); prem.sh stop ждёт чуть дольше
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "15"))
+
+
+# ===================== GRACEFUL SHUTDOWN =====================
+
+class ShutdownReport:
+    """
+    Отслеживает дедлайн завершения, время шагов и число потерянных элементов.
+    Порядок шагов задаёт сам бот (см. on_shutdown в str.py / n.py).
+    """
+
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT):
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.steps: Dict[str, float] = {}
+        self.dropped: Dict[str, int] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def drop(self, name: str, count: int) -> None:
+        if count:
+            self.dropped[name] = self.dropped.get(name, 0) + count
+
+    async def wait_tasks(self, name: str, tasks: Iterable[asyncio.Task]) -> None:
+        """Ждёт задачи в пределах оставшегося времени, остальные отменяет и считает потерянными."""
+        t0 = time.monotonic()
+        current = asyncio.current_task()
+        pending = {t for t in list(tasks) if not t.done() and t is not current}
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=self.remaining())
+            for t in pending:
+                t.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        self.drop(name, len(pending))
+        self.steps[name] = time.monotonic() - t0
+
+    async def drain(self, name: str, drainer: Callable[[Optional[float]], Awaitable[int]]) -> None:
+        """Очередь с методом drain(timeout) -> число отброшенных (Outbox, UpdateLimiter)."""
+        t0 = time.monotonic()
+        self.drop(name, await drainer(self.remaining()))
+        self.steps[name] = time.monotonic() - t0
+
+    def run_sync(self, name: str, fn: Callable[[], None]) -> None:
+        """Синхронный шаг без дедлайна (сохранение хранилищ выполняется всегда)."""
+        t0 = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"[SHUTDOWN] шаг {name} завершился ошибкой: {e}")
+        self.steps[name] = time.monotonic() - t0
+
+    def log_summary(self) -> None:
+        elapsed = time.monotonic() - self.started
+        steps = ", ".join(f"{k}={v:.2f}s" for k, v in self.steps.items()) or "-"
+        dropped = ", ".join(f"{k}={v}" for k, v in self.dropped.items()) or "0"
+        logger.info(f"[SHUTDOWN] завершено за {elapsed:.2f}s; шаги: {steps}; потеряно: {dropped}")
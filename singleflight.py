@@ -0,0 +1,54 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Однократное выполнение по ключу (кнопки решений в админ-чатах): пока первый вызов с ключом
+# выполняется, повторные ждут его результат, а не запускают работу заново; после завершения
+# результат хранится ttl секунд, и поздние повторы получают его сразу.
+# Неудачный вызов (исключение, отмена или результат False) не кешируется — его можно повторить.
+
+FAILED = object()  # результат для ожидавших, если первый вызов не удался
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = 30.0, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.done: Dict[Hashable, Tuple[float, Any]] = {}  # ключ -> (истекает, результат), по времени завершения
+        self.deduplicated = 0
+
+    def _expire(self, now: float) -> None:
+        while self.done:
+            key = next(iter(self.done))
+            if self.done[key][0] > now and len(self.done) <= self.maxsize:
+                break
+            del self.done[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(результат, получен ли он от другого вызова); ожидавшие неудачный вызов получают FAILED."""
+        self._expire(time.monotonic())
+        cached = self.done.get(key)
+        if cached is not None:
+            self.deduplicated += 1
+            return cached[1], True
+        fut = self.inflight.get(key)
+        if fut is not None:
+            self.deduplicated += 1
+            # shield: отмена ожидающего не отменяет общий результат
+            return await asyncio.shield(fut), True
+
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[key] = fut
+        result = FAILED
+        try:
+            result = await fn()
+            return result, False
+        finally:
+            del self.inflight[key]
+            fut.set_result(result)
+            if result is not FAILED and result is not False:
+                self.done[key] = (time.monotonic() + self.ttl, result)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self.inflight), "cached": len(self.done), "deduplicated": self.deduplicated}
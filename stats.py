@@ -0,0 +1,249 @@
+import os
+import json
+import math
+import time
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Счётчики событий бота (заявки, отказы, баны, счета, оплаты, возвраты) для админской /stats.
+# Каждое событие — итог с момента первого запуска и кольцевой буфер по минутам за неделю;
+# суммы за час/сутки/неделю поддерживаются инкрементально при сдвиге минуты, поэтому ответ
+# /stats не зависит ни от числа пользователей, ни от размера JSON-файлов.
+# Длительности (время до решения по заявке) — в квантильных скетчах: логарифмические корзины
+# с относительной точностью SKETCH_ACCURACY, добавление O(1), память — десятки корзин на любой поток.
+# Снимок сохраняется в STATS_FILE при остановке (в шардированном режиме — у каждого шарда свой).
+
+WEEK_MINUTES = 7 * 24 * 60
+WINDOWS = {"час": 60, "сутки": 24 * 60, "неделя": WEEK_MINUTES}
+SPARK = "▁▂▃▄▅▆▇█"
+SKETCH_ACCURACY = 0.02  # относительная погрешность квантилей
+
+
+def _minute(ts: Optional[float] = None) -> int:
+    return int((time.time() if ts is None else ts) // 60)
+
+
+# ===================== ROLLING WINDOW =====================
+
+class RollingCounter:
+    """Кольцо из WEEK_MINUTES минутных корзин + текущие суммы по окнам WINDOWS."""
+
+    __slots__ = ("ring", "last", "sums")
+
+    def __init__(self, now: Optional[int] = None):
+        self.ring: List[float] = [0.0] * WEEK_MINUTES
+        self.last = _minute() if now is None else now
+        self.sums: Dict[int, float] = {w: 0.0 for w in WINDOWS.values()}
+
+    def _advance(self, now: int) -> None:
+        steps = now - self.last
+        if steps <= 0:
+            return
+        if steps >= WEEK_MINUTES:
+            self.ring = [0.0] * WEEK_MINUTES
+            self.sums = {w: 0.0 for w in self.sums}
+            self.last = now
+            return
+        for t in range(self.last + 1, now + 1):
+            # минута t - w выходит из окна w; для недели это та же корзина, что сейчас обнулится
+            for w in self.sums:
+                self.sums[w] -= self.ring[(t - w) % WEEK_MINUTES]
+            self.ring[t % WEEK_MINUTES] = 0.0
+        self.last = now
+
+    def add(self, value: float = 1.0, now: Optional[int] = None) -> None:
+        now = _minute() if now is None else now
+        self._advance(now)
+        self.ring[now % WEEK_MINUTES] += value
+        for w in self.sums:
+            self.sums[w] += value
+
+    def window(self, minutes: int, now: Optional[int] = None) -> float:
+        self._advance(_minute() if now is None else now)
+        return self.sums[minutes]
+
+    def hourly(self, hours: int = 24, now: Optional[int] = None) -> List[float]:
+        """Суммы по часам за последние hours часов (старые -> новые)."""
+        now = _minute() if now is None else now
+        self._advance(now)
+        out = []
+        for h in range(hours - 1, -1, -1):
+            end = now - h * 60
+            out.append(sum(self.ring[t % WEEK_MINUTES] for t in range(end - 59, end + 1)))
+        return out
+
+    def to_dict(self) -> Dict[str, float]:
+        # только ненулевые минуты: обычно это малая часть недели
+        return {str(t): self.ring[t % WEEK_MINUTES] for t in range(self.last - WEEK_MINUTES + 1, self.last + 1)
+                if self.ring[t % WEEK_MINUTES]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float], now: Optional[int] = None) -> "RollingCounter":
+        rc = cls(now)
+        for t, v in data.items():
+            t = int(t)
+            if rc.last - WEEK_MINUTES < t <= rc.last:
+                rc.ring[t % WEEK_MINUTES] += v
+                for w in rc.sums:
+                    if t > rc.last - w:
+                        rc.sums[w] += v
+        return rc
+
+
+def sparkline(values: List[float]) -> str:
+    top = max(values) if values else 0
+    if not top:
+        return SPARK[0] * len(values)
+    return "".join(SPARK[round(v / top * (len(SPARK) - 1))] for v in values)
+
+
+# ===================== QUANTILE SKETCH =====================
+
+class QuantileSketch:
+    """
+    Скетч квантилей неотрицательных величин: значение x > 0 попадает в корзину ceil(log_gamma(x)),
+    gamma = (1 + a) / (1 - a); оценка квантиля отличается от истинного значения не более чем на долю a.
+    """
+
+    __slots__ = ("gamma", "log_gamma", "buckets", "zeros", "count", "total", "max")
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        value = max(0.0, float(value))
+        if value < 1e-9:
+            self.zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # середина корзины (gamma^(k-1), gamma^k] в смысле относительной ошибки
+                return min(self.max, 2 * self.gamma ** key / (self.gamma + 1))
+        return self.max
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_dict(self) -> Dict:
+        return {"gamma": self.gamma, "zeros": self.zeros, "count": self.count, "total": self.total,
+                "max": self.max, "buckets": {str(k): v for k, v in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "QuantileSketch":
+        sk = cls()
+        if abs(float(data.get("gamma", sk.gamma)) - sk.gamma) > 1e-12:
+            # сохранено с другой точностью — корзины несовместимы, начинаем заново
+            return sk
+        sk.buckets = {int(k): int(v) for k, v in data.get("buckets", {}).items()}
+        sk.zeros = int(data.get("zeros", 0))
+        sk.count = int(data.get("count", 0))
+        sk.total = float(data.get("total", 0.0))
+        sk.max = float(data.get("max", 0.0))
+        return sk
+
+
+# ===================== EVENT STATS =====================
+
+class EventStats:
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.rolling: Dict[str, RollingCounter] = {}
+        self.sketches: Dict[str, QuantileSketch] = {}
+        self.since = time.time()
+
+    def add(self, name: str, value: float = 1.0) -> None:
+        self.totals[name] = self.totals.get(name, 0.0) + value
+        rc = self.rolling.get(name)
+        if rc is None:
+            rc = self.rolling[name] = RollingCounter()
+        rc.add(value)
+
+    def observe(self, name: str, value: float) -> None:
+        sk = self.sketches.get(name)
+        if sk is None:
+            sk = self.sketches[name] = QuantileSketch()
+        sk.add(value)
+
+    def quantiles(self, name: str, qs=(0.5, 0.9, 0.99)) -> Dict[float, float]:
+        """{q: значение}; пусто, если наблюдений ещё не было."""
+        sk = self.sketches.get(name)
+        if sk is None or not sk.count:
+            return {}
+        return {q: sk.quantile(q) for q in qs}
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """{событие: {"всего": ..., "час": ..., "сутки": ..., "неделя": ...}}"""
+        now = _minute()
+        out = {}
+        for name, total in self.totals.items():
+            rc = self.rolling[name]
+            out[name] = {"всего": total, **{label: rc.window(w, now) for label, w in WINDOWS.items()}}
+        return out
+
+    def trend(self, name: str, hours: int = 24) -> str:
+        rc = self.rolling.get(name)
+        return sparkline(rc.hourly(hours)) if rc is not None else ""
+
+    # --------- сохранение между перезапусками ---------
+
+    def save(self, path: str) -> None:
+        data = {
+            "since": self.since,
+            "totals": self.totals,
+            "minutes": {name: rc.to_dict() for name, rc in self.rolling.items()},
+            "sketches": {name: sk.to_dict() for name, sk in self.sketches.items()},
+        }
+        try:
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить {path}: {e}")
+
+    def load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = _minute()
+            self.since = float(data.get("since", self.since))
+            self.totals = {str(k): float(v) for k, v in data.get("totals", {}).items()}
+            self.rolling = {name: RollingCounter.from_dict(data.get("minutes", {}).get(name, {}), now)
+                            for name in self.totals}
+            self.sketches = {str(name): QuantileSketch.from_dict(sk) for name, sk in data.get("sketches", {}).items()}
+        except Exception as e:
+            logger.warning(f"{path} поврежден или не читается: {e}")
+
+
+def stats_file(default: str = "stats.json") -> str:
+    path = os.getenv("STATS_FILE", default)
+    shard = os.getenv("SHARD_INDEX")
+    if shard is not None and int(os.getenv("SHARD_COUNT", "1")) > 1:
+        # счётчики событий у каждого шарда свои
+        base, ext = os.path.splitext(path)
+        path = f"{base}.shard{shard}{ext}"
+    return path
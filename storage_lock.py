@@ -0,0 +1,104 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка не поддерживается
+    fcntl = None
+
+# Межпроцессная блокировка JSON-хранилища для шардированного режима (shard.py).
+# В обычном режиме (один процесс) SHARD_COUNT не задан и блокировка ничего не делает.
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0") or 0)
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0") or 0)
+SHARDED = SHARD_COUNT > 1
+LOCK_FILE = os.getenv("STORAGE_LOCK_FILE", ".storage.lock")
+# astorage_lock: пауза между попытками взять flock, пока его держит другой шард (экспоненциально до максимума)
+LOCK_POLL_MIN = 0.001
+LOCK_POLL_MAX = 0.05
+
+_rlock = threading.RLock()
+_depth = 0
+_fd = None
+_mtimes: Dict[str, float] = {}
+
+
+def _acquire(blocking: bool) -> bool:
+    global _depth, _fd
+    if not _rlock.acquire(blocking=blocking):
+        return False
+    if _depth == 0:
+        if _fd is None:
+            _fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(_fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            _rlock.release()
+            return False
+    _depth += 1
+    return True
+
+
+def _release() -> None:
+    global _depth
+    _depth -= 1
+    if _depth == 0:
+        fcntl.flock(_fd, fcntl.LOCK_UN)
+    _rlock.release()
+
+
+@contextmanager
+def storage_lock():
+    """
+    Реентерабельная блокировка read-modify-write для JSON-файлов.
+    Ждёт блокирующе — для потоков (asyncio.to_thread); в корутинах нужен astorage_lock.
+    Внутри нельзя делать await: блокировка держится потоком, а не корутиной.
+    """
+    if not SHARDED or fcntl is None:
+        yield
+        return
+    _acquire(blocking=True)
+    try:
+        yield
+    finally:
+        _release()
+
+
+@asynccontextmanager
+async def astorage_lock():
+    """
+    storage_lock для event loop: flock берётся с LOCK_NB, а пока его держит другой шард
+    (или поток to_thread) — ждём через asyncio.sleep, не останавливая loop.
+    Внутри, как и в storage_lock, нельзя делать await; вложенные storage_lock() реентерабельны.
+    """
+    if not SHARDED or fcntl is None:
+        yield
+        return
+    delay = LOCK_POLL_MIN
+    while not _acquire(blocking=False):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LOCK_POLL_MAX)
+    try:
+        yield
+    finally:
+        _release()
+
+
+def file_changed(path: str) -> bool:
+    """
+    True, если файл изменился (по mtime) с прошлой проверки — значит его переписал другой шард
+    и in-memory копию нужно перечитать. В обычном режиме всегда False.
+    """
+    if not SHARDED:
+        return False
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    if _mtimes.get(path) == mtime:
+        return False
+    _mtimes[path] = mtime
+    return True
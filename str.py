@@ -5,15 +5,20 @@ import random
 import re
 import uuid
 import logging
+import functools
+import time
+from bisect import bisect_left
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Union, Optional
+from typing import AsyncIterator, Dict, Iterable, List, Tuple, Union, Optional
 from html import escape
 
 import aiohttp
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.types import (
     Message,
@@ -22,10 +27,12 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     FSInputFile,
+    BufferedInputFile,
+    Update,
     PreCheckoutQuery,
     LabeledPrice,
 )
-from aiogram.filters import Command, ChatMemberUpdatedFilter, MEMBER
+from aiogram.filters import Command, CommandObject, ChatMemberUpdatedFilter, MEMBER
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
     InputMediaPhoto,
@@ -34,19 +41,34 @@ from aiogram.types import (
     InputMediaAudio,
 )
 
+from outbox import Outbox
+from backpressure import UpdateLimiter
+from banindex import BanIndex, IdStreamParser
+from reqindex import RequestIndex
+from userindex import UserIndex
+from logsetup import setup_logging, flush_logging
+from loopmon import MONITOR as loop_monitor
+from profiler import PROFILE_MAX_SECONDS, ProfileBusy, profile as run_profiler
+from metrics import ApiCallMetrics, MetricsMiddleware, api_path, start_server as start_metrics_server, stop_server as stop_metrics_server
+from shutdown import ShutdownReport
+from supervisor import notify_ready
+from tracing import TRACES, span, start_trace, traced
+from storage_lock import SHARDED, SHARD_INDEX, astorage_lock, storage_lock, file_changed
+from stats import stats_file
+from eventlog import EventLog
+from singleflight import FAILED, SingleFlight
+from fsmstore import CompactMemoryStorage
+from keyedlock import KeyedLock
+
+# LOG_* (как и остальные настройки) могут лежать в .env.prem — загружаем до setup_logging
+load_dotenv(".env.prem")
+
 # ===================== DEBUG LOGGING =====================
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("bot_debug.log", encoding="utf-8"),
-    ],
-)
+# запись в файл — в потоке QueueListener, ротация и формат через LOG_* (см. logsetup.py)
+setup_logging("bot_debug.log")
 logger = logging.getLogger(__name__)
 
 # ===================== ENV (robust parsing for multiple IDs) =====================
-load_dotenv(".env.prem")
 
 
 def _parse_int_list(env_name: str) -> List[int]:
@@ -98,11 +120,58 @@ if not API_TOKEN:
     logger.error("BOT_TOKEN2 не найден в .env.prem")
     raise RuntimeError("BOT_TOKEN2 не найден в .env.prem")
 
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+# TELEGRAM_API_BASE — локальный Bot API сервер или фейковый bench/fake_api.py для нагрузочных тестов
+API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+bot = Bot(
+    token=API_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(API_BASE)),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
+dp = Dispatcher(storage=CompactMemoryStorage())
+
+# метрики (/metrics при заданном METRICS_PORT); регистрируются до лимитера, чтобы считать и отброшенные апдейты
+BOT_NAME = os.path.splitext(os.path.basename(__file__))[0]
+bot_metrics = MetricsMiddleware(BOT_NAME)
+bot_metrics.setup(dp)
+# вызовы Bot API: задержка, статус, 429 — по методу, классу чата (user/admin) и хендлеру
+api_metrics = ApiCallMetrics(BOT_NAME, ADMIN_CHAT_IDS, token=API_TOKEN)
+bot.session.middleware(api_metrics)
+bot_metrics.watch("loop_lag", loop_monitor.lag_stats)
+
+
+def _is_low_priority_update(update: Update) -> bool:
+    """Шум из посторонних групп/каналов (leave_any_group, on_added) — первым отбрасывается при перегрузке."""
+    event = update.message or update.chat_member or update.my_chat_member
+    if event is None:
+        return False
+    return event.chat.type != "private" and event.chat.id not in ADMIN_CHAT_IDS
+
+
+# ограниченная очередь апдейтов: UPDATE_CONCURRENCY воркеров, по одному апдейту на пользователя одновременно
+update_limiter = UpdateLimiter(_is_low_priority_update)
+dp.update.outer_middleware(update_limiter)
+bot_metrics.watch("update_limiter", update_limiter.stats)
+# с handle_as_tasks=False заполненная очередь лимитера тормозит сам polling
+POLLING_KWARGS = {"handle_as_tasks": False}
+
+# задачи, в которых сейчас выполняются хендлеры (при завершении ждём их в пределах дедлайна)
+handler_tasks: set = set()
+
+
+async def _track_handler_task(handler, event, data):
+    task = asyncio.current_task()
+    handler_tasks.add(task)
+    try:
+        return await handler(event, data)
+    finally:
+        handler_tasks.discard(task)
+
+
+# регистрируется после лимитера — выполняется в задаче, которая реально обрабатывает апдейт
+dp.update.outer_middleware(_track_handler_task)
 
 # Объект для блокировки одновременной обработки заявок от одного пользователя
-user_submission_locks = defaultdict(asyncio.Lock)
+user_submission_locks = KeyedLock()
 
 REQUESTS_FILE = "requests.json"
 CONFIG_FILE = "config.json"
@@ -111,11 +180,35 @@ BANNED_FILE = "banned.json"
 ADMIN_MAP_FILE = "admin_map.json"  # сохраняет маппинг "chat:msg" -> user_id
 ADMIN_TOPICS_FILE = "admin_topics.json"  # сохраняет маппинг chat_id -> thread_id (созданные темы)
 REJECTED_FILE = "rejected.json"  # сохраняет пользователей, которым отклонили заявку
+BANNED_PAGE_SIZE = 50  # id на одной странице /banned
+QUEUE_PAGE_SIZE = 20  # заявок на одной странице /queue
+SLA_OVERDUE_HOURS = float(os.getenv("SLA_OVERDUE_HOURS", "72"))  # заявка без решения дольше — просрочена
+SLA_CHECK_SECONDS = float(os.getenv("SLA_CHECK_SECONDS", "900"))  # период проверки просроченных
+SLA_REMIND_HOURS = float(os.getenv("SLA_REMIND_HOURS", "24"))  # повтор напоминания, если новых просроченных нет
+SLA_REMIND_LIMIT = 20  # заявок в одном напоминании
+BAN_FILE_MAX_BYTES = 20 * 1024 * 1024  # предел Bot API на скачивание файла
 TRANSACTIONS_FILE = "transactions.json"  # сохраняет транзакции (list of records)
+STATS_FILE = stats_file()  # счётчики событий для /stats (сохраняются при остановке)
 
 # Buffers and tasks to collect messages sent by user within a short window
 submission_buffers: Dict[str, List[Message]] = defaultdict(list)
 collecting_tasks: Dict[str, asyncio.Task] = {}
+# коллекторы, уже отправляющие заявку (нужны при завершении, чтобы не оборвать рассылку)
+inflight_submissions: set = set()
+# фоновые прогоны /profile
+profile_tasks: set = set()
+
+# очередь лог-сообщений в админ-чаты (хендлеры не ждут рассылку логов)
+admin_log_outbox = Outbox("admin_log", maxsize=int(os.getenv("ADMIN_LOG_QUEUE_SIZE", "1000")))
+bot_metrics.watch("admin_log_outbox", admin_log_outbox.stats)
+# правка шапок заявки во всех админ-чатах после решения: несколько воркеров — правки идут параллельно,
+# но не больше DECISION_EDIT_WORKERS одновременно
+decision_outbox = Outbox("decision_mirror", maxsize=int(os.getenv("DECISION_QUEUE_SIZE", "1000")),
+                         workers=int(os.getenv("DECISION_EDIT_WORKERS", "4")))
+bot_metrics.watch("decision_outbox", decision_outbox.stats)
+# повторные нажатия кнопок решения (двойной тап, нажатие в двух чатах) выполняются один раз
+decision_flights = SingleFlight(ttl=float(os.getenv("DECISION_DEDUP_SECONDS", "30")))
+bot_metrics.watch("decision_flights", decision_flights.stats)
 
 # mapping admin chat+message -> user_id (ключ: "chat:msgid")
 admin_message_to_user: Dict[str, int] = {}
@@ -133,6 +226,7 @@ def _now() -> datetime:
     return datetime.now()
 
 
+@traced("storage.load_requests")
 def load_requests() -> Dict[str, dict]:
     if not os.path.exists(REQUESTS_FILE):
         return {}
@@ -145,14 +239,35 @@ def load_requests() -> Dict[str, dict]:
         return {}
 
 
+def _reindex_requests(data: Dict[str, dict]) -> None:
+    request_index.load(data)
+
+
+def _refresh_read_views() -> None:
+    """
+    Перед админскими отчётами (/stats, /user): в шардированном режиме заявки и транзакции
+    пишут и другие воркеры — тогда индексы по ним строятся заново. В обычном режиме — ничего.
+    """
+    _refresh_shared_maps()
+    if file_changed(REQUESTS_FILE):
+        _reindex_requests(load_requests())
+    if file_changed(TRANSACTIONS_FILE):
+        user_index.load_transactions(_read_all_transactions_sync())
+
+
+@traced("storage.save_requests")
 def save_requests(data: Dict[str, dict]) -> None:
+    # запись через tmp + os.replace: читатели (в т.ч. другие шарды) не видят полузаписанный файл
     try:
-        with open(REQUESTS_FILE, "w", encoding="utf-8") as f:
+        tmp = REQUESTS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, REQUESTS_FILE)
     except IOError as e:
         logger.error(f"Не удалось сохранить {REQUESTS_FILE}: {e}")
 
 
+@traced("storage.load_banned")
 def load_banned() -> List[int]:
     if not os.path.exists(BANNED_FILE):
         return []
@@ -164,26 +279,37 @@ def load_banned() -> List[int]:
         return []
 
 
+@traced("storage.save_banned")
 def save_banned(b: List[int]) -> None:
     try:
-        with open(BANNED_FILE, "w", encoding="utf-8") as f:
+        tmp = BANNED_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(b, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, BANNED_FILE)
     except Exception as e:
         logger.warning(f"Не удалось сохранить {BANNED_FILE}: {e}")
 
 
-def ban_user_by_id(uid: int) -> None:
-    b = load_banned()
-    if uid not in b:
-        b.append(uid)
-        save_banned(b)
+def _refresh_banned() -> None:
+    # шардированный режим: banned.json мог переписать другой процесс
+    if file_changed(BANNED_FILE):
+        banned_index.load(load_banned())
+
 
+async def ban_user_by_id(uid: int) -> None:
+    async with astorage_lock():
+        _refresh_banned()
+        if banned_index.add(uid):
+            save_banned(banned_index.to_list())
+            bot_metrics.event("ban")
 
-def unban_user_by_id(uid: int) -> None:
-    b = load_banned()
-    if uid in b:
-        b.remove(uid)
-        save_banned(b)
+
+async def unban_user_by_id(uid: int) -> None:
+    async with astorage_lock():
+        _refresh_banned()
+        if banned_index.remove(uid):
+            save_banned(banned_index.to_list())
+            bot_metrics.event("unban")
 
 
 def is_banned(uid: Union[int, str]) -> bool:
@@ -191,7 +317,8 @@ def is_banned(uid: Union[int, str]) -> bool:
         uid_int = int(uid)
     except Exception:
         return False
-    return uid_int in load_banned()
+    _refresh_banned()
+    return uid_int in banned_index
 
 
 def load_admin_map() -> Dict[str, int]:
@@ -205,6 +332,7 @@ def load_admin_map() -> Dict[str, int]:
         return {}
 
 
+@traced("storage.save_admin_map")
 def save_admin_map(m: Dict[str, int]) -> None:
     try:
         with open(ADMIN_MAP_FILE, "w", encoding="utf-8") as f:
@@ -224,6 +352,7 @@ def load_admin_topics() -> Dict[str, int]:
         return {}
 
 
+@traced("storage.save_admin_topics")
 def save_admin_topics(m: Dict[str, int]) -> None:
     try:
         with open(ADMIN_TOPICS_FILE, "w", encoding="utf-8") as f:
@@ -243,6 +372,7 @@ def load_rejected() -> set:
         return set()
 
 
+@traced("storage.save_rejected")
 def save_rejected(s: set) -> None:
     try:
         with open(REJECTED_FILE, "w", encoding="utf-8") as f:
@@ -251,46 +381,138 @@ def save_rejected(s: set) -> None:
         logger.warning(f"Не удалось сохранить {REJECTED_FILE}: {e}")
 
 
-def add_rejected(uid: int) -> None:
+async def add_rejected(uid: int) -> None:
     global rejected_users
-    rejected_users.add(int(uid))
-    save_rejected(rejected_users)
+    async with astorage_lock():
+        _refresh_shared_maps()
+        rejected_users.add(int(uid))
+        save_rejected(rejected_users)
 
 
-def remove_rejected(uid: int) -> None:
+async def remove_rejected(uid: int) -> None:
     global rejected_users
     try:
-        rejected_users.discard(int(uid))
-        save_rejected(rejected_users)
+        async with astorage_lock():
+            _refresh_shared_maps()
+            rejected_users.discard(int(uid))
+            save_rejected(rejected_users)
     except Exception:
         pass
 
 
-def clear_all_rejected() -> None:
+async def clear_all_rejected() -> None:
     global rejected_users
-    rejected_users.clear()
-    save_rejected(rejected_users)
+    async with astorage_lock():
+        rejected_users.clear()
+        save_rejected(rejected_users)
+
+
+async def ban_users_bulk(uids: List[int]) -> Dict[str, int]:
+    """
+    Бан пачки id одной транзакцией: banned.json, rejected.json, requests.json и admin_map.json
+    переписываются по одному разу на всю пачку, а не на каждого пользователя.
+    Как и /ban, снимает кнопки с сообщений пользователей в админ-чатах (через decision_outbox)
+    и помечает их шапки решёнными.
+    """
+    async with astorage_lock():
+        _refresh_shared_maps()
+        added = sum(1 for uid in uids if banned_index.add(uid))
+        if added:
+            save_banned(banned_index.to_list())
+        rejected_users.update(uids)
+        save_rejected(rejected_users)
+        data = load_requests()
+        closed = 0
+        headers = []
+        for uid in uids:
+            # шапки берём до drop: он удаляет их вместе с записью заявки
+            headers.extend((int(chat), msg) for chat, msg in (request_index.headers.get(uid) or {}).items())
+            rec = data.pop(str(uid), None)
+            if rec is not None:
+                closed += 1
+                request_index.drop(uid)
+        if closed:
+            save_requests(data)
+    # admin_map — отдельный файл и своя блокировка: внутри astorage_lock не ждём
+    messages = set(await drop_admin_messages(uids)) | set(headers)
+    remember_decided(headers, DECISION_MARKS["ban"])
+    queued = sum(1 for c, m in messages if decision_outbox.put(lambda c=c, m=m: _strip_keyboard(c, m)))
+    if added:
+        bot_metrics.event("ban", added)
+    return {"added": added, "already": len(uids) - added, "closed": closed, "keyboards": queued}
+
+
+async def unban_users_bulk(uids: List[int]) -> Dict[str, int]:
+    async with astorage_lock():
+        _refresh_banned()
+        removed = sum(1 for uid in uids if banned_index.remove(uid))
+        if removed:
+            save_banned(banned_index.to_list())
+    if removed:
+        bot_metrics.event("unban", removed)
+    return {"removed": removed, "missing": len(uids) - removed}
 
 
 def _admin_map_key(chat_id: int, message_id: int) -> str:
     return f"{chat_id}:{message_id}"
 
 
-def set_admin_map(chat_id: int, msg_id: int, user_id: int) -> None:
+async def set_admin_map(chat_id: int, msg_id: int, user_id: int) -> None:
     key = _admin_map_key(chat_id, msg_id)
-    admin_message_to_user[key] = user_id
-    save_admin_map(admin_message_to_user)
+    async with astorage_lock():
+        _refresh_shared_maps()
+        admin_message_to_user[key] = user_id
+        user_index.add_admin_msg(key, user_id)
+        save_admin_map(admin_message_to_user)
 
 
-def remove_admin_map_by_key(key: str) -> None:
-    if key in admin_message_to_user:
-        del admin_message_to_user[key]
-        save_admin_map(admin_message_to_user)
+async def remove_admin_map_by_key(key: str) -> None:
+    async with astorage_lock():
+        _refresh_shared_maps()
+        if key in admin_message_to_user:
+            user_index.drop_admin_msg(key, admin_message_to_user.pop(key))
+            save_admin_map(admin_message_to_user)
 
 
-def remove_admin_map(chat_id: int, msg_id: int) -> None:
+def _refresh_shared_maps() -> None:
+    """
+    Шардированный режим (shard.py): перечитывает in-memory карты, если их файлы переписал другой процесс.
+    В обычном режиме file_changed всегда False.
+    """
+    if file_changed(ADMIN_MAP_FILE):
+        admin_message_to_user.clear()
+        admin_message_to_user.update(load_admin_map())
+        user_index.load_admin_map(admin_message_to_user)
+    if file_changed(ADMIN_TOPICS_FILE):
+        admin_topics_map.clear()
+        admin_topics_map.update(load_admin_topics())
+    if file_changed(REJECTED_FILE):
+        rejected_users.clear()
+        rejected_users.update(load_rejected())
+    _refresh_banned()
+
+
+async def remove_admin_map(chat_id: int, msg_id: int) -> None:
     key = _admin_map_key(chat_id, msg_id)
-    remove_admin_map_by_key(key)
+    await remove_admin_map_by_key(key)
+
+
+async def drop_admin_messages(uids: List[int]) -> List[Tuple[int, int]]:
+    """
+    Убирает из admin_map все сообщения админ-чатов о пользователях uids (файл переписывается один раз).
+    Возвращает их (chat_id, message_id) — чтобы снять кнопки.
+    """
+    async with astorage_lock():
+        _refresh_shared_maps()
+        dropped = []
+        for uid in uids:
+            for chat_id, msg_id in user_index.admin_messages(uid):
+                key = _admin_map_key(chat_id, msg_id)
+                user_index.drop_admin_msg(key, admin_message_to_user.pop(key, uid))
+                dropped.append((chat_id, msg_id))
+        if dropped:
+            save_admin_map(admin_message_to_user)
+    return dropped
 
 
 # ===================== TRANSACTIONS storage (safe sync file ops) =====================
@@ -319,29 +541,37 @@ def _write_all_transactions_sync(data: List[Dict]):
     os.replace(tmp, TRANSACTIONS_FILE)
 
 
+@traced("storage._save_transaction_sync")
 def _save_transaction_sync(record: Dict):
-    data = _read_all_transactions_sync()
-    # если уже есть транзакция с таким charge_id — не дублируем
-    if record.get("telegram_payment_charge_id"):
-        for r in data:
-            if r.get("telegram_payment_charge_id") == record.get("telegram_payment_charge_id"):
-                return False
-    data.append(record)
-    _write_all_transactions_sync(data)
-    return True
+    with storage_lock():
+        data = _read_all_transactions_sync()
+        # если уже есть транзакция с таким charge_id — не дублируем
+        if record.get("telegram_payment_charge_id"):
+            for r in data:
+                if r.get("telegram_payment_charge_id") == record.get("telegram_payment_charge_id"):
+                    return False
+        data.append(record)
+        _write_all_transactions_sync(data)
+        user_index.add_transaction(record)
+        return True
 
 
+@traced("storage._mark_transaction_refunded_sync")
 def _mark_transaction_refunded_sync(charge_id: str) -> bool:
-    data = _read_all_transactions_sync()
-    changed = False
-    for r in data:
-        if r.get("telegram_payment_charge_id") == charge_id and not r.get("refunded"):
-            r["refunded"] = True
-            r["refunded_at"] = datetime.now(timezone.utc).isoformat()
-            changed = True
-    if changed:
-        _write_all_transactions_sync(data)
-    return changed
+    with storage_lock():
+        data = _read_all_transactions_sync()
+        changed = False
+        refunded_at = datetime.now(timezone.utc).isoformat()
+        for r in data:
+            if r.get("telegram_payment_charge_id") == charge_id and not r.get("refunded"):
+                r["refunded"] = True
+                r["refunded_at"] = refunded_at
+                changed = True
+        if changed:
+            _write_all_transactions_sync(data)
+            user_index.update_transaction(charge_id, refunded=True, refunded_at=refunded_at)
+            bot_metrics.event("refund")
+        return changed
 
 
 def _get_transaction_by_charge_sync(charge_id: str) -> Optional[Dict]:
@@ -380,7 +610,7 @@ async def get_transaction_by_charge(charge_id: str) -> Optional[Dict]:
 
 # ---- Telegram API refund call (логируем тело ответа) ----
 async def refund_star_payment(user_id: int, telegram_payment_charge_id: str) -> dict:
-    url = f"https://api.telegram.org/bot{API_TOKEN}/refundStarPayment"
+    url = f"{API_BASE}/bot{API_TOKEN}/refundStarPayment"
     payload = {"user_id": user_id, "telegram_payment_charge_id": telegram_payment_charge_id}
     async with aiohttp.ClientSession() as session:
         async with session.post(url, json=payload) as resp:
@@ -410,54 +640,123 @@ try:
 except Exception:
     rejected_users = set()
 
-# ===================== REQUESTS / LANGS =====================
+# индекс заблокированных: is_banned и /banned без чтения banned.json на каждый вызов
+banned_index = BanIndex(load_banned())
 
+# журнал шагов воронки (eventlog.py) для /funnel
+event_log = EventLog()
 
-def update_user_lang(user_id: str, lang: str) -> List[str]:
-    data = load_requests()
-    rec = data.get(user_id) or {
-        "full_name": "",
-        "username": "",
-        "langs": [],
-        "started_at": None,
-        "submitted": False,
-        "has_seen_instructions": False,
-    }
-    if lang and lang not in rec["langs"]:
-        rec["langs"].append(lang)
-    data[user_id] = rec
-    save_requests(data)
-    return rec["langs"]
+# вторичные индексы заявок (username, язык, состояние, started_at) и для /user
+# (сообщения в админ-чатах, транзакции); заполняются ниже и обновляются при каждой записи
+request_index = RequestIndex()
+user_index = UserIndex(request_index)
+user_index.load_admin_map(admin_message_to_user)
+user_index.load_transactions(_read_all_transactions_sync())
 
+# счётчики /stats: события с прошлых запусков
+bot_metrics.stats.load(STATS_FILE)
+_reindex_requests(load_requests())
 
-def start_request(user, langs: List[str]) -> None:
-    data = load_requests()
-    user_id_str = str(user.id)
-    existing_record = data.get(user_id_str, {})
-    has_seen = existing_record.get("has_seen_instructions", False)
-    data[user_id_str] = {
-        "full_name": user.full_name,
-        "username": user.username or "",
-        "langs": langs,
-        "started_at": _now().isoformat(),
-        "submitted": False,
-        "has_seen_instructions": has_seen,
-    }
-    save_requests(data)
+# ===================== REQUESTS / LANGS =====================
 
 
-def mark_submitted(user_id: str) -> None:
-    data = load_requests()
-    if user_id in data:
-        data[user_id]["submitted"] = True
+async def update_user_lang(user_id: str, lang: str) -> List[str]:
+    async with astorage_lock():
+        data = load_requests()
+        rec = data.get(user_id) or {
+            "full_name": "",
+            "username": "",
+            "langs": [],
+            "started_at": None,
+            "submitted": False,
+            "has_seen_instructions": False,
+        }
+        if lang and lang not in rec["langs"]:
+            rec["langs"].append(lang)
+        if user_id not in data:
+            bot_metrics.event("new_user")
+        data[user_id] = rec
         save_requests(data)
+        request_index.put(user_id, rec)
+        return rec["langs"]
 
 
-def remove_request(user_id: str) -> None:
-    data = load_requests()
-    if user_id in data:
-        del data[user_id]
+async def start_request(user, langs: List[str]) -> None:
+    async with astorage_lock():
+        data = load_requests()
+        user_id_str = str(user.id)
+        existing_record = data.get(user_id_str, {})
+        has_seen = existing_record.get("has_seen_instructions", False)
+        data[user_id_str] = {
+            "full_name": user.full_name,
+            "username": user.username or "",
+            "langs": langs,
+            "started_at": _now().isoformat(),
+            "submitted": False,
+            "has_seen_instructions": has_seen,
+        }
         save_requests(data)
+        request_index.put(user_id_str, data[user_id_str])
+    bot_metrics.event("request")
+
+
+async def mark_submitted(user_id: str, headers: Optional[Dict[str, int]] = None) -> None:
+    """headers — id шапки заявки (с кнопками решения) по админ-чатам, для ссылок из /queue."""
+    async with astorage_lock():
+        data = load_requests()
+        if user_id in data:
+            rec = data[user_id]
+            rec["submitted"] = True
+            rec["submitted_at"] = _now().isoformat()
+            rec["headers"] = headers or {}
+            rec.pop("decision", None)
+            rec.pop("decided_at", None)
+            save_requests(data)
+            request_index.put(user_id, rec)
+
+
+async def mark_decided(user_id: str, decision: str) -> None:
+    """Решение админа по отправленной заявке — она уходит из очереди /queue."""
+    async with astorage_lock():
+        data = load_requests()
+        rec = data.get(user_id)
+        if rec and rec.get("submitted") and not rec.get("decision"):
+            rec["decision"] = decision
+            rec["decided_at"] = _now().isoformat()
+            save_requests(data)
+            request_index.put(user_id, rec)
+
+
+DECISION_LABELS = {"grantpay": "одобрение", "reject": "отказ", "ban": "бан"}
+
+
+def observe_decision(user_id, decision: str) -> None:
+    """Время от отправки заявки до решения — в скетч квантилей /stats. Вызывать до изменения заявки."""
+    try:
+        since = request_index.pending_at(int(user_id))
+        if since:
+            seconds = (_now() - datetime.fromisoformat(since)).total_seconds()
+            bot_metrics.stats.observe("decision", seconds)
+            bot_metrics.stats.observe(f"decision_{decision}", seconds)
+    except (ValueError, TypeError):
+        pass
+
+
+async def remove_request(user_id: str) -> None:
+    async with astorage_lock():
+        data = load_requests()
+        if user_id in data:
+            del data[user_id]
+            request_index.drop(user_id)
+            save_requests(data)
+
+
+async def mark_seen_instructions(user_id: str) -> None:
+    async with astorage_lock():
+        data = load_requests()
+        if user_id in data:
+            data[user_id]["has_seen_instructions"] = True
+            save_requests(data)
 
 
 def can_start_new_request(user_id: str) -> bool:
@@ -567,6 +866,7 @@ async def ensure_or_create_topic_for_chat(chat_id: int) -> Optional[int]:
     Сохранить в admin_topics_map и вернуть id; иначе вернуть None.
     """
     key = str(chat_id)
+    _refresh_shared_maps()
     if key in admin_topics_map:
         try:
             return int(admin_topics_map[key])
@@ -598,8 +898,10 @@ async def ensure_or_create_topic_for_chat(chat_id: int) -> Optional[int]:
                     except Exception:
                         thread_id = None
                 if thread_id:
-                    admin_topics_map[key] = int(thread_id)
-                    save_admin_topics(admin_topics_map)
+                    async with astorage_lock():
+                        _refresh_shared_maps()
+                        admin_topics_map[key] = int(thread_id)
+                        save_admin_topics(admin_topics_map)
                     logger.info(f"[INFO] Создана тема '{name}' в чате {chat_id} -> thread {thread_id}")
                     return int(thread_id)
             except Exception as e:
@@ -639,18 +941,25 @@ async def log_user_action(user_obj: Union[Message, CallbackQuery, Message, dict,
     header = f"{safe_full_name} {safe_username}\nID: {uid}\nЯзыки: {safe_langs}\nВремя: {tm}\n\n"
     text = header + f"Действие: {escape(action)}"
 
-    # Отправляем в каждый admin chat (в thread если задан)
+    # Ставим в очередь отправку в каждый admin chat (в thread если задан)
     for admin_chat in ADMIN_CHAT_IDS:
         # пытаемся использовать заранее настроенную log-thread (если есть)
         thread_id = get_log_thread_for_chat(admin_chat)
-        try:
-            if thread_id is not None:
-                await bot.send_message(chat_id=admin_chat, text=text, message_thread_id=thread_id)
-            else:
-                await bot.send_message(chat_id=admin_chat, text=text)
-        except Exception as e:
-            # не фатально, логируем на stdout
-            logger.warning(f"Не удалось отправить лог в {admin_chat} (thread {thread_id}): {e}")
+        # рассылка логов учитывается в метриках API отдельным путём, а не хендлером-источником
+        token = api_path.set("log_user_action")
+        admin_log_outbox.put(lambda c=admin_chat, t=thread_id: _send_log_message(c, t, text))
+        api_path.reset(token)
+
+
+async def _send_log_message(admin_chat: int, thread_id: Optional[int], text: str) -> None:
+    try:
+        if thread_id is not None:
+            await bot.send_message(chat_id=admin_chat, text=text, message_thread_id=thread_id)
+        else:
+            await bot.send_message(chat_id=admin_chat, text=text)
+    except Exception as e:
+        # не фатально, логируем на stdout
+        logger.warning(f"Не удалось отправить лог в {admin_chat} (thread {thread_id}): {e}")
 
 
 # ===================== HANDLERS =====================
@@ -658,7 +967,7 @@ async def log_user_action(user_obj: Union[Message, CallbackQuery, Message, dict,
 
 @dp.message(Command("start"))
 async def send_welcome(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # логируем команду /start
     await log_user_action(message, "/start")
@@ -669,6 +978,7 @@ async def send_welcome(message: Message):
 
     if not await ensure_private_and_autoleave(message):
         return
+    event_log.record(message.from_user.id, "send_welcome")
     price = load_config()["price"]
     caption = (
         "Добро пожаловать! Я платёжный бот Gene's Land!\n\n"
@@ -692,7 +1002,7 @@ async def send_welcome(message: Message):
 
 @dp.message(Command("setprice"))
 async def set_price(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # логируем попытку изменить цену (для аудита)
     await log_user_action(message, f"Команда /setprice ({message.text})")
@@ -719,7 +1029,7 @@ async def set_price(message: Message):
 
 @dp.message(Command("setprice_stars"))
 async def set_price_stars(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # логируем попытку изменить цену в звёздах (для аудита)
     await log_user_action(message, f"Команда /setprice_stars ({message.text})")
@@ -747,7 +1057,7 @@ async def set_price_stars(message: Message):
 
 @dp.callback_query(F.data == "premium")
 async def process_premium(callback: CallbackQuery):
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     # логируем действие пользователя
     await log_user_action(callback, "Нажал кнопку: Premium")
@@ -755,6 +1065,7 @@ async def process_premium(callback: CallbackQuery):
     if is_banned(callback.from_user.id):
         await callback.answer("🔒 Вы заблокированы.", show_alert=True)
         return
+    event_log.record(callback.from_user.id, "process_premium")
 
     # построим клавиатуру оплаты
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -780,7 +1091,7 @@ async def process_premium(callback: CallbackQuery):
 
 @dp.callback_query(F.data == "home")
 async def go_home(callback: CallbackQuery):
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     # логируем действие пользователя
     await log_user_action(callback, "Нажал кнопку: Домой")
@@ -816,7 +1127,7 @@ async def go_home(callback: CallbackQuery):
 
 @dp.callback_query(F.data.in_(["pay_card", "pay_crypto", "pay_stars"]))
 async def ask_screenshots(callback: CallbackQuery):
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     # логируем выбор способа оплаты
     await log_user_action(callback, f"Выбрал способ оплаты: {callback.data}")
@@ -832,8 +1143,9 @@ async def ask_screenshots(callback: CallbackQuery):
     if not can_start_new_request(user_id_str):
         await callback.message.answer("Вы уже подавали заявку, ожидайте одобрения ✅")
         return
-    langs = update_user_lang(user_id_str, user.language_code or "unknown")
-    start_request(user, langs)
+    langs = await update_user_lang(user_id_str, user.language_code or "unknown")
+    await start_request(user, langs)
+    event_log.record(user.id, f"ask_screenshots_{callback.data.split('_', 1)[1]}")
     instruction = (
         "Наша система сочла ваш аккаунт подозрительным.\n"
         "Для покупки Gene Premium мы обязаны убедиться в вас.\n\n"
@@ -846,29 +1158,122 @@ async def ask_screenshots(callback: CallbackQuery):
 
     data = load_requests()
     user_record = data.get(user_id_str, {})
+    _refresh_shared_maps()
     # Если пользователь ранее отклонён (в requests.json или в rejected.json) — НЕ показываем "Подготавливаем..." и сразу отправляем инструкцию.
     if user_record.get("rejected", False) or int(user_id_str) in rejected_users:
         await callback.message.answer(instruction)
         # отметим, что он видел инструкции
-        if user_id_str in data:
-            data[user_id_str]["has_seen_instructions"] = True
-            save_requests(data)
+        await mark_seen_instructions(user_id_str)
         return
 
     if not user_record.get("has_seen_instructions", False):
         preparing_msg = await callback.message.answer("⏳ Подготавливаем для вас оплату...")
         await asyncio.sleep(random.randint(4234, 10110) / 1000)
         await preparing_msg.edit_text(instruction)
-        if user_id_str in data:
-            data[user_id_str]["has_seen_instructions"] = True
-            save_requests(data)
+        await mark_seen_instructions(user_id_str)
     else:
         await callback.message.answer(instruction)
 
 
+# ===================== РЕШЕНИЯ ПО ЗАЯВКАМ: шапки во всех админ-чатах =====================
+
+DECISION_MARKS = {"grantpay": "✅ Доступ к оплате выдан", "reject": "❌ Отклонена", "ban": "🔒 Заблокирован"}
+DECIDED_CACHE_SIZE = 10000
+
+# (chat_id, message_id) шапки -> строка решения; по ней повторное нажатие отвечается без работы
+decided_headers: Dict[Tuple[int, int], str] = {}
+
+
+async def answer_if_decided(callback: CallbackQuery) -> bool:
+    """Кнопка на шапке, по которой уже решили (в этом или другом админ-чате): только ответ на callback."""
+    mark = decided_headers.get((callback.message.chat.id, callback.message.message_id)) if callback.message else None
+    if mark is None:
+        return False
+    await callback.answer(f"Уже решено: {mark}")
+    return True
+
+
+def mirror_decision(callback: CallbackQuery, uid: int, decision: str) -> None:
+    """
+    Помечает решение на всех шапках заявки (по одной в каждом админ-чате) и снимает с них кнопки.
+    Вызывать до изменения заявки: ban_ удаляет её вместе с записью о шапках.
+    """
+    admin = callback.from_user
+    who = escape(admin.full_name or str(admin.id)) + (f" (@{escape(admin.username)})" if admin.username else "")
+    mark = f"{DECISION_MARKS[decision]} — {who}, {_now().strftime('%d.%m %H:%M')}"
+    headers = {(int(chat), msg) for chat, msg in (request_index.headers.get(uid) or {}).items()}
+    headers.add((callback.message.chat.id, callback.message.message_id))
+    text = f"{callback.message.html_text}\n\n{mark}"
+    remember_decided(headers, DECISION_MARKS[decision])
+    for key in headers:
+        decision_outbox.put(lambda c=key[0], m=key[1]: _edit_decided_header(c, m, text))
+
+
+def remember_decided(headers: Iterable[Tuple[int, int]], mark: str) -> None:
+    """Запоминает решение по шапкам; старые записи вытесняются сверх DECIDED_CACHE_SIZE."""
+    for key in headers:
+        decided_headers[key] = mark
+    while len(decided_headers) > DECIDED_CACHE_SIZE:
+        del decided_headers[next(iter(decided_headers))]
+
+
+def single_flight_decision(decision: str):
+    """
+    Кнопка решения выполняется один раз на (callback data, пользователь, решение, submitted_at заявки):
+    одновременные повторы ждут первый вызов, поздние (DECISION_DEDUP_SECONDS) — сразу получают ответ на callback,
+    без логов, записи хранилищ и уведомлений. Хендлер, вернувший False, не кешируется (можно повторить).
+    Нажатия не админов и вне админ-чатов идут в хендлер как есть.
+    """
+    def wrap(handler):
+        @functools.wraps(handler)
+        async def wrapper(callback: CallbackQuery):
+            if (callback.from_user.id not in ALL_ADMINS_SET or callback.message is None
+                    or callback.message.chat.id not in ADMIN_CHAT_IDS):
+                return await handler(callback)
+            user_id_str = callback.data.split("_", 1)[1]
+            try:
+                # submitted_at отличает повторную заявку того же пользователя от дубля нажатия;
+                # pending_at не подходит — решение обнуляет его, и поздний дубль получил бы новый ключ
+                submitted_at = request_index.submitted_at(int(user_id_str))
+            except ValueError:
+                submitted_at = ""
+            key = (callback.data, user_id_str, decision, submitted_at)
+            result, shared = await decision_flights.do(key, lambda: handler(callback))
+            if shared:
+                try:
+                    if result is FAILED or result is False:
+                        await callback.answer("⚠️ Не удалось обработать, нажмите ещё раз.")
+                    else:
+                        await callback.answer(f"Уже решено: {DECISION_MARKS[decision]}")
+                except TelegramBadRequest:
+                    pass  # callback устарел
+        return wrapper
+    return wrap
+
+
+async def _strip_keyboard(chat_id: int, msg_id: int) -> None:
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=msg_id, reply_markup=None)
+    except TelegramBadRequest as e:
+        # сообщение удалили или кнопок на нём уже нет
+        logger.debug(f"Не удалось снять кнопки {chat_id}:{msg_id}: {e}")
+
+
+async def _edit_decided_header(chat_id: int, msg_id: int, text: str) -> None:
+    try:
+        # без reply_markup Telegram снимает инлайн-кнопки вместе с правкой текста
+        await bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=text)
+    except TelegramBadRequest as e:
+        # шапку удалили или она уже в этом виде
+        logger.debug(f"Не удалось обновить шапку {chat_id}:{msg_id}: {e}")
+
+
 @dp.callback_query(F.data.startswith("reject_"))
+@single_flight_decision("reject")
 async def reject_request(callback: CallbackQuery):
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    if await answer_if_decided(callback):
+        return
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     # логируем действие админа (отклонение)
     await log_user_action(callback, f"Админ {callback.from_user.id} отклонил заявку {callback.data}")
@@ -879,38 +1284,47 @@ async def reject_request(callback: CallbackQuery):
     if callback.from_user.id not in ALL_ADMINS_SET:
         return
     user_id = callback.data.split("_", 1)[1]
-    data = load_requests()
-    # Вместо удаления — помечаем как отклонённую, чтобы при следующем заходе не показывать "Подготавливаем..."
-    rec = data.get(user_id, {})
-    rec["rejected"] = True
-    rec["submitted"] = False
-    rec["started_at"] = None
-    rec["has_seen_instructions"] = False
-    # сохраняем full_name/username если их нет (необязательно)
-    rec.setdefault("full_name", rec.get("full_name", ""))
-    rec.setdefault("username", rec.get("username", ""))
-    rec.setdefault("langs", rec.get("langs", []))
-    data[user_id] = rec
-    save_requests(data)
-
-    try:
-        add_rejected(int(user_id))
+    try:
+        mirror_decision(callback, int(user_id), "reject")
+    except ValueError:
+        return
+    observe_decision(user_id, "reject")
+    async with astorage_lock():
+        data = load_requests()
+        # Вместо удаления — помечаем как отклонённую, чтобы при следующем заходе не показывать "Подготавливаем..."
+        rec = data.get(user_id, {})
+        rec["rejected"] = True
+        rec["submitted"] = False
+        rec["started_at"] = None
+        rec["decision"] = "reject"
+        rec["decided_at"] = _now().isoformat()
+        rec["has_seen_instructions"] = False
+        # сохраняем full_name/username если их нет (необязательно)
+        rec.setdefault("full_name", rec.get("full_name", ""))
+        rec.setdefault("username", rec.get("username", ""))
+        rec.setdefault("langs", rec.get("langs", []))
+        data[user_id] = rec
+        save_requests(data)
+        request_index.put(user_id, rec)
+
+    try:
+        await add_rejected(int(user_id))
     except Exception:
         pass
+    bot_metrics.event("rejection")
 
     try:
         await bot.send_message(user_id, "❌ Ваша заявка отклонена.\nВы можете попробовать подать её снова.")
     except Exception as e:
         logger.warning(f"Не удалось уведомить пользователя {user_id}: {e}")
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
 
 
 @dp.callback_query(F.data.startswith("ban_"))
+@single_flight_decision("ban")
 async def ban_request(callback: CallbackQuery):
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    if await answer_if_decided(callback):
+        return
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     # логируем действие админа (бан)
     await log_user_action(callback, f"Админ {callback.from_user.id} заблокировал пользователя {callback.data}")
@@ -928,9 +1342,11 @@ async def ban_request(callback: CallbackQuery):
         await callback.message.answer("Неверный id для блокировки.")
         return
 
+    mirror_decision(callback, uid, "ban")
+    observe_decision(uid, "ban")
     try:
-        ban_user_by_id(uid)
-        remove_request(str(uid))
+        await ban_user_by_id(uid)
+        await remove_request(str(uid))
         submission_buffers.pop(str(uid), None)
         task = collecting_tasks.pop(str(uid), None)
         if task and not task.done():
@@ -942,7 +1358,7 @@ async def ban_request(callback: CallbackQuery):
         logger.warning(f"Не удалось полностью заблокировать/очистить данные для {uid}: {e}")
 
     try:
-        add_rejected(uid)
+        await add_rejected(uid)
     except Exception:
         pass
 
@@ -951,17 +1367,12 @@ async def ban_request(callback: CallbackQuery):
     except Exception as e:
         logger.warning(f"Не удалось уведомить пользователя {uid}: {e}")
 
-    try:
-        await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
 
 # ------------------ COMMAND /ban (added) ------------------
 
 @dp.message(Command("ban"))
 async def cmd_ban(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
     await log_user_action(message, f"Команда /ban ({message.text})")
 
     if message.from_user.id not in ALL_ADMINS_SET:
@@ -980,6 +1391,7 @@ async def cmd_ban(message: Message):
     else:
         # или reply на сообщении бота в админ-чате
         if message.reply_to_message:
+            _refresh_shared_maps()
             replied_key = _admin_map_key(message.reply_to_message.chat.id, message.reply_to_message.message_id)
             target_id = admin_message_to_user.get(replied_key)
             if not target_id:
@@ -992,14 +1404,14 @@ async def cmd_ban(message: Message):
 
     # Выполняем бан и чистку
     try:
-        ban_user_by_id(target_id)
+        await ban_user_by_id(target_id)
     except Exception as e:
         await message.reply(f"Ошибка при добавлении в бан-лист: {e}")
         return
 
     # Удаляем/закрываем заявку пользователя, буферы, задачи
     try:
-        remove_request(str(target_id))
+        await remove_request(str(target_id))
     except Exception:
         pass
     try:
@@ -1018,23 +1430,16 @@ async def cmd_ban(message: Message):
 
     # Убираем inline-кнопки и маппинги у всех сообщений админ-чатов, относящихся к этому userid
     try:
-        for k, v in list(admin_message_to_user.items()):
+        for chat_id, msg_id in await drop_admin_messages([target_id]):
             try:
-                if int(v) == int(target_id):
-                    chat_s, msg_s = k.split(":", 1)
-                    chat_id = int(chat_s); msg_id = int(msg_s)
-                    try:
-                        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=msg_id, reply_markup=None)
-                    except Exception:
-                        pass
-                    remove_admin_map_by_key(k)
+                await bot.edit_message_reply_markup(chat_id=chat_id, message_id=msg_id, reply_markup=None)
             except Exception:
-                continue
+                pass
     except Exception as e:
         logger.warning(f"Ошибка при очистке админских сообщений для {target_id}: {e}")
 
     try:
-        add_rejected(int(target_id))
+        await add_rejected(int(target_id))
     except Exception:
         pass
 
@@ -1046,11 +1451,100 @@ async def cmd_ban(message: Message):
         pass
 
 
+# ------------------ BAN/UNBAN списком из файла ------------------
+
+async def _document_chunks(document) -> AsyncIterator[bytes]:
+    """Содержимое документа по кускам — без загрузки файла в память целиком."""
+    file = await bot.get_file(document.file_id)
+    api = bot.session.api
+    if api.is_local:
+        with open(api.wrap_local_file.to_local(file.file_path), "rb") as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+    async for chunk in bot.session.stream_content(
+        url=api.file_url(bot.token, file.file_path), timeout=60, chunk_size=65536, raise_for_status=True
+    ):
+        yield chunk
+
+
+def _drop_collectors(uids: List[int]) -> int:
+    """Один проход по буферам/коллекторам заявок: снимает всё, что относится к uids."""
+    stopped = 0
+    for uid in map(str, uids):
+        submission_buffers.pop(uid, None)
+        task = collecting_tasks.pop(uid, None)
+        if task and not task.done():
+            task.cancel()
+            stopped += 1
+    return stopped
+
+
+@dp.message(Command("ban_file", "unban_file"))
+async def cmd_ban_file(message: Message, command: CommandObject):
+    """
+    /ban_file, /unban_file — подписью к .txt/.csv с id (или reply на такой документ).
+    id разделяются переводом строки, пробелом, «,» или «;». Выгрузка текущего списка — кнопка 📄 в /banned.
+    """
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await log_user_action(message, f"Команда /{command.command}")
+
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+
+    document = message.document or (message.reply_to_message.document if message.reply_to_message else None)
+    if document is None:
+        await message.reply(f"Пришлите .txt/.csv с id пользователей с подписью /{command.command} "
+                            f"или ответьте командой на такой документ.")
+        return
+    if document.file_size and document.file_size > BAN_FILE_MAX_BYTES:
+        await message.reply("Файл слишком большой (больше 20 МБ).")
+        return
+
+    parser = IdStreamParser()
+    try:
+        async for chunk in _document_chunks(document):
+            parser.feed(chunk)
+    except Exception as e:
+        logger.error(f"Не удалось скачать файл для /{command.command}: {e}")
+        await message.reply(f"Не удалось скачать файл: {e}")
+        return
+    uids = parser.close()
+    skipped = f"\nПропущено нечисловых значений: {parser.invalid}" if parser.invalid else ""
+    if parser.invalid_samples:
+        skipped += " (" + ", ".join(parser.invalid_samples) + ")"
+    if not uids:
+        await message.reply("В файле не найдено ни одного id." + skipped)
+        return
+
+    try:
+        if command.command == "unban_file":
+            res = await unban_users_bulk(uids)
+            text = (f"✅ Разблокировано: {res['removed']} из {len(uids)}"
+                    f"\nНе было в бан-листе: {res['missing']}")
+        else:
+            res = await ban_users_bulk(uids)
+            stopped = _drop_collectors(uids)
+            # пользователей не уведомляем: тысячи send_message упрутся в лимиты Bot API
+            text = (f"🔒 Заблокировано новых: {res['added']} из {len(uids)}"
+                    f"\nУже были в бан-листе: {res['already']}"
+                    f"\nЗакрыто заявок: {res['closed']}, остановлено сборов заявок: {stopped}"
+                    f"\nСнимаются кнопки с сообщений в админ-чатах: {res['keyboards']}")
+    except Exception as e:
+        logger.error(f"Ошибка при /{command.command}: {e}")
+        await message.reply(f"Ошибка при сохранении: {e}")
+        return
+    logger.info(f"/{command.command} от {message.from_user.id}: {len(uids)} id")
+    await message.reply(text + skipped + f"\nВсего в бан-листе: {len(banned_index)}")
+
+
 # ------------------ UNBAN: команда и callback ------------------
 
 @dp.message(Command("unban"))
 async def cmd_unban(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # логируем действие админа (unban)
     await log_user_action(message, f"Команда /unban ({message.text})")
@@ -1068,19 +1562,19 @@ async def cmd_unban(message: Message):
             return
     else:
         if message.reply_to_message:
+            _refresh_shared_maps()
             replied_key = _admin_map_key(message.reply_to_message.chat.id, message.reply_to_message.message_id)
             target_id = admin_message_to_user.get(replied_key)
         if not target_id:
             await message.reply("Укажите id: /unban <user_id> или выполните команду через reply на сообщении бота в админ-чате.")
             return
 
-    banned = load_banned()
-    if target_id not in banned:
+    if not is_banned(target_id):
         await message.reply(f"Пользователь {target_id} не в списке заблокированных.")
         return
 
     try:
-        unban_user_by_id(target_id)
+        await unban_user_by_id(target_id)
     except Exception as e:
         await message.reply(f"Ошибка при разблокировке: {e}")
         return
@@ -1107,8 +1601,7 @@ async def unban_request(callback: CallbackQuery):
         await callback.message.answer("Неверный id для разблокировки.")
         return
 
-    banned = load_banned()
-    if uid not in banned:
+    if not is_banned(uid):
         await callback.message.answer("Пользователь уже не заблокирован.")
         try:
             await callback.message.edit_reply_markup(reply_markup=None)
@@ -1117,7 +1610,7 @@ async def unban_request(callback: CallbackQuery):
         return
 
     try:
-        unban_user_by_id(uid)
+        await unban_user_by_id(uid)
     except Exception as e:
         await callback.message.answer(f"Ошибка при сохранении: {e}")
         return
@@ -1136,19 +1629,77 @@ async def unban_request(callback: CallbackQuery):
 
 @dp.message(Command("banned"))
 async def cmd_banned(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # логирование просмотра списка забаненных
     await log_user_action(message, "Команда /banned")
 
     if message.from_user.id not in ALL_ADMINS_SET:
         return
-    banned = load_banned()
-    if not banned:
-        await message.reply("Список заблокированных пуст.")
+    parts = (message.text or "").split(maxsplit=1)
+    prefix = parts[1].strip() if len(parts) > 1 else ""
+    if prefix and not (prefix.isdigit() and len(prefix) <= 20):
+        await message.reply("Использование: /banned [начало id]")
+        return
+    text, kb = _banned_page(prefix)
+    await message.reply(text, reply_markup=kb)
+
+
+def _banned_page(prefix: str = "", after: Optional[str] = None, before: Optional[str] = None):
+    """Страница /banned из индекса: курсор — крайний id страницы, префикс — фильтр по началу id."""
+    ids, has_prev, has_next, total = banned_index.page(prefix, after=after, before=before, limit=BANNED_PAGE_SIZE)
+    if total and not ids:
+        # курсор ушёл за край (id с края страницы разбанили) — с начала списка
+        ids, has_prev, has_next, total = banned_index.page(prefix, limit=BANNED_PAGE_SIZE)
+    if not total:
+        return ("Нет заблокированных с id на " + prefix) if prefix else "Список заблокированных пуст.", None
+    title = f"Заблокированные пользователи с id на {prefix}" if prefix else "Заблокированные пользователи"
+    text = f"{title} (всего {total}):\n" + "\n".join(ids)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"banned:p:{prefix}:{ids[0]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"banned:n:{prefix}:{ids[-1]}"))
+    rows = [nav] if nav else []
+    if has_prev or has_next:
+        rows.append([InlineKeyboardButton(text="📄 Выгрузить файлом", callback_data=f"banned:f:{prefix}")])
+    return text, InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+@dp.callback_query(F.data.startswith("banned:"))
+async def banned_nav(callback: CallbackQuery):
+    if callback.from_user.id not in ALL_ADMINS_SET:
+        await callback.answer()
         return
-    text = "Заблокированные пользователи:\n" + "\n".join([str(x) for x in banned])
-    await message.reply(text)
+    parts = callback.data.split(":")
+    action, prefix = parts[1], parts[2] if len(parts) > 2 else ""
+    cursor = parts[3] if len(parts) > 3 else None
+
+    if action == "f":
+        ids = banned_index.matching(prefix)
+        await callback.answer()
+        if not ids:
+            return
+        name = f"banned_{prefix}.txt" if prefix else "banned.txt"
+        try:
+            await callback.message.answer_document(
+                BufferedInputFile(("\n".join(ids) + "\n").encode("utf-8"), filename=name),
+                caption=f"Заблокированных: {len(ids)}",
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить выгрузку /banned: {e}")
+        return
+
+    if action == "n":
+        text, kb = _banned_page(prefix, after=cursor)
+    else:
+        text, kb = _banned_page(prefix, before=cursor)
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        # страница не изменилась (двойное нажатие) — нечего обновлять
+        pass
 
 
 # ===================== NEW: /clear_rejected command =====================
@@ -1159,7 +1710,7 @@ async def cmd_clear_rejected(message: Message):
     /clear_rejected <user_id>   -> удалить одного пользователя из rejected
     Доступно только для админов.
     """
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
     await log_user_action(message, f"Команда /clear_rejected ({message.text})")
 
     if message.from_user.id not in ALL_ADMINS_SET:
@@ -1173,35 +1724,392 @@ async def cmd_clear_rejected(message: Message):
         except ValueError:
             await message.reply("Неверный id. Использование: /clear_rejected <user_id> или /clear_rejected")
             return
-        remove_rejected(uid)
+        await remove_rejected(uid)
         # также удаляем флаг rejected из requests.json если он там есть
-        data = load_requests()
-        rec = data.get(str(uid))
-        if rec and rec.get("rejected"):
-            rec.pop("rejected", None)
-            data[str(uid)] = rec
-            save_requests(data)
+        async with astorage_lock():
+            data = load_requests()
+            rec = data.get(str(uid))
+            if rec and rec.get("rejected"):
+                rec.pop("rejected", None)
+                data[str(uid)] = rec
+                save_requests(data)
         await message.reply(f"✅ Пользователь {uid} удалён из списка отклонённых.")
     else:
         # очистка всех
-        clear_all_rejected()
+        await clear_all_rejected()
         # чистим флаги в requests.json
-        data = load_requests()
-        changed = False
-        for k, rec in list(data.items()):
-            if rec.get("rejected"):
-                rec.pop("rejected", None)
-                data[k] = rec
-                changed = True
-        if changed:
-            save_requests(data)
+        async with astorage_lock():
+            data = load_requests()
+            changed = False
+            for k, rec in list(data.items()):
+                if rec.get("rejected"):
+                    rec.pop("rejected", None)
+                    data[k] = rec
+                    changed = True
+            if changed:
+                save_requests(data)
         await message.reply("✅ Список отклонённых пользователей очищен.")
 
 
+# ===================== ДИАГНОСТИКА (админские команды) =====================
+@dp.message(Command("lag"))
+async def cmd_lag(message: Message):
+    """
+    /lag — лаг event loop (p50/p95/p99/max) и самые долгие блокировки.
+    /lag dump — плюс файл со стеками блокировок и текущими задачами.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    st = loop_monitor.lag_stats()
+    lines = [
+        f"⏱ Лаг event loop ({st['samples']} замеров): p50 {st['p50'] * 1000:.1f} мс, p95 {st['p95'] * 1000:.1f} мс, "
+        f"p99 {st['p99'] * 1000:.1f} мс, max {st['max'] * 1000:.1f} мс",
+        f"Блокировок дольше {loop_monitor.threshold * 1000:.0f} мс: {st['stalls']}",
+    ]
+    for rec in loop_monitor.slowest(5):
+        lines.append(f"• {rec['duration'] * 1000:.0f} мс — {escape(rec['where'])} ({escape(rec['task'])})")
+    await message.reply("\n".join(lines))
+
+    args = (message.text or "").split()[1:]
+    if args and args[0] == "dump":
+        dump = loop_monitor.dump().encode("utf-8")
+        await message.reply_document(BufferedInputFile(dump, filename=f"loop_dump_{int(time.time())}.txt"))
+
+
+STATS_LABELS = {
+    "new_user": "Новые пользователи",
+    "request": "Начатые заявки",
+    "submission": "Отправленные заявки",
+    "rejection": "Отклонено",
+    "ban": "Баны",
+    "unban": "Разбаны",
+    "invoice": "Счета",
+    "payment": "Оплаты",
+    "refund": "Возвраты",
+}
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """
+    /stats — размеры хранилища и события за час/сутки/неделю с почасовым трендом за сутки.
+    Всё берётся из счётчиков и индексов в памяти (обновляются по ходу событий), JSON-файлы не читаются.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    stats = bot_metrics.stats
+    _refresh_read_views()
+    since = datetime.fromtimestamp(stats.since).strftime("%Y-%m-%d %H:%M")
+    # заявка активна 3 дня (has_active_request) — подсчёт по индексу started_at
+    active = request_index.count_started(since=(_now() - timedelta(days=3)).isoformat())
+    langs = sorted(request_index.lang_counts().items(), key=lambda kv: -kv[1])[:8]
+    head = [
+        f"📊 Статистика{f' (шард {SHARD_INDEX})' if SHARDED else ''}",
+        f"Пользователей: {len(request_index)}, активных заявок: {active}, "
+        f"отправленных: {request_index.count('submitted')}",
+        f"Заблокировано: {len(banned_index)}, отклонённых: {len(rejected_users)}",
+        "Языки: " + (", ".join(f"{escape(k)} {v}" for k, v in langs) or "-"),
+    ]
+    overdue = len(request_index.overdue((_now() - timedelta(hours=SLA_OVERDUE_HOURS)).isoformat()))
+    head.append(f"Ждут решения: {len(request_index.pending)}, дольше {SLA_OVERDUE_HOURS:g} ч: {overdue}")
+    sla = []
+    for decision, label in (("", "все"), *DECISION_LABELS.items()):
+        name = f"decision_{decision}" if decision else "decision"
+        q = stats.quantiles(name)
+        if q:
+            sla.append(f"{label} " + "/".join(_duration(v) for v in q.values()) + f" (n={stats.sketches[name].count})")
+    if sla:
+        head.append("До решения p50/p90/p99: " + ", ".join(sla))
+    snap = stats.snapshot()
+    rows = [f"{'':<20}{'час':>6}{'сутки':>7}{'неделя':>8}{'всего':>8}  24ч"]
+    for name, label in STATS_LABELS.items():
+        c = snap.get(name, {})
+        rows.append(
+            f"{label:<20}{c.get('час', 0):>6.0f}{c.get('сутки', 0):>7.0f}{c.get('неделя', 0):>8.0f}"
+            f"{c.get('всего', 0):>8.0f}  {stats.trend(name) or '-'}"
+        )
+    await message.reply("\n".join(head) + f"\n<pre>{escape(chr(10).join(rows))}</pre>\nСобытия считаются с {since}")
+
+
+def _message_link(chat_id: int, msg_id: int) -> str:
+    s = str(chat_id)
+    if s.startswith("-100"):
+        return f'<a href="https://t.me/c/{s[4:]}/{msg_id}">{chat_id}:{msg_id}</a>'
+    return f"{chat_id}:{msg_id}"
+
+
+def _request_state(rec: Optional[dict]) -> str:
+    if not rec:
+        return "нет записи"
+    if rec.get("submitted"):
+        return "отправлена, одобрена" if rec.get("decision") == "grantpay" else "отправлена, ждёт решения"
+    if rec.get("decision"):
+        # отказ снимает submitted и started_at, но оставляет решение
+        return "отклонена" if rec["decision"] == "reject" else f"решена ({DECISION_LABELS.get(rec['decision'], rec['decision'])})"
+    if not rec.get("started_at"):
+        return "не начата"
+    try:
+        started = datetime.fromisoformat(rec["started_at"])
+        return "начата" if _now() - started <= timedelta(days=3) else "начата, истекла"
+    except (ValueError, TypeError):
+        return "начата"
+
+
+@dp.message(Command("user"))
+async def cmd_user(message: Message):
+    """
+    /user <id|@username|charge_id> — всё о пользователе одним ответом: заявка, бан/отказ,
+    сообщения о нём в админ-чатах, оплаты и возвраты. Поиск — по вторичным индексам (userindex.py).
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        await message.reply("Использование: /user <id | @username | telegram_payment_charge_id>")
+        return
+    _refresh_read_views()
+    uid, via = user_index.resolve(parts[1])
+    if uid is None:
+        await message.reply(f"Не найдено: {escape(parts[1].strip())}")
+        return
+
+    rec = request_index.summary(uid)  # без разбора requests.json на event loop
+    lines = [f"👤 <b>{uid}</b>" + (f" (найден по {via})" if via != "id" else "")]
+    if rec:
+        name = escape(rec.get("full_name") or "(без имени)")
+        username = f" @{escape(rec['username'])}" if rec.get("username") else ""
+        lines.append(f"{name}{username}, языки: {escape(', '.join(rec.get('langs') or []) or '-')}")
+    times = [f"{label} {rec[field][:19].replace('T', ' ')}"
+             for label, field in (("старт", "started_at"), ("отправлена", "submitted_at"), ("решение", "decided_at"))
+             if rec and rec.get(field)]
+    lines.append(f"Заявка: {_request_state(rec)}" + (f" ({', '.join(times)})" if times else ""))
+    flags = [f for f, on in (("🔒 в бане", uid in banned_index), ("⛔️ отклонён", uid in rejected_users)) if on]
+    if flags:
+        lines.append(", ".join(flags))
+
+    msgs = user_index.admin_messages(uid)
+    if msgs:
+        lines.append(f"Сообщения в админ-чатах ({len(msgs)}): " + ", ".join(_message_link(c, m) for c, m in msgs[-10:]))
+
+    txs = user_index.transactions(uid)
+    if txs:
+        lines.append(f"Платежи ({len(txs)}):")
+        for tx in txs[-10:]:
+            refund = f", возврат {str(tx.get('refunded_at') or '')[:19]}" if tx.get("refunded") else ""
+            lines.append(f"• {str(tx.get('created_at') or '')[:19]} {tx.get('amount')} {escape(str(tx.get('currency')))}"
+                         f" <code>{escape(str(tx.get('telegram_payment_charge_id')))}</code>{refund}")
+    else:
+        lines.append("Платежей нет")
+    await message.reply("\n".join(lines), disable_web_page_preview=True)
+
+
+def _duration(seconds: float) -> str:
+    seconds = max(0, int(seconds))
+    if seconds < 3600:
+        return f"{seconds // 60}м"
+    if seconds < 86400:
+        return f"{seconds // 3600}ч {seconds % 3600 // 60}м"
+    return f"{seconds // 86400}д {seconds % 86400 // 3600}ч"
+
+
+def _age(since: str) -> str:
+    try:
+        return _duration((_now() - datetime.fromisoformat(since)).total_seconds())
+    except (ValueError, TypeError):
+        return "?"
+
+
+def _queue_line(n: int, submitted_at: str, uid: int, chat_id: Optional[int]) -> str:
+    """Строка очереди: пользователь, возраст заявки и ссылка на её шапку (в chat_id, если она там есть)."""
+    username = request_index.username_of(uid)
+    who = f"<code>{uid}</code>" + (f" @{escape(username)}" if username else "")
+    headers = request_index.headers.get(uid) or {}
+    chat = str(chat_id) if str(chat_id) in headers else next(iter(headers), None)
+    link = _message_link(int(chat), headers[chat]) if chat is not None else "шапки нет"
+    return f"{n}. {who} — {_age(submitted_at)} назад, {link}"
+
+
+@dp.message(Command("queue"))
+async def cmd_queue(message: Message):
+    """
+    /queue — отправленные заявки без решения, от самых старых. Каждая строка — ссылка на шапку
+    заявки в админ-чате (в этом чате, если команда дана в нём). Очередь — упорядоченный индекс
+    (reqindex.py), из которого заявка уходит при grantpay_/reject_/ban_.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    _refresh_read_views()
+    text, kb = _queue_page(message.chat.id)
+    await message.reply(text, reply_markup=kb, disable_web_page_preview=True)
+
+
+def _queue_page(chat_id: int, after: Optional[Tuple[str, int]] = None, before: Optional[Tuple[str, int]] = None):
+    items, start, has_prev, has_next = request_index.pending_page(after=after, before=before, limit=QUEUE_PAGE_SIZE)
+    if request_index.pending and not items:
+        # курсор ушёл за край (заявки с края страницы разобраны) — с начала очереди
+        items, start, has_prev, has_next = request_index.pending_page(limit=QUEUE_PAGE_SIZE)
+    total = len(request_index.pending)
+    if not total:
+        return "Очередь пуста: все отправленные заявки разобраны.", None
+    home = chat_id if chat_id in ADMIN_CHAT_IDS else ADMIN_CHAT_IDS[0] if ADMIN_CHAT_IDS else None
+    lines = [f"📥 Ждут решения: {total}"]
+    for n, (submitted_at, uid) in enumerate(items, start + 1):
+        lines.append(_queue_line(n, submitted_at, uid, home))
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"queue:p:{items[0][0]}:{items[0][1]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"queue:n:{items[-1][0]}:{items[-1][1]}"))
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+
+@dp.callback_query(F.data.startswith("queue:"))
+async def queue_nav(callback: CallbackQuery):
+    if callback.from_user.id not in ALL_ADMINS_SET:
+        await callback.answer()
+        return
+    # queue:<n|p>:<submitted_at>:<user_id>; в iso-времени есть двоеточия — user_id берём справа
+    head, _, uid = callback.data.rpartition(":")
+    _, action, submitted_at = head.split(":", 2)
+    try:
+        cursor = (submitted_at, int(uid))
+    except ValueError:
+        await callback.answer()
+        return
+    _refresh_read_views()
+    if action == "n":
+        text, kb = _queue_page(callback.message.chat.id, after=cursor)
+    else:
+        text, kb = _queue_page(callback.message.chat.id, before=cursor)
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text, reply_markup=kb, disable_web_page_preview=True)
+    except TelegramBadRequest:
+        pass
+
+
+@dp.message(Command("funnel"))
+async def cmd_funnel(message: Message):
+    """
+    /funnel [дней] — воронка по журналу событий: конверсия шагов, время между шагами (p50/p90/p99),
+    способы оплаты и языки. Считается analytics.py (NumPy) в отдельном потоке.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    parts = (message.text or "").split()
+    try:
+        days = float(parts[1]) if len(parts) > 1 else None
+    except ValueError:
+        await message.reply("Использование: /funnel [число дней]")
+        return
+    try:
+        import analytics
+    except ImportError:
+        await message.reply("Для /funnel нужен numpy (pip install numpy).")
+        return
+    event_log.flush()
+    t0 = time.perf_counter()
+    try:
+        # requests.json читается в том же потоке, что и считается отчёт, — не на event loop
+        text = await asyncio.to_thread(lambda: analytics.report(event_log.path, days, load_requests()))
+    except Exception as e:
+        logger.error(f"[FUNNEL] {e!r}")
+        await message.reply(f"Не удалось посчитать воронку: {e}")
+        return
+    title = f"📈 Воронка за {parts[1]} дн." if days else "📈 Воронка за всё время"
+    await message.reply(f"{title}\n<pre>{escape(text)}</pre>\n({time.perf_counter() - t0:.2f} с)")
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """
+    /profile [секунды] — семплирующий профайлер event loop на заданное окно (по умолчанию 10 с).
+    Результат (топ функций и collapsed stacks) уходит документами в лог-темы админ-чатов.
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    args = (message.text or "").split()[1:]
+    try:
+        seconds = float(args[0]) if args else 10.0
+    except ValueError:
+        await message.reply("Использование: /profile [секунды]")
+        return
+    seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+    await message.reply(f"🔬 Профилирую {seconds:.0f} с, результат придёт в лог-тему.")
+    # окно профилирования не занимает слот обработки апдейтов
+    task = asyncio.create_task(_run_profile(message, seconds))
+    profile_tasks.add(task)
+    task.add_done_callback(profile_tasks.discard)
+
+
+async def _run_profile(message: Message, seconds: float) -> None:
+    try:
+        prof = await run_profiler(seconds)
+    except ProfileBusy as e:
+        await message.reply(f"⚠️ {e}")
+        return
+    except Exception as e:
+        logger.error(f"[PROFILE] ошибка профилирования: {e}")
+        return
+    summary = prof.summary()
+    stamp = int(time.time())
+    logger.info(f"[PROFILE] {summary.splitlines()[0]}")
+    caption = f"/profile {seconds:.0f}s от {message.from_user.id}\n{escape(summary.splitlines()[0])}"
+    for admin_chat in ADMIN_CHAT_IDS:
+        thread_id = get_log_thread_for_chat(admin_chat)
+        try:
+            await bot.send_document(
+                chat_id=admin_chat,
+                document=BufferedInputFile(summary.encode("utf-8"), filename=f"profile_{stamp}_top.txt"),
+                caption=caption,
+                message_thread_id=thread_id,
+            )
+            await bot.send_document(
+                chat_id=admin_chat,
+                document=BufferedInputFile(prof.collapsed().encode("utf-8"), filename=f"profile_{stamp}.collapsed.txt"),
+                message_thread_id=thread_id,
+            )
+        except Exception as e:
+            logger.warning(f"[PROFILE] не удалось отправить профиль в {admin_chat}: {e}")
+
+
+@dp.message(Command("trace"))
+async def cmd_trace(message: Message):
+    """
+    /trace — самые медленные недавние заявки; /trace all | /trace <хендлер> — среди всех трасс или одного хендлера;
+    /trace <id> — шаги одной трассы (id есть в строках лога).
+    """
+    if message.from_user.id not in ALL_ADMINS_SET:
+        return
+    args = (message.text or "").split()[1:]
+    arg = args[0] if args else "submission"
+    trace = TRACES.get(arg)
+    if trace is not None:
+        text = trace.format()
+        if len(text) > 3500:
+            await message.reply_document(BufferedInputFile(text.encode("utf-8"), filename=f"trace_{trace.id}.txt"))
+        else:
+            await message.reply(f"<pre>{escape(text)}</pre>")
+        return
+    traces = TRACES.slowest(None if arg == "all" else arg, 10)
+    if not traces:
+        await message.reply(f"Трасс «{escape(arg)}» нет (в буфере {TRACES.stats()['kept']}).")
+        return
+    lines = [f"🐢 Самые медленные трассы «{escape(arg)}» из последних {TRACES.stats()['kept']}:"]
+    for t in traces:
+        top = sorted(t.spans, key=lambda s: s[2], reverse=True)[:3]
+        steps = ", ".join(f"{escape(name)} {duration * 1000:.0f}" for name, _, duration, _ in top)
+        user = t.attrs.get("user", "-")
+        lines.append(f"• {t.duration * 1000:.0f} мс — <code>{t.id}</code> {escape(t.name)} user={user} {t.status} ({steps})")
+    await message.reply("\n".join(lines))
+
+
 # ===================== ПРИЁМ ЗАЯВОК (с копированием) =====================
 
 
 async def handle_submission(messages: Union[Message, List[Message]]):
+    # выполняется в своей задаче (коллектор / досылка при остановке) — метка не затрагивает хендлер
+    api_path.set("handle_submission")
     first_message: Message = messages[0] if isinstance(messages, list) else messages
     if not await ensure_private_and_autoleave(first_message):
         return
@@ -1209,7 +2117,7 @@ async def handle_submission(messages: Union[Message, List[Message]]):
     user_id_str = str(user.id)
 
     if is_banned(user.id):
-        remove_request(user_id_str)
+        await remove_request(user_id_str)
         submission_buffers.pop(user_id_str, None)
         task = collecting_tasks.pop(user_id_str, None)
         if task and not task.done():
@@ -1223,10 +2131,10 @@ async def handle_submission(messages: Union[Message, List[Message]]):
             pass
         return
 
-    async with user_submission_locks[user_id_str]:
+    async with user_submission_locks.hold(user_id_str):
         if not has_active_request(user_id_str):
             return
-        update_user_lang(user_id_str, user.language_code or "unknown")
+        await update_user_lang(user_id_str, user.language_code or "unknown")
 
         safe_full_name = escape(user.full_name or "(без имени)")
         safe_username = f"@{escape(user.username)}" if user.username else ""
@@ -1242,53 +2150,61 @@ async def handle_submission(messages: Union[Message, List[Message]]):
             ]
         )
 
+        headers: Dict[str, int] = {}
         try:
             # Для каждого admin chat отправляем копии и шапку (в topic, если задан или можно создать)
             for admin_chat in ADMIN_CHAT_IDS:
-                # NEW: ensure or create thread for submissions (if ADMIN_THREAD_NAMES provided)
-                thread_id = await ensure_or_create_topic_for_chat(admin_chat)
-
-                if isinstance(messages, list):
-                    album_msgs: List[Message] = sorted(messages, key=lambda m: m.message_id)
-                    media_group_ids = {getattr(m, "media_group_id", None) for m in album_msgs}
-                    if len(media_group_ids) == 1 and next(iter(media_group_ids)) is not None:
-                        for m in album_msgs:
-                            res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
-                            set_admin_map(admin_chat, res.message_id, int(user.id))
-                        header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
-                        set_admin_map(admin_chat, header_msg.message_id, int(user.id))
-                    else:
-                        media_group = []
-                        for i, m in enumerate(album_msgs):
-                            caption = getattr(m, "html_text", None) or getattr(m, "caption_html", None) or None
-                            cap = caption if i == 0 else None
-                            if m.photo:
-                                file_id = m.photo[-1].file_id
-                                media_group.append(InputMediaPhoto(media=file_id, caption=cap, parse_mode="HTML"))
-                            elif m.video:
-                                media_group.append(InputMediaVideo(media=m.video.file_id, caption=cap, parse_mode="HTML"))
-                            elif getattr(m, "document", None):
-                                media_group.append(InputMediaDocument(media=m.document.file_id, caption=cap, parse_mode="HTML"))
-                            elif getattr(m, "audio", None):
-                                media_group.append(InputMediaAudio(media=m.audio.file_id, caption=cap, parse_mode="HTML"))
-                            else:
+                with span(f"fanout.{admin_chat}"):
+                    # NEW: ensure or create thread for submissions (if ADMIN_THREAD_NAMES provided)
+                    thread_id = await ensure_or_create_topic_for_chat(admin_chat)
+
+                    if isinstance(messages, list):
+                        album_msgs: List[Message] = sorted(messages, key=lambda m: m.message_id)
+                        media_group_ids = {getattr(m, "media_group_id", None) for m in album_msgs}
+                        if len(media_group_ids) == 1 and next(iter(media_group_ids)) is not None:
+                            for m in album_msgs:
                                 res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
-                                set_admin_map(admin_chat, res.message_id, int(user.id))
-                        if media_group:
-                            sent = await bot.send_media_group(chat_id=admin_chat, media=media_group, message_thread_id=thread_id)
-                            for s in sent:
-                                set_admin_map(admin_chat, s.message_id, int(user.id))
+                                await set_admin_map(admin_chat, res.message_id, int(user.id))
                             header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
-                            set_admin_map(admin_chat, header_msg.message_id, int(user.id))
-                else:
-                    res = await bot.copy_message(chat_id=admin_chat, from_chat_id=first_message.chat.id, message_id=first_message.message_id, message_thread_id=thread_id)
-                    set_admin_map(admin_chat, res.message_id, int(user.id))
-                    header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
-                    set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                            await set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                            headers[str(admin_chat)] = header_msg.message_id
+                        else:
+                            media_group = []
+                            for i, m in enumerate(album_msgs):
+                                caption = getattr(m, "html_text", None) or getattr(m, "caption_html", None) or None
+                                cap = caption if i == 0 else None
+                                if m.photo:
+                                    file_id = m.photo[-1].file_id
+                                    media_group.append(InputMediaPhoto(media=file_id, caption=cap, parse_mode="HTML"))
+                                elif m.video:
+                                    media_group.append(InputMediaVideo(media=m.video.file_id, caption=cap, parse_mode="HTML"))
+                                elif getattr(m, "document", None):
+                                    media_group.append(InputMediaDocument(media=m.document.file_id, caption=cap, parse_mode="HTML"))
+                                elif getattr(m, "audio", None):
+                                    media_group.append(InputMediaAudio(media=m.audio.file_id, caption=cap, parse_mode="HTML"))
+                                else:
+                                    res = await bot.copy_message(chat_id=admin_chat, from_chat_id=m.chat.id, message_id=m.message_id, message_thread_id=thread_id)
+                                    await set_admin_map(admin_chat, res.message_id, int(user.id))
+                            if media_group:
+                                sent = await bot.send_media_group(chat_id=admin_chat, media=media_group, message_thread_id=thread_id)
+                                for s in sent:
+                                    await set_admin_map(admin_chat, s.message_id, int(user.id))
+                                header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
+                                await set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                                headers[str(admin_chat)] = header_msg.message_id
+                    else:
+                        res = await bot.copy_message(chat_id=admin_chat, from_chat_id=first_message.chat.id, message_id=first_message.message_id, message_thread_id=thread_id)
+                        await set_admin_map(admin_chat, res.message_id, int(user.id))
+                        header_msg = await bot.send_message(admin_chat, text=header, reply_markup=admin_keyboard, message_thread_id=thread_id)
+                        await set_admin_map(admin_chat, header_msg.message_id, int(user.id))
+                        headers[str(admin_chat)] = header_msg.message_id
 
             # уведомляем пользователя и помечаем заявку
             await bot.send_message(chat_id=user.id, text="✅ Ваша заявка отправлена администраторам.\nОжидайте ответа.")
-            mark_submitted(user_id_str)
+            with span("mark_submitted"):
+                await mark_submitted(user_id_str, headers)
+            bot_metrics.event("submission")
+            event_log.record(user.id, "handle_submission")
 
         except TelegramBadRequest as e:
             logger.warning(f"[BAD_REQUEST] {e!r}")
@@ -1299,15 +2215,15 @@ async def handle_submission(messages: Union[Message, List[Message]]):
 
 
 # Новый обработчик: собирает сообщения от пользователя в буфер и запускает задачу-коллектор
-@dp.message(F.chat.type == "private")
+# (регистрируется в конце раздела хендлеров, см. «CATCH-ALL»)
 async def collect_user_messages(message: Message):
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     # можно логировать отправку сообщений пользователем (необязательно)
     # await log_user_action(message, "Отправил сообщение в личку")
 
     if is_banned(message.from_user.id):
-        remove_request(str(message.from_user.id))
+        await remove_request(str(message.from_user.id))
         submission_buffers.pop(str(message.from_user.id), None)
         task = collecting_tasks.pop(str(message.from_user.id), None)
         if task and not task.done():
@@ -1340,22 +2256,27 @@ async def collect_user_messages(message: Message):
         return
 
     async def _collector(uid: str):
-        await asyncio.sleep(3)
-        msgs = submission_buffers.pop(uid, [])
-        collecting_tasks.pop(uid, None)
-        if not msgs:
-            return
-        if len(msgs) == 1:
-            await handle_submission(msgs[0])
-        else:
-            await handle_submission(msgs)
+        # трасса заявки; родитель — трасса апдейта, начавшего сбор (контекст задачи наследуется)
+        with start_trace("submission", user=uid) as trace:
+            with span("collect.wait"):
+                await asyncio.sleep(3)
+            msgs = submission_buffers.pop(uid, [])
+            collecting_tasks.pop(uid, None)
+            trace.attrs["messages"] = len(msgs)
+            if not msgs:
+                return
+            if len(msgs) == 1:
+                await handle_submission(msgs[0])
+            else:
+                await handle_submission(msgs)
 
     task = asyncio.create_task(_collector(user_id_str))
     collecting_tasks[user_id_str] = task
+    inflight_submissions.add(task)
+    task.add_done_callback(inflight_submissions.discard)
 
 
 # ===================== АДМИН: ответ reply -> пользователю =====================
-@dp.message(F.chat.id.in_(ADMIN_CHAT_IDS) if ADMIN_CHAT_IDS else F.chat.id == ADMIN_CHAT_ID)
 async def admin_reply_handler(message: Message):
     # разрешаем только админам
     if message.from_user.id not in ALL_ADMINS_SET:
@@ -1365,6 +2286,7 @@ async def admin_reply_handler(message: Message):
         return
 
     replied = message.reply_to_message
+    _refresh_shared_maps()
     key = _admin_map_key(replied.chat.id, replied.message_id)
     target_user_id = admin_message_to_user.get(key)
     if not target_user_id:
@@ -1375,7 +2297,7 @@ async def admin_reply_handler(message: Message):
     if not target_user_id:
         return
 
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
 
     if is_banned(target_user_id):
         await message.reply("⚠️ Этот пользователь заблокирован. Ответ не отправлен.", quote=False)
@@ -1403,7 +2325,6 @@ async def on_added(event: ChatMemberUpdated):
             logger.error(f"Не удалось выйти из чата {event.chat.id}: {e}")
 
 
-@dp.message(F.chat.type.in_(["group", "supergroup", "channel"]))
 async def leave_any_group(message: Message):
     if message.chat.id not in ADMIN_CHAT_IDS:
         try:
@@ -1449,6 +2370,9 @@ async def handle_successful_payment(message: Message):
     try:
         if telegram_charge_id:
             saved = await save_transaction(user_id=user_id, charge_id=telegram_charge_id, payload=invoice_payload, amount=total_amount, currency=currency)
+            if saved:
+                bot_metrics.event("payment")
+                event_log.record(user_id, "successful_payment")
             if not saved:
                 logger.info(f"Transaction {telegram_charge_id} already exists in {TRANSACTIONS_FILE}")
         else:
@@ -1499,6 +2423,7 @@ async def handle_successful_payment(message: Message):
             res = await refund_star_payment(user_id=user_id, telegram_payment_charge_id=telegram_charge_id)
             if res.get("ok"):
                 await mark_transaction_refunded(telegram_charge_id)
+                event_log.record(int(user_id), "refund")
                 try:
                     await bot.send_message(chat_id=user_id, text="⚠️ При генерации ссылки на чат произошла ошибка. Звезды возвращены.")
                 except Exception:
@@ -1529,12 +2454,15 @@ async def handle_successful_payment(message: Message):
 
 # ------------------ CALLBACK: выдать доступ к оплате (создание invoice для XTR) ------------------
 @dp.callback_query(F.data.startswith("grantpay_"))
+@single_flight_decision("grantpay")
 async def grant_payment_access(callback: CallbackQuery):
     """
     Админ нажал 'выдать доступ к оплате' — отправляем пользователю invoice (Stars, currency=XTR).
     payload = "uid::<user_id>" чтобы связать оплату с пользователем при успешной оплате.
     """
-    update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
+    if await answer_if_decided(callback):
+        return
+    await update_user_lang(str(callback.from_user.id), callback.from_user.language_code or "unknown")
 
     if callback.message.chat.id not in ADMIN_CHAT_IDS:
         await callback.answer("⚠️ Эта кнопка доступна только в админ-чатах.", show_alert=True)
@@ -1551,6 +2479,7 @@ async def grant_payment_access(callback: CallbackQuery):
     except Exception:
         await callback.message.answer("Неверный user id в callback.")
         return
+    event_log.record(uid, "grantpay")
 
     cfg = load_config()
     stars_price = int(cfg.get("price_stars", 100))
@@ -1575,6 +2504,12 @@ async def grant_payment_access(callback: CallbackQuery):
             currency="XTR",
             prices=price,
         )
+        bot_metrics.event("invoice")
+        # решение фиксируется и кнопки снимаются только после отправленного счёта:
+        # при ошибке заявка остаётся в очереди, и админ может нажать ещё раз
+        observe_decision(uid, "grantpay")
+        await mark_decided(user_id_str, "grantpay")
+        mirror_decision(callback, uid, "grantpay")
         # Отправка invoice успешно — логируем факт отправки invoice в admin chat (лог-тема)
         for admin_chat in ADMIN_CHAT_IDS:
             try:
@@ -1592,7 +2527,7 @@ async def grant_payment_access(callback: CallbackQuery):
             await callback.message.answer(f"Ошибка при отправке инвойса пользователю {uid}: {e}")
         except Exception:
             pass
-        return
+        return False
 
     try:
         await callback.message.answer(f"Инвойс отправлен пользователю {uid} ({stars_price}⭐️).")
@@ -1607,7 +2542,7 @@ async def cmd_refund(message: Message):
     /refund <telegram_payment_charge_id>  -> вернуть звёзды по id операции, который дал Telegram
     Доступно только для админов.
     """
-    update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
+    await update_user_lang(str(message.from_user.id), message.from_user.language_code or "unknown")
     await log_user_action(message, f"Команда /refund ({message.text})")
 
     if message.from_user.id not in ALL_ADMINS_SET:
@@ -1639,6 +2574,7 @@ async def cmd_refund(message: Message):
         result = await refund_star_payment(int(user_id_for_refund), charge_id)
         if result.get("ok"):
             await mark_transaction_refunded(charge_id)
+            event_log.record(int(user_id_for_refund), "refund")
             await message.reply("✅ Возврат выполнен успешно.")
             # уведомляем пользователя
             try:
@@ -1663,18 +2599,139 @@ async def cmd_refund(message: Message):
         logger.error(f"[REFUND ERROR] {e}")
 
 
+# ===================== CATCH-ALL =====================
+# Хендлеры «всё остальное» в личке, админ-чатах и группах — строго после всех остальных message-хендлеров
+# (aiogram проверяет их в порядке регистрации): иначе successful_payment и /refund до своих хендлеров не доходят.
+dp.message.register(collect_user_messages, F.chat.type == "private")
+dp.message.register(admin_reply_handler, F.chat.id.in_(ADMIN_CHAT_IDS) if ADMIN_CHAT_IDS else F.chat.id == ADMIN_CHAT_ID)
+dp.message.register(leave_any_group, F.chat.type.in_(["group", "supergroup", "channel"]))
+
+
+# ===================== SHUTDOWN =====================
+
+def flush_submission_buffers() -> None:
+    """
+    Досылает накопленные буферы заявок сразу, не дожидаясь окна коллектора.
+    Спящие коллекторы отменяются, вместо них запускается handle_submission.
+    """
+    for uid, task in list(collecting_tasks.items()):
+        if not task.done():
+            task.cancel()
+    collecting_tasks.clear()
+    for uid, msgs in list(submission_buffers.items()):
+        submission_buffers.pop(uid, None)
+        if not msgs:
+            continue
+        task = asyncio.create_task(handle_submission(msgs[0] if len(msgs) == 1 else msgs))
+        inflight_submissions.add(task)
+        task.add_done_callback(inflight_submissions.discard)
+
+
+# ===================== SLA: напоминания о просроченных заявках =====================
+
+sla_task: Optional[asyncio.Task] = None
+
+
+async def sla_reminders() -> None:
+    """
+    Раз в SLA_CHECK_SECONDS — просроченные заявки из очереди (префикс индекса по submitted_at, без перебора
+    заявок) одним сообщением в лог-тему каждого админ-чата. Напоминание уходит, если с прошлого появились
+    новые просроченные, иначе — не чаще раза в SLA_REMIND_HOURS.
+    """
+    reminded_until = ""  # submitted_at, до которого просроченные уже попадали в напоминание
+    last_sent = 0.0
+    while True:
+        await asyncio.sleep(SLA_CHECK_SECONDS)
+        try:
+            _refresh_read_views()
+            cutoff = (_now() - timedelta(hours=SLA_OVERDUE_HOURS)).isoformat()
+            overdue = request_index.overdue(cutoff)
+            fresh = len(overdue) - bisect_left(overdue, (reminded_until,))
+            if not overdue or (not fresh and time.monotonic() - last_sent < SLA_REMIND_HOURS * 3600):
+                continue
+            reminded_until, last_sent = cutoff, time.monotonic()
+            head = f"⏰ Без решения дольше {SLA_OVERDUE_HOURS:g} ч: {len(overdue)}"
+            if fresh != len(overdue):
+                head += f" (новых с прошлого напоминания: {fresh})"
+            for admin_chat in ADMIN_CHAT_IDS:
+                lines = [head] + [_queue_line(n, at, uid, admin_chat)
+                                  for n, (at, uid) in enumerate(overdue[:SLA_REMIND_LIMIT], 1)]
+                if len(overdue) > SLA_REMIND_LIMIT:
+                    lines.append(f"…и ещё {len(overdue) - SLA_REMIND_LIMIT}, вся очередь — /queue")
+                thread_id = get_log_thread_for_chat(admin_chat)
+                token = api_path.set("sla_reminders")
+                admin_log_outbox.put(lambda c=admin_chat, t=thread_id, text="\n".join(lines): _send_log_message(c, t, text))
+                api_path.reset(token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[SLA] {e!r}")
+
+
+def persist_stores() -> None:
+    with storage_lock():
+        # в шардированном режиме файлы могли измениться другими воркерами — не затираем их
+        _refresh_shared_maps()
+        save_admin_map(admin_message_to_user)
+        save_admin_topics(admin_topics_map)
+        save_rejected(rejected_users)
+    bot_metrics.stats.save(STATS_FILE)
+    event_log.flush()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    Вызывается aiogram после остановки polling (SIGTERM/SIGINT) — новые апдейты уже не принимаются.
+    Сессия бота закрывается aiogram после этого хука.
+    """
+    report = ShutdownReport()
+    logger.info("[SHUTDOWN] polling остановлен, завершаем обработку...")
+    # принятые апдейты: очередь лимитера и хендлеры, которые ещё выполняются
+    await report.drain("updates", update_limiter.drain)
+    await report.wait_tasks("handlers", handler_tasks)
+    # буферы заявок -> рассылка в админ-чаты
+    flush_submission_buffers()
+    await report.wait_tasks("submissions", inflight_submissions)
+    if sla_task is not None:
+        sla_task.cancel()
+    # очередь логов в админ-чаты
+    await report.drain("admin_log", admin_log_outbox.drain)
+    await report.drain("decision_mirror", decision_outbox.drain)
+    report.run_sync("stores", persist_stores)
+    report.log_summary()
+    await stop_metrics_server()
+    report.run_sync("logs", flush_logging)
+
+
 # ===================== MAIN =====================
-async def main():
+async def on_startup():
+    global sla_task
     logger.info(f"[BOOT] ADMIN_CHAT_IDS={ADMIN_CHAT_IDS}, ADMIN_THREAD_IDS={ADMIN_THREAD_IDS}, ADMIN_THREAD_NAMES={ADMIN_THREAD_NAMES}, ADMIN_LOG_THREAD_IDS={ADMIN_LOG_THREAD_IDS}, MAIN_ADMIN_IDS={MAIN_ADMIN_IDS}, ADMINS={ADMINS}")
     # init transactions db
     await init_transactions()
+    await start_metrics_server()
+    loop_monitor.start()
     # Попытка заранее создать темы, которые указаны в ADMIN_THREAD_NAMES и ещё не сохранены
+    # (в шардированном режиме — только шард 0, остальные подхватят темы из файла)
+    if SHARDED and SHARD_INDEX != 0:
+        return
+    # напоминания о просроченных заявках — один воркер на все шарды
+    sla_task = asyncio.create_task(sla_reminders())
     for admin_chat in ADMIN_CHAT_IDS:
         try:
             await ensure_or_create_topic_for_chat(admin_chat)
         except Exception:
             pass
-    await dp.start_polling(bot)
+
+
+# хуки регистрируются при импорте, чтобы host.py мог запускать dp без main()
+dp.startup.register(on_startup)
+dp.startup.register(notify_ready)
+dp.shutdown.register(on_shutdown)
+
+
+async def main():
+    await dp.start_polling(bot, **POLLING_KWARGS)
 
 
 if __name__ == "__main__":
@@ -1682,6 +2739,3 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Shutting down...")
-
-if __name__ == "__main__":
-    asyncio.run(main())
@@ -1,10 +1,16 @@
 import os
 import json
+import time
 import logging
 import tempfile
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.request import HTTPXRequest
+
+from logsetup import setup_logging
+from metrics import METRICS_API_BYTES, ApiCallMetrics, estimate_values_size
+from supervisor import notify_ready
 
 # Загружаем переменные окружения из .env.sup
 load_dotenv(dotenv_path=".env.sup")
@@ -14,10 +20,47 @@ ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID"))
 DB_PATH = os.getenv("DB_PATH", "mappings.json")
 THREAD_ID = os.getenv("THREAD_ID")
 THREAD_ID = int(THREAD_ID) if THREAD_ID else None
+# TELEGRAM_API_BASE — локальный Bot API сервер или фейковый bench/fake_api.py для нагрузочных тестов
+API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
 
-logging.basicConfig(level=logging.INFO)
+setup_logging("")
 logger = logging.getLogger(__name__)
 
+api_metrics = ApiCallMetrics("sup", [ADMIN_GROUP_ID])
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest с учётом вызовов Bot API (метрики bot_api_* как у aiogram-ботов)."""
+
+    @staticmethod
+    def _request_size(request_data, params) -> int:
+        # json_payload заново сериализует запрос — только при METRICS_API_BYTES=exact, как в ApiCallMetrics
+        if request_data is None or METRICS_API_BYTES == "off":
+            return 0
+        if METRICS_API_BYTES == "exact":
+            return len(request_data.json_payload)
+        return estimate_values_size(params.values())
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        chat_id = params.get("chat_id")
+        sent = self._request_size(request_data, params)
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            api_metrics.record(api_method, chat_id, type(e).__name__, time.perf_counter() - t0, sent)
+            raise
+        retry_after = 0
+        if code == 429:
+            try:
+                retry_after = int(json.loads(payload)["parameters"]["retry_after"])
+            except Exception:
+                pass
+        api_metrics.record(api_method, chat_id, "ok" if code == 200 else str(code), time.perf_counter() - t0, sent, retry_after)
+        return code, payload
+
 # ------------------ Работа с JSON DB ------------------
 def load_db():
     if not os.path.exists(DB_PATH):
@@ -106,17 +149,34 @@ async def get_group_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ------------------ main ------------------
-def main():
+async def post_init(app: Application):
+    notify_ready()
+
+
+def build_application() -> Application:
     if not BOT_TOKEN or not ADMIN_GROUP_ID:
         raise RuntimeError("BOT_TOKEN3 и ADMIN_GROUP_ID должны быть заданы в .env.sup")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{API_BASE}/bot")
+        .base_file_url(f"{API_BASE}/file/bot")
+        .request(MeteredRequest(connection_pool_size=256))
+        .get_updates_request(MeteredRequest())
+        .post_init(post_init)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("get_group_id", get_group_id))
     app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, forward_to_group))
     app.add_handler(MessageHandler(filters.ChatType.SUPERGROUP & ~filters.COMMAND, reply_from_admin))
+    return app
 
+
+def main():
+    app = build_application()
     logger.info("Bot started")
     app.run_polling()
 
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from shutdown import SHUTDOWN_TIMEOUT
+
+# Супервизор ботов: вместо tmux-окон из prem.sh.
+# Запуск: python3 supervisor.py [n.py sup.py ...]  (по умолчанию — SUPERVISOR_BOTS или n.py,sup.py)
+
+logger = logging.getLogger("supervisor")
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(DIR, "logs")
+PYTHON = os.getenv("PYTHON", sys.executable)
+
+BACKOFF_BASE = float(os.getenv("SUPERVISOR_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("SUPERVISOR_BACKOFF_MAX", "60"))
+# сколько процесс должен проработать, чтобы счётчик рестартов сбросился
+STABLE_AFTER = float(os.getenv("SUPERVISOR_STABLE_AFTER", "60"))
+# сколько ждать сигнала готовности от ребёнка (notify_ready) до признания запуска неудачным
+READY_TIMEOUT = float(os.getenv("SUPERVISOR_READY_TIMEOUT", "30"))
+STATS_INTERVAL = float(os.getenv("SUPERVISOR_STATS_INTERVAL", "60"))
+STOP_TIMEOUT = SHUTDOWN_TIMEOUT + 5
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# ===================== READY NOTIFICATION (вызывается из ботов) =====================
+
+def notify_ready() -> None:
+    """
+    Сообщает супервизору, что бот поднялся (вызывать из startup-хука).
+    Без супервизора (переменная не задана) ничего не делает.
+    """
+    path = os.getenv("SUPERVISOR_READY_FILE")
+    if not path:
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+    except Exception as e:
+        logger.warning(f"Не удалось записать ready-файл {path}: {e}")
+
+
+# ===================== /proc STATS =====================
+
+def _read_proc_stats(pid: int) -> Optional[Dict[str, float]]:
+    """cpu-время (сек) и RSS (байты) процесса из /proc; None, если недоступно."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # comm может содержать пробелы — режем по последней ')'
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm", "r") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    utime, stime = int(fields[11]), int(fields[12])
+    return {"cpu": (utime + stime) / _CLK_TCK, "rss": rss_pages * _PAGE_SIZE}
+
+
+# ===================== CHILD =====================
+
+class Child:
+    def __init__(self, script: str):
+        self.script = script
+        self.name = os.path.splitext(os.path.basename(script))[0]
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.failures = 0
+        self.started_at = 0.0
+        self.ready = False
+        self.ready_file = os.path.join(LOG_DIR, f"{self.name}.ready")
+        self._last_cpu: Optional[float] = None
+        self._last_ts = 0.0
+
+    def backoff(self) -> float:
+        return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, self.failures - 1)))
+
+    async def spawn(self) -> None:
+        try:
+            os.remove(self.ready_file)
+        except FileNotFoundError:
+            pass
+        env = dict(os.environ, SUPERVISOR_READY_FILE=self.ready_file, PYTHONUNBUFFERED="1")
+        log = open(os.path.join(LOG_DIR, f"{self.name}.log"), "ab")
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                PYTHON, self.script, cwd=DIR, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT,
+            )
+        finally:
+            log.close()
+        self.started_at = time.monotonic()
+        self.ready = False
+        self._last_cpu = None
+        logger.info(f"[SUP] {self.name}: запущен pid={self.proc.pid}")
+
+    async def wait_ready(self) -> bool:
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.proc.returncode is not None:
+                return False
+            if os.path.exists(self.ready_file):
+                self.ready = True
+                logger.info(f"[SUP] {self.name}: готов за {time.monotonic() - self.started_at:.1f}s")
+                return True
+            await asyncio.sleep(0.2)
+        return False
+
+    def stats(self) -> Optional[str]:
+        if not self.proc or self.proc.returncode is not None:
+            return None
+        st = _read_proc_stats(self.proc.pid)
+        if st is None:
+            return None
+        now = time.monotonic()
+        cpu_pct = 0.0
+        if self._last_cpu is not None and now > self._last_ts:
+            cpu_pct = 100.0 * (st["cpu"] - self._last_cpu) / (now - self._last_ts)
+        self._last_cpu, self._last_ts = st["cpu"], now
+        return (
+            f"{self.name} pid={self.proc.pid} cpu={cpu_pct:.1f}% rss={st['rss'] / 1048576:.1f}MB "
+            f"uptime={now - self.started_at:.0f}s restarts={self.restarts}"
+        )
+
+    async def terminate(self, sig: int = signal.SIGTERM) -> None:
+        if not self.proc or self.proc.returncode is not None:
+            return
+        try:
+            self.proc.send_signal(sig)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout=STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"[SUP] {self.name}: не завершился за {STOP_TIMEOUT:.0f}s, SIGKILL")
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+            await self.proc.wait()
+
+
+# ===================== SUPERVISOR =====================
+
+class Supervisor:
+    def __init__(self, scripts: List[str]):
+        self.children = [Child(s) for s in scripts]
+        self.stopping = asyncio.Event()
+        # задачи остановки из обработчика сигнала: без ссылки event loop может собрать их сборщиком мусора
+        self._terminating: set = set()
+
+    async def _run_child(self, child: Child) -> None:
+        while not self.stopping.is_set():
+            try:
+                await child.spawn()
+            except Exception as e:
+                logger.error(f"[SUP] {child.name}: не удалось запустить: {e}")
+                child.failures += 1
+            else:
+                if not await child.wait_ready() and child.proc.returncode is None and not self.stopping.is_set():
+                    logger.warning(f"[SUP] {child.name}: нет готовности за {READY_TIMEOUT:.0f}s, перезапуск")
+                    await child.terminate()
+                code = await child.proc.wait()
+                if self.stopping.is_set():
+                    logger.info(f"[SUP] {child.name}: остановлен (код {code})")
+                    return
+                uptime = time.monotonic() - child.started_at
+                child.failures = 1 if uptime >= STABLE_AFTER else child.failures + 1
+                logger.warning(f"[SUP] {child.name}: завершился с кодом {code} через {uptime:.1f}s")
+            child.restarts += 1
+            delay = child.backoff()
+            logger.info(f"[SUP] {child.name}: перезапуск через {delay:.1f}s (рестартов: {child.restarts})")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _report_stats(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=STATS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self.stopping.is_set():
+                return
+            for child in self.children:
+                line = child.stats()
+                if line:
+                    logger.info(f"[SUP] {line}")
+
+    def _on_signal(self, sig: signal.Signals) -> None:
+        if self.stopping.is_set():
+            return
+        logger.info(f"[SUP] получен {sig.name}, останавливаем ботов...")
+        self.stopping.set()
+        for child in self.children:
+            task = asyncio.create_task(child.terminate(signal.SIGTERM))
+            self._terminating.add(task)
+            task.add_done_callback(self._terminating.discard)
+
+    async def run(self) -> None:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._on_signal, sig)
+        stats = asyncio.create_task(self._report_stats())
+        await asyncio.gather(*(self._run_child(c) for c in self.children))
+        stats.cancel()
+        if self._terminating:
+            await asyncio.gather(*self._terminating, return_exceptions=True)
+        logger.info("[SUP] все боты остановлены")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    scripts = sys.argv[1:] or [s.strip() for s in os.getenv("SUPERVISOR_BOTS", "n.py,sup.py").split(",") if s.strip()]
+    asyncio.run(Supervisor(scripts).run())
+
+
+if __name__ == "__main__":
+    main()
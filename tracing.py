@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Трассировка обработки: трасса на каждый вызов хендлера (ставит MetricsMiddleware) и на каждую
+# заявку (коллектор -> handle_submission -> рассылка -> mark_submitted). Спаны — шаги внутри трассы:
+# ожидание в очереди апдейтов, вызовы Bot API, операции хранилища, рассылка по админ-чатам.
+# id трассы попадает в каждую строку лога (logsetup.py). Завершённые трассы лежат в кольцевом
+# буфере TRACE_KEEP штук — их показывает админская команда /trace.
+
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "500"))
+MAX_SPANS = 200
+
+Span = Tuple[str, float, float, str]  # имя, начало от старта трассы, длительность, статус
+
+
+class Trace:
+    __slots__ = ("id", "name", "parent", "attrs", "started", "t0", "duration", "status", "spans", "dropped_spans")
+
+    def __init__(self, name: str, parent: Optional[str] = None, **attrs: Any):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+
+    def add_span(self, name: str, start: float, duration: float, status: str = "ok") -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, start - self.t0, duration, status))
+
+    def format(self) -> str:
+        at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started))
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        out = [f"trace {self.id} {self.name} {(self.duration or 0) * 1000:.1f}ms {self.status} at {at} {attrs}".rstrip()]
+        if self.parent:
+            out.append(f"parent {self.parent}")
+        for name, offset, duration, status in sorted(self.spans, key=lambda s: s[1]):
+            mark = "" if status == "ok" else f" [{status}]"
+            out.append(f"  +{offset * 1000:8.1f}ms {duration * 1000:8.1f}ms  {name}{mark}")
+        if self.dropped_spans:
+            out.append(f"  ... ещё {self.dropped_spans} спанов")
+        return "\n".join(out)
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+# ===================== RING BUFFER =====================
+
+class TraceBuffer:
+    def __init__(self, keep: int = TRACE_KEEP):
+        self.traces: Deque[Trace] = deque(maxlen=keep)
+        self.completed = 0
+
+    def add(self, trace: Trace) -> None:
+        self.traces.append(trace)
+        self.completed += 1
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        for t in reversed(self.traces):
+            if t.id == trace_id:
+                return t
+        return None
+
+    def slowest(self, name: Optional[str] = None, n: int = 10) -> List[Trace]:
+        items = [t for t in self.traces if name is None or t.name == name]
+        return sorted(items, key=lambda t: t.duration or 0, reverse=True)[:n]
+
+    def stats(self) -> Dict[str, int]:
+        return {"kept": len(self.traces), "completed": self.completed}
+
+
+TRACES = TraceBuffer()
+
+
+# ===================== API =====================
+
+def current_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.id if trace is not None else None
+
+
+@contextmanager
+def start_trace(name: str, **attrs: Any) -> Iterator[Trace]:
+    """Новая трасса в текущем контексте; родитель — трасса, в контексте которой она начата."""
+    trace = Trace(name, parent=current_id(), **attrs)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.status = type(e).__name__
+        raise
+    finally:
+        trace.duration = time.perf_counter() - trace.t0
+        current_trace.reset(token)
+        TRACES.add(trace)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, t0, time.perf_counter() - t0, status)
+
+
+def record_span(name: str, start: float, duration: float, status: str = "ok") -> None:
+    """Спан, измеренный вызывающим (start — perf_counter начала)."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, duration, status)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Декоратор синхронной функции (операции хранилища): спан, только если есть трасса."""
+    def wrap(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if current_trace.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
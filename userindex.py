@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from reqindex import RequestIndex
+
+# Вторичные индексы для /user: user_id -> сообщения в админ-чатах (admin_map.json),
+# charge_id -> транзакция и user_id -> charge_id (transactions.json); username -> user_id
+# берётся из индексов заявок (reqindex.py). Строятся один раз при старте и обновляются
+# в тех же функциях, что пишут хранилища, поэтому поиск по пользователю не перебирает файлы.
+
+
+class UserIndex:
+    def __init__(self, requests: RequestIndex):
+        self.requests = requests
+        self.admin_msgs: Dict[int, Dict[str, None]] = {}
+        self.tx_by_charge: Dict[str, Dict] = {}
+        self.tx_by_user: Dict[int, Dict[str, None]] = {}
+
+    # --------- сообщения в админ-чатах ---------
+
+    def load_admin_map(self, amap: Dict[str, int]) -> None:
+        self.admin_msgs = {}
+        for key, uid in amap.items():
+            self.add_admin_msg(key, uid)
+
+    def add_admin_msg(self, key: str, uid: int) -> None:
+        self.admin_msgs.setdefault(int(uid), {})[key] = None
+
+    def drop_admin_msg(self, key: str, uid: Optional[int]) -> None:
+        if uid is None:
+            return
+        keys = self.admin_msgs.get(int(uid))
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self.admin_msgs[int(uid)]
+
+    def admin_messages(self, uid: int) -> List[Tuple[int, int]]:
+        """(chat_id, message_id) сообщений бота об этом пользователе в админ-чатах."""
+        out = []
+        for key in self.admin_msgs.get(int(uid), ()):
+            chat_s, msg_s = key.split(":", 1)
+            out.append((int(chat_s), int(msg_s)))
+        return out
+
+    # --------- транзакции ---------
+
+    def load_transactions(self, records: Iterable[Dict]) -> None:
+        self.tx_by_charge = {}
+        self.tx_by_user = {}
+        for rec in records:
+            self.add_transaction(rec)
+
+    def add_transaction(self, rec: Dict) -> None:
+        charge = rec.get("telegram_payment_charge_id")
+        if not charge:
+            return
+        self.tx_by_charge[charge] = dict(rec)
+        try:
+            self.tx_by_user.setdefault(int(rec.get("user_id")), {})[charge] = None
+        except (TypeError, ValueError):
+            pass
+
+    def update_transaction(self, charge: str, **fields) -> None:
+        rec = self.tx_by_charge.get(charge)
+        if rec is not None:
+            rec.update(fields)
+
+    def transaction(self, charge: str) -> Optional[Dict]:
+        return self.tx_by_charge.get(charge)
+
+    def transactions(self, uid: int) -> List[Dict]:
+        return [self.tx_by_charge[c] for c in self.tx_by_user.get(int(uid), ()) if c in self.tx_by_charge]
+
+    # --------- разбор запроса /user ---------
+
+    def resolve(self, query: str) -> Tuple[Optional[int], str]:
+        """user_id по id, @username или charge_id; второй элемент — по какому индексу найден."""
+        q = query.strip()
+        if not q:
+            return None, ""
+        if q.lstrip("-").isdigit():
+            return int(q), "id"
+        if q.startswith("@"):
+            return self.requests.by_username(q), "username"
+        rec = self.tx_by_charge.get(q)
+        if rec is not None:
+            try:
+                return int(rec.get("user_id")), "charge_id"
+            except (TypeError, ValueError):
+                return None, "charge_id"
+        return self.requests.by_username(q), "username"